@@ -0,0 +1,537 @@
+"""Benchmarks for gc_attendance.
+
+Run the micro-benchmarks with: python benchmarks.py
+Run the workflow suite over growing datasets, checked against an earlier run, with:
+python benchmarks.py suite --sizes 1 2 5 10 --output new.json --baseline old.json
+Report the memory held by the model objects of a loaded semester with:
+python benchmarks.py memory
+"""
+
+import os
+import sys
+import subprocess
+import shutil
+import tempfile
+import timeit
+import json
+import argparse
+import resource
+import apsw
+try:
+	import tracemalloc	# Python 3.4+, or the pytracemalloc backport
+except ImportError:
+	tracemalloc = None
+from gc_attendance import *
+import datagen
+
+LOOKUPS = 100000
+# Seconds "import gc_attendance" may take in a fresh interpreter
+IMPORT_BUDGET = 0.25
+# Seconds a kiosk tap may take at the 99th percentile
+KIOSK_P99_BUDGET = 0.005
+# Modules that importing gc_attendance should leave for first use
+LAZY_MODULES = ['httplib2', 'apiclient', 'oauth2client', 'dateutil.parser']
+# Dataset sizes for the suite, in academic years
+SUITE_SIZES = [1, 2, 5, 10]
+# Fraction a workflow's throughput may drop against the baseline before it counts as a regression
+TOLERANCE = 0.2
+# Model classes counted by the memory report
+MODELS = (Student, Event, Signin, Excuse, Absence, Group, Organization)
+
+def setup_students(connection, count=2000):
+	cur = connection.cursor()
+	cur.executemany('INSERT INTO students VALUES (?,?,?,?,1,1)', [(10000 + i, 'First', 'Last', 'student%d@wpi.edu' % i) for i in range(count)])
+	cur.close()
+	return [10000 + (i * 7919) % count for i in range(LOOKUPS)]
+
+def select_by_id_unpooled(id, connection):
+	"""Student.select_by_id as it was before cursor reuse: a new cursor per call."""
+	
+	try:
+		cur = connection.cursor()
+		
+		rows = list(cur.execute('SELECT * FROM students WHERE id=?', (id,)))
+		student = None
+		if len(rows) == 1:
+			student = Student.new_from_row(rows[0])
+	
+	finally:
+		cur.close()
+		return student
+
+def bench_lookups():
+	"""100k Student.select_by_id calls, with a cursor per call vs. pooled cursors."""
+	
+	unpooled = apsw.Connection(':memory:')	# apsw's default statement cache
+	gcdb.create_tables(unpooled)
+	ids = setup_students(unpooled)
+	pooled = gcdb.connect(':memory:')
+	gcdb.create_tables(pooled)
+	setup_students(pooled)
+	
+	before = timeit.timeit(lambda: [select_by_id_unpooled(id, unpooled) for id in ids], number=1)
+	after = timeit.timeit(lambda: [Student.select_by_id(id, pooled) for id in ids], number=1)
+	print 'Student.select_by_id x %d: %.2f us/call before, %.2f us/call after (%.0f%% less)' % (
+		LOOKUPS, before / LOOKUPS * 1e6, after / LOOKUPS * 1e6, 100 * (1 - after / before))
+	unpooled.close()
+	pooled.close()
+
+def apply_roster_unbatched(group, rows, connection):
+	"""Group.apply_roster as it was before transactions: every write in autocommit."""
+	
+	for (rfid, fname, lname, email, credit) in rows:
+		student = Student(int(rfid), fname, lname, email)
+		if Student.select_by_id(student.rfid, connection) is None:
+			student.insert(connection)
+		else:
+			student.update(connection)
+		group.add_member(student, credit, connection)
+
+def bench_roster(count=2000):
+	"""A 2,000-row roster import into a disk DB, row by row in autocommit vs. in one transaction."""
+	
+	folder = tempfile.mkdtemp()
+	rows = [(20000 + i, 'First', 'Last', 'student%d@wpi.edu' % i, i % 2 == 0) for i in range(count)]
+	times = {}
+	try:
+		for batched in (False, True):
+			connection = gcdb.connect(os.path.join(folder, 'roster-%s.sqlite' % batched))
+			gcdb.create_tables(connection)
+			cur = connection.cursor()
+			cur.execute("INSERT INTO terms VALUES ('A11', '2011-08-25', '2011-10-13')")
+			cur.execute("INSERT INTO terms VALUES ('B11', '2011-10-25', '2011-12-15')")
+			cur.execute("INSERT INTO semesters VALUES ('fall_2011', 'A11', 'B11')")
+			cur.execute("INSERT INTO organizations VALUES ('Glee Club', NULL)")
+			cur.execute("INSERT INTO groups VALUES (1, 'Glee Club', 'fall_2011', 'Glee Club Fall 2011', NULL)")
+			cur.close()
+			group = Group(1, None, None, 'Glee Club Fall 2011')
+			if batched:
+				times[batched] = timeit.timeit(lambda: group.apply_roster(rows, connection), number=1)
+			else:
+				times[batched] = timeit.timeit(lambda: apply_roster_unbatched(group, rows, connection), number=1)
+			connection.close()
+	finally:
+		shutil.rmtree(folder)
+	print 'Roster import of %d rows on disk: %.2fs in autocommit, %.2fs in one transaction (%.0fx)' % (
+		count, times[False], times[True], times[False] / times[True])
+
+def bench_roster_import(count=300, groups=3):
+	"""A 300-member roster workbook, one sheet per Group, imported and then re-imported with a few changes."""
+	
+	folder = tempfile.mkdtemp()
+	try:
+		connection = gcdb.connect(os.path.join(folder, 'rosters.sqlite'))
+		gcdb.create_tables(connection)
+		cur = connection.cursor()
+		cur.execute("INSERT INTO terms VALUES ('A11', '2011-08-25', '2011-10-13')")
+		cur.execute("INSERT INTO terms VALUES ('B11', '2011-10-25', '2011-12-15')")
+		cur.execute("INSERT INTO semesters VALUES ('fall_2011', 'A11', 'B11')")
+		sheets = {}
+		for g in range(groups):
+			cur.execute("INSERT INTO groups VALUES (?, NULL, 'fall_2011', ?, NULL)", (g + 1, 'Group %d' % (g + 1)))
+			sheets['Group %d' % (g + 1)] = Group(g + 1, None, None, 'Group %d' % (g + 1))
+		cur.close()
+		
+		def workbook(path, edited):
+			rows = dict((name, [datagen.ROSTER_HEADER]) for name in sheets)
+			for i in range(count):
+				email = 'student%d@wpi.edu' % i
+				if edited and i % 50 == 0:
+					email = 'changed%d@wpi.edu' % i
+				if not (edited and i % 75 == 1):
+					rows['Group %d' % (i % groups + 1)].append([str(20000 + i), 'First', 'Last', email, 'N', 'Y' if (i % 2 == 0) != (edited and i % 60 == 0) else 'N', 'N'])
+			datagen.write_workbook(path, sorted(rows.items()))
+		
+		workbook(os.path.join(folder, 'first.xlsx'), False)
+		workbook(os.path.join(folder, 'second.xlsx'), True)
+		for name in ('first', 'second'):
+			diffs = {}
+			seconds = timeit.timeit(lambda: diffs.update(Group.read_gc_rosters(os.path.join(folder, name + '.xlsx'), sheets, connection)), number=1)
+			totals = [sum(len(getattr(diff, field)) for diff in diffs.values()) for field in RosterDiff._fields]
+			print '%d-member %d-sheet roster, %s import: %.1f ms (%s)' % (count, groups, name, seconds * 1000, 
+				', '.join('%d %s' % (total, field.replace('_', ' ')) for (total, field) in zip(totals, RosterDiff._fields)))
+		connection.close()
+	finally:
+		shutil.rmtree(folder)
+
+def bench_backfill(years=4):
+	"""Backfill's parse stage over a generated archive, with 1 process and up to one per CPU."""
+	
+	import multiprocessing
+	
+	folder = tempfile.mkdtemp()
+	try:
+		dataset = datagen.Dataset(years=years)
+		dataset.write_rfid_exports(folder)
+		dataset.write_rosters(folder)
+		paths = Backfill.discover(folder)
+		cpus = multiprocessing.cpu_count()
+		times = {}
+		for processes in sorted(set([1, 2, 4, cpus])):
+			if processes > cpus:
+				continue
+			backfill = Backfill(None, processes)
+			times[processes] = timeit.timeit(lambda: list(backfill.parse(paths)), number=1)
+			print 'Backfill parse of %d files, %d processes: %.2fs (%.1fx)' % (len(paths), processes, times[processes], times[1] / times[processes])
+	finally:
+		shutil.rmtree(folder)
+
+def bench_timestamps(years=2):
+	"""Decode generated RFID exports as datetimes (read_rfid_export) and through RfidTimestamps."""
+	
+	folder = tempfile.mkdtemp()
+	try:
+		dataset = datagen.Dataset(years=years)
+		paths = [path for paths in dataset.write_rfid_exports(folder).values() for path in paths]
+		taps = sum(len(list(read_rfid_export(path))) for path in paths)
+		datetimes = timeit.timeit(lambda: [(epoch(dt), dt.isoformat(), rfid) for path in paths for (dt, rfid) in read_rfid_export(path)], number=1)
+		decoded = timeit.timeit(lambda: [row for path in paths for row in read_rfid_timestamps(path)], number=1)
+		print 'RFID export timestamps, %d taps: datetimes %.0f taps/s, decoded %.0f taps/s (%.1fx)' % (
+			taps, taps / datetimes, taps / decoded, datetimes / decoded)
+	finally:
+		shutil.rmtree(folder)
+
+def bench_kiosk(taps=150):
+	"""Per-tap latency of a rehearsal's burst of kiosk taps, against KIOSK_P99_BUDGET."""
+	
+	folder = tempfile.mkdtemp()
+	db = AttendanceDB(os.path.join(folder, 'kiosk.sqlite'))
+	connection = db.connect(db.disk_db)
+	db.create_tables(connection)
+	start = datetime(2011, 9, 6, 18, 30, tzinfo=TZ_EST)
+	cur = connection.cursor()
+	cur.executemany('INSERT INTO students VALUES (?,?,?,?,1,1)', [(10000 + i, 'First', 'Last', 'student%d@wpi.edu' % i) for i in range(taps)])
+	cur.execute('INSERT INTO events (id, eventname, start, end) VALUES (1, ?, ?, ?)', ('Rehearsal', start.isoformat(), (start + timedelta(0, 7200)).isoformat()))
+	cur.close()
+	kiosk = Kiosk(db, connection, clock=lambda: start)
+	kiosk.start()
+	latencies = []
+	for i in range(taps):
+		before = timeit.default_timer()
+		kiosk.tap(10000 + i, start + timedelta(0, -300 + i * 4))
+		latencies.append(timeit.default_timer() - before)
+	kiosk.close()
+	connection.close()
+	shutil.rmtree(folder)
+	p99 = percentile(latencies, 99)
+	print 'Kiosk tap latency, %d taps: p50 %.3f ms, p99 %.3f ms (budget %.0f ms): %s' % (
+		taps, percentile(latencies, 50) * 1000, p99 * 1000, KIOSK_P99_BUDGET * 1000, 'ok' if p99 <= KIOSK_P99_BUDGET else 'OVER BUDGET')
+
+def bench_import(runs=5):
+	"""Time "import gc_attendance" in fresh interpreters against IMPORT_BUDGET."""
+	
+	code = 'import sys, time; t = time.time(); import gc_attendance; print time.time() - t; print " ".join(sorted(sys.modules))'
+	times = []
+	for i in range(runs):
+		output = subprocess.check_output([sys.executable, '-c', code]).split('\n')
+		times.append(float(output[0]))
+		loaded = output[1].split()
+	median = sorted(times)[runs // 2]
+	eager = [module for module in LAZY_MODULES if module in loaded]
+	print 'import gc_attendance: %.0f ms median of %d (budget %.0f ms): %s' % (
+		median * 1000, runs, IMPORT_BUDGET * 1000, 'ok' if median <= IMPORT_BUDGET else 'OVER BUDGET')
+	if len(eager) > 0:
+		print '  imported eagerly:', ', '.join(eager)
+
+class QueryCounter(object):
+	
+	"""Counts the statements run on a connection, through its exec tracer.
+	
+	executemany() counts once per row, as SQLite steps the statement that often.
+	"""
+	
+	def __init__(self, connection):
+		self.count = 0
+		connection.setexectrace(self.trace)
+	
+	def trace(self, cursor, sql, bindings):
+		self.count += 1
+		return True
+
+def percentile(values, p):
+	"""Nearest-rank percentile of a non-empty list."""
+	
+	values = sorted(values)
+	return values[max(0, min(len(values) - 1, int(round(p / 100.0 * len(values))) - 1))]
+
+def peak_rss_kb():
+	"""The process's peak resident set size so far, in KB (Linux reports ru_maxrss in KB)."""
+	
+	return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def run_workflow(name, operations, counter):
+	"""Time a workflow's (items, function) operations one by one.
+	
+	@return: The workflow's result record. peak_rss_kb is the process
+	high-water mark after the workflow, so it only grows over a run.
+	"""
+	
+	latencies = []
+	items = 0
+	queries = counter.count
+	for (count, function) in operations:
+		start = timeit.default_timer()
+		function()
+		latencies.append(timeit.default_timer() - start)
+		items += count
+	seconds = sum(latencies)
+	return {'workflow' : name, 
+		'operations' : len(latencies), 
+		'items' : items, 
+		'seconds' : seconds, 
+		'throughput' : items / seconds if seconds > 0 else None, 
+		'latency_ms' : dict([('p%d' % p, percentile(latencies, p) * 1000) for p in (50, 90, 99)] + [('max', max(latencies) * 1000)]) if len(latencies) > 0 else {}, 
+		'queries' : counter.count - queries, 
+		'peak_rss_kb' : peak_rss_kb()}
+
+def suite_size(dataset, folder):
+	"""Run each workflow against one Dataset in a fresh disk DB under folder.
+	
+	Workflows run in the order a semester's data arrives: rosters, then RFID
+	exports, then the read-only signin assignment, absences, standing and the
+	Google Calendar JSON for the last Semester's Events.
+	@return: List of result records.
+	"""
+	
+	connection = gcdb.connect(os.path.join(folder, 'suite.sqlite'))
+	gcdb.create_tables(connection)
+	dataset.write_db(connection, signins=False)
+	exports = dataset.write_rfid_exports(folder)
+	rosters = dataset.write_rosters(folder)
+	counter = QueryCounter(connection)
+	semesters = [row[0] for row in dataset.semesters]
+	memberships = {}
+	for (rfid, group_id, credit) in dataset.group_memberships:
+		memberships[group_id] = memberships.get(group_id, 0) + 1
+	results = []
+	
+	operations = []
+	for (group_id, organization, semester, name, parent_id) in dataset.groups:
+		group = Group(group_id, None, None, name)
+		operations.append((memberships.get(group_id, 0), lambda group=group, path=rosters[group_id]: group.read_gc_roster(path, connection)))
+	results.append(run_workflow('read_gc_roster', operations, counter))
+	
+	operations = []
+	for semester in semesters:
+		paths = exports.get(semester, [])
+		taps = sum(len(list(read_rfid_export(path))) for path in paths)
+		operations.append((taps, lambda paths=paths: SigninMerge(connection).run(paths)))
+	results.append(run_workflow('read_attendance', operations, counter))
+	
+	index = EventIndex.select_all(connection)
+	operations = []
+	for semester in semesters:
+		streams = [list(SigninMerge.reader_stream(path, reader_id)) for (reader_id, path) in enumerate(exports.get(semester, []))]
+		merge = SigninMerge(connection, index=index)
+		operations.append((sum(len(stream) for stream in streams), 
+			lambda merge=merge, streams=streams: list(merge.merge([iter(stream) for stream in streams]))))
+	results.append(run_workflow('assign_signins', operations, counter))
+	
+	operations = []
+	for semester in semesters:
+		events = Event.select_by_semester(semester, connection)
+		operations.append((len(events), lambda events=events: Absence.generate(events, connection)))
+	results.append(run_workflow('generate_absences', operations, counter))
+	
+	operations = []
+	for semester in semesters:
+		operations.append((1, lambda semester=semester: SemesterRollup.standing(semester, connection)))
+	results.append(run_workflow('standing', operations, counter))
+	
+	operations = []
+	for event in Event.select_by_semester(semesters[-1], connection):
+		operations.append((1, lambda event=event: event.make_json(connection)))
+	results.append(run_workflow('make_json', operations, counter))
+	
+	connection.close()
+	for result in results:
+		result['dataset'] = {'years' : dataset.years, 
+			'semesters' : len(dataset.semesters), 
+			'groups' : len(dataset.groups), 
+			'students' : len(dataset.students), 
+			'events' : len(dataset.events), 
+			'taps' : len(dataset.taps)}
+	return results
+
+def run_suite(sizes=SUITE_SIZES, seed=2011):
+	"""Run the workflows against a Dataset of each size in years.
+	
+	@return: A JSON-ready dict of the run's environment and result records.
+	"""
+	
+	results = []
+	for years in sizes:
+		folder = tempfile.mkdtemp()
+		try:
+			results.extend(suite_size(datagen.Dataset(seed=seed, years=years), folder))
+		finally:
+			shutil.rmtree(folder)
+	return {'created' : datetime.now().isoformat(), 
+		'python' : sys.version.split()[0], 
+		'sqlite' : apsw.sqlitelibversion(), 
+		'apsw' : apsw.apswversion(), 
+		'seed' : seed, 
+		'sizes' : list(sizes), 
+		'results' : results}
+
+def compare(run, baseline, tolerance=TOLERANCE):
+	"""Return a line for each workflow and size that got slower or chattier than the baseline."""
+	
+	previous = dict(((r['workflow'], r['dataset']['years']), r) for r in baseline['results'])
+	regressions = []
+	for result in run['results']:
+		old = previous.get((result['workflow'], result['dataset']['years']))
+		if old is None:
+			continue
+		label = '%s (%d years)' % (result['workflow'], result['dataset']['years'])
+		if old['throughput'] and result['throughput'] and result['throughput'] < old['throughput'] * (1 - tolerance):
+			regressions.append('%s: %.0f items/s, was %.0f' % (label, result['throughput'], old['throughput']))
+		if result['queries'] > old['queries']:
+			regressions.append('%s: %d queries, was %d' % (label, result['queries'], old['queries']))
+	return regressions
+
+def footprint(obj):
+	"""Shallow bytes of a model object: itself, its __dict__ if it has one, and its relation containers."""
+	
+	size = sys.getsizeof(obj)
+	if hasattr(obj, '__dict__'):
+		size += sys.getsizeof(obj.__dict__)
+	return size + sum(sys.getsizeof(value) for value in attributes(obj) if isinstance(value, (list, dict)))
+
+def attributes(obj):
+	if hasattr(obj, '__dict__'):
+		return obj.__dict__.values()
+	return [getattr(obj, slot, None) for slot in type(obj).__slots__]
+
+def hydrated(objects):
+	"""Return every distinct model object reachable from objects."""
+	
+	seen = {}
+	stack = list(objects)
+	while len(stack) > 0:
+		obj = stack.pop()
+		if isinstance(obj, list):
+			stack.extend(obj)
+		elif isinstance(obj, MODELS) and id(obj) not in seen:
+			seen[id(obj)] = obj
+			stack.extend(attributes(obj))
+	return seen.values()
+
+def load_semester(semester, connection):
+	"""Hydrate a Semester's Groups with their members and its Events with their signins, excuses and absences."""
+	
+	groups = Group.select_by_semester(semester, connection)
+	for group in groups:
+		group.fetch_members(connection)
+	events = Event.select_by_semester(semester, connection)
+	for event in events:
+		event.signins = Signin.select_by_event(event, connection)
+		event.excuses = Excuse.select_by_event(event, connection)
+		event.fetch_absences(connection)
+	return groups + events
+
+def memory_report(semester, connection):
+	"""Measure the model objects of load_semester().
+	
+	The total is the memory tracemalloc saw allocated by the load when it's
+	available, and otherwise the sum of the objects' shallow footprints.
+	@return: Dict with 'classes' (class name -> {'objects', 'bytes_per_object'}),
+	'total_bytes' and whether the total was 'traced'.
+	"""
+	
+	QueryCache.for_connection(connection).clear()	# Build every object inside the measurement
+	if tracemalloc is not None:
+		tracemalloc.start()
+		before = tracemalloc.get_traced_memory()[0]
+	objects = load_semester(semester, connection)
+	if tracemalloc is not None:
+		total = tracemalloc.get_traced_memory()[0] - before
+		tracemalloc.stop()
+	
+	sizes = {}
+	for obj in hydrated(objects):
+		sizes.setdefault(type(obj).__name__, []).append(footprint(obj))
+	if tracemalloc is None:
+		total = sum(sum(values) for values in sizes.values())
+	classes = dict((name, {'objects' : len(values), 'bytes_per_object' : float(sum(values)) / len(values)}) for (name, values) in sizes.items())
+	return {'classes' : classes, 'total_bytes' : total, 'traced' : tracemalloc is not None}
+
+def bench_memory(years=1):
+	"""Print the memory report for the last Semester of a generated Dataset."""
+	
+	dataset = datagen.Dataset(years=years)
+	connection = gcdb.connect(':memory:')
+	gcdb.create_tables(connection)
+	dataset.write_db(connection)
+	Absence.generate(Event.select_by_semester(dataset.semesters[-1][0], connection), connection)
+	report = memory_report(dataset.semesters[-1][0], connection)
+	connection.close()
+	for (name, stats) in sorted(report['classes'].items()):
+		print '%-12s %7d objects %7.0f bytes each' % (name, stats['objects'], stats['bytes_per_object'])
+	print 'Loading %s: %.1f MB%s' % (dataset.semesters[-1][0], report['total_bytes'] / 1048576.0, 
+		'' if report['traced'] else ' (estimated; tracemalloc is not available)')
+
+def bench_columns(years=2):
+	"""A Semester's signins as Signin objects (one select_by_event per Event) vs. as columns."""
+	
+	dataset = datagen.Dataset(years=years)
+	connection = gcdb.connect(':memory:')
+	gcdb.create_tables(connection)
+	dataset.write_db(connection)
+	semester = dataset.semesters[-1][0]
+	events = Event.select_by_semester(semester, connection)
+	signins = []
+	objects = timeit.timeit(lambda: signins.extend(signin for event in events for signin in Signin.select_by_event(event, connection)), number=1)
+	columns = {}
+	arrays = timeit.timeit(lambda: columns.update(AttendanceDB.columns('signins', connection, semester)), number=1)
+	object_bytes = sum(footprint(obj) for obj in hydrated(signins))
+	array_bytes = sum(sys.getsizeof(column) for column in columns.values())
+	print '%d %s signins: %.3fs and %.1f MB as objects, %.3fs and %.2f MB as columns' % (
+		len(columns['student']), semester, objects, object_bytes / 1048576.0, arrays, array_bytes / 1048576.0)
+	connection.close()
+
+def main(argv=None):
+	"""Command line entry point."""
+	
+	parser = argparse.ArgumentParser(description='Benchmark gc_attendance.')
+	parser.add_argument('command', nargs='?', default='micro', choices=['micro', 'suite', 'memory'])
+	parser.add_argument('--sizes', type=int, nargs='+', default=SUITE_SIZES, help='dataset sizes in academic years')
+	parser.add_argument('--seed', type=int, default=2011)
+	parser.add_argument('--output', help='write the suite results to this JSON file')
+	parser.add_argument('--baseline', help='flag regressions against the results JSON of an earlier run')
+	parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+	args = parser.parse_args(argv)
+	
+	if args.command == 'micro':
+		bench_import()
+		bench_lookups()
+		bench_kiosk()
+		bench_roster()
+		bench_roster_import()
+		bench_columns()
+		bench_backfill()
+		bench_timestamps()
+		return 0
+	elif args.command == 'memory':
+		bench_memory()
+		return 0
+	
+	run = run_suite(args.sizes, args.seed)
+	for result in run['results']:
+		print '%-18s %2d years: %9.0f items/s  p50 %8.2f ms  p99 %8.2f ms  %8d queries  %7d KB peak' % (
+			result['workflow'], result['dataset']['years'], result['throughput'] or 0, 
+			result['latency_ms'].get('p50', 0), result['latency_ms'].get('p99', 0), result['queries'], result['peak_rss_kb'])
+	if args.output is not None:
+		with open(args.output, 'w') as f:
+			json.dump(run, f, indent=1, sort_keys=True)
+	if args.baseline is not None:
+		with open(args.baseline) as f:
+			regressions = compare(run, json.load(f), args.tolerance)
+		for line in regressions:
+			print 'REGRESSION', line
+		if len(regressions) > 0:
+			return 1
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
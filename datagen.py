@@ -0,0 +1,403 @@
+"""Deterministic synthetic attendance data for load and scale testing.
+
+A Dataset is generated in memory from a seed and a handful of sizes, then
+written straight into an AttendanceDB connection through the bulk write
+paths, or out as RFID reader exports and xlsx rosters for the importers.
+Run with: python datagen.py --years 10 --organizations 5 --db big.sqlite
+"""
+
+import os
+import re
+import csv
+import random
+import zipfile
+import argparse
+from datetime import *
+from xml.sax.saxutils import escape
+from gc_attendance import *
+
+# (name, rehearsal weekday (Monday is 0), rehearsal start hour, minute)
+ORGANIZATIONS = [
+	('Glee Club', 1, 18, 30),
+	('Alden Voices', 2, 19, 0),
+	('Festival Choir', 0, 18, 0),
+	('Concert Band', 3, 19, 0),
+	('Orchestra', 2, 18, 30),
+	('Jazz Ensemble', 0, 20, 0),
+	('Brass Ensemble', 3, 17, 30),
+	('Chamber Choir', 4, 16, 0)]
+
+FIRST_NAMES = ['Alex', 'Ben', 'Chris', 'Dan', 'Emily', 'Fatima', 'Greg', 'Hannah', 'Ian', 'Jess',
+	'Kevin', 'Laura', 'Mike', 'Nina', 'Omar', 'Priya', 'Quinn', 'Rachel', 'Sam', 'Tom', 'Uma', 'Victor', 'Wei', 'Yusuf']
+LAST_NAMES = ['Baker', 'Chen', 'Davis', 'Evans', 'Garcia', 'Hughes', 'Jones', 'Kim', 'Lopez', 'Miller',
+	'Nguyen', 'Patel', 'Roberts', 'Smith', 'Taylor', 'Walsh', 'Young']
+EXCUSE_REASONS = ['I have a lab that runs late tonight.', 'Sick with a cold, sorry!', 'Job interview off campus.',
+	'IQP meeting with my advisor.', 'Family emergency, heading home.', 'Exam review session for my class.',
+	'My car broke down on the way back.', 'Varsity game tonight.']
+
+ROSTER_HEADER = ['RFID', 'First Name', 'Last Name', 'Email', 'SHM', 'Credit', 'Officer']
+
+def nth_weekday(year, month, weekday, n):
+	"""Return the date of the nth (1-based) weekday of a month."""
+	
+	first = date(year, month, 1)
+	return first + timedelta((weekday - first.weekday()) % 7 + 7 * (n - 1))
+
+def next_weekday(day, weekday):
+	"""Return the first date on or after day that falls on weekday."""
+	
+	return day + timedelta((weekday - day.weekday()) % 7)
+
+def write_xlsx(path, rows, sheet='Sheet1'):
+	"""Write rows of strings as a minimal single-sheet xlsx file, using shared strings."""
+	
+	write_workbook(path, [(sheet, rows)])
+
+def write_workbook(path, sheets):
+	"""Write a minimal xlsx file of (sheet name, rows of strings) sheets, using shared strings."""
+	
+	strings = {}
+	ordered = []
+	sheet_xml = []
+	for (name, rows) in sheets:
+		sheet_rows = []
+		for (r, row) in enumerate(rows):
+			cells = []
+			for (c, value) in enumerate(row):
+				value = unicode(value)
+				if value not in strings:
+					strings[value] = len(ordered)
+					ordered.append(value)
+				cells.append('<c r="%s%d" t="s"><v>%d</v></c>' % (chr(ord('A') + c), r + 1, strings[value]))
+			sheet_rows.append('<row r="%d">%s</row>' % (r + 1, ''.join(cells)))
+		sheet_xml.append(''.join(sheet_rows))
+	
+	main = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+	relationships = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+	package = 'http://schemas.openxmlformats.org/package/2006/relationships'
+	header = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+	numbers = range(1, len(sheets) + 1)
+	with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as book:
+		book.writestr('[Content_Types].xml', header +
+			'<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+			'<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+			'<Default Extension="xml" ContentType="application/xml"/>'
+			'<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>' + 
+			''.join('<Override PartName="/xl/worksheets/sheet%d.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>' % n for n in numbers) + 
+			'<Override PartName="/xl/sharedStrings.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/>'
+			'</Types>')
+		book.writestr('_rels/.rels', header +
+			'<Relationships xmlns="%s"><Relationship Id="rId1" Type="%s/officeDocument" Target="xl/workbook.xml"/></Relationships>' % (package, relationships))
+		book.writestr('xl/workbook.xml', header +
+			'<workbook xmlns="%s" xmlns:r="%s"><sheets>%s</sheets></workbook>' % (main, relationships, 
+			''.join('<sheet name="%s" sheetId="%d" r:id="rId%d"/>' % (escape(name), n, n) for (n, (name, rows)) in zip(numbers, sheets))))
+		book.writestr('xl/_rels/workbook.xml.rels', header +
+			'<Relationships xmlns="%s">' % package + 
+			''.join('<Relationship Id="rId%d" Type="%s/worksheet" Target="worksheets/sheet%d.xml"/>' % (n, relationships, n) for n in numbers) + 
+			'<Relationship Id="rId%d" Type="%s/sharedStrings" Target="sharedStrings.xml"/>' % (len(sheets) + 1, relationships) + 
+			'</Relationships>')
+		for (n, rows) in zip(numbers, sheet_xml):
+			book.writestr('xl/worksheets/sheet%d.xml' % n, header +
+				'<worksheet xmlns="%s"><sheetData>%s</sheetData></worksheet>' % (main, rows))
+		book.writestr('xl/sharedStrings.xml', (header +
+			'<sst xmlns="%s" count="%d" uniqueCount="%d">%s</sst>' % (main, len(ordered), len(ordered),
+			''.join('<si><t>%s</t></si>' % escape(value) for value in ordered))).encode('utf-8'))
+
+class Dataset(object):
+	
+	"""A deterministic multi-year attendance dataset.
+	
+	Everything is generated in __init__ from the seed, so two Datasets with
+	the same arguments hold identical rows. The row lists match the table
+	layouts in AttendanceDB.create_tables, with explicit group and event IDs.
+	Taps are (datetime, event ID or None, RFID, reader ID) in time order,
+	including repeat taps and cards nobody has registered.
+	"""
+	
+	def __init__(self, seed=2011, years=10, organizations=5, students_per_year=150, group_size=60,
+			first_year=2011, readers=2, duplicate_rate=0.05, unknown_rate=0.2, excuse_rate=0.4):
+		"""@param years: Academic years, each a fall and a spring Semester.
+		@param organizations: How many of ORGANIZATIONS to use.
+		@param students_per_year: Size of each incoming class; students stay four years.
+		@param group_size: Members of each Organization's Group per Semester.
+		@param readers: RFID readers the taps are spread over.
+		@param duplicate_rate: Chance a signin is followed by a repeat tap.
+		@param unknown_rate: Chance per Event of a tap from an unregistered card.
+		@param excuse_rate: Chance an absent member sent an excuse.
+		"""
+		
+		self.random = random.Random(seed)
+		self.years = years
+		self.first_year = first_year
+		self.students_per_year = students_per_year
+		self.group_size = group_size
+		self.readers = readers
+		self.duplicate_rate = duplicate_rate
+		self.unknown_rate = unknown_rate
+		self.excuse_rate = excuse_rate
+		self.schedules = ORGANIZATIONS[:organizations]
+		
+		self.organizations = []
+		self.optional_member_orgs = []
+		self.mandatory_member_orgs = []
+		self.terms = []
+		self.semesters = []
+		self.daysoff = []
+		self.students = []
+		self.groups = []
+		self.group_memberships = []
+		self.events = []
+		self.excuses = []
+		self.taps = []
+		
+		self.cohorts = {}		# Entering year -> list of RFIDs
+		self.reliability = {}	# RFID -> chance of attending a rehearsal
+		self.generate()
+	
+	def generate(self):
+		for (name, weekday, hour, minute) in self.schedules:
+			self.organizations.append((name, None))
+		# Festival Choir draws on the other choirs; the rest may borrow from the Glee Club
+		names = [row[0] for row in self.organizations]
+		for (i, parent) in enumerate(names):
+			if parent == 'Festival Choir':
+				for child in ('Glee Club', 'Alden Voices'):
+					if child in names:
+						self.mandatory_member_orgs.append((len(self.mandatory_member_orgs) + 1, parent, child))
+			elif i > 0 and i % 2 == 1:
+				self.optional_member_orgs.append((len(self.optional_member_orgs) + 1, parent, names[0]))
+		
+		members = dict((name, []) for name in names)
+		for year in range(self.first_year, self.first_year + self.years):
+			self.add_cohort(year)
+			for (semester, term_one, term_two) in self.academic_year(year):
+				self.semesters.append((semester, term_one[0], term_two[0]))
+				current = set(rfid for entering in range(year - 3, year + 1) for rfid in self.cohorts.get(entering, []))
+				for (name, weekday, hour, minute) in self.schedules:
+					roster = [rfid for rfid in members[name] if rfid in current and self.random.random() > 0.08]
+					candidates = sorted(current - set(roster))
+					self.random.shuffle(candidates)
+					roster.extend(candidates[:max(0, self.group_size - len(roster))])
+					members[name] = roster
+					self.add_group(name, semester, roster, term_one, term_two, weekday, hour, minute)
+		
+		last = set(rfid for entering in range(self.first_year + self.years - 4, self.first_year + self.years) for rfid in self.cohorts.get(entering, []))
+		self.students = [(rfid, fname, lname, email, 1, int(rfid in last)) for (rfid, fname, lname, email) in self.students]
+		self.taps.sort(key=lambda tap: (tap[0], tap[2], tap[3]))
+	
+	def add_cohort(self, year):
+		cohort = []
+		used = set(row[0] for row in self.students)
+		while len(cohort) < self.students_per_year:
+			rfid = self.random.randint(100000, 999999)
+			if rfid in used:
+				continue
+			used.add(rfid)
+			fname = self.random.choice(FIRST_NAMES)
+			lname = self.random.choice(LAST_NAMES)
+			self.students.append((rfid, fname, lname, '%s%s%d@wpi.edu' % (fname[0].lower(), lname.lower(), rfid % 1000)))
+			self.reliability[rfid] = self.random.uniform(0.7, 0.98)
+			cohort.append(rfid)
+		self.cohorts[year] = cohort
+	
+	def academic_year(self, year):
+		"""Add the Terms and days off of the academic year starting in the fall of year.
+		
+		@return: [(semester name, term one row, term two row)] for the fall and spring.
+		"""
+		
+		a_start = next_weekday(date(year, 8, 23), 3)
+		b_start = a_start + timedelta(61)
+		c_start = next_weekday(date(year + 1, 1, 10), 3)
+		d_start = c_start + timedelta(61)
+		terms = []
+		for (letter, start, length, term_year) in (('A', a_start, 48, year), ('B', b_start, 51, year),
+				('C', c_start, 50, year + 1), ('D', d_start, 52, year + 1)):
+			row = ('%s%02d' % (letter, term_year % 100), start.isoformat(), (start + timedelta(length)).isoformat())
+			self.terms.append(row)
+			terms.append(row)
+		
+		thanksgiving = nth_weekday(year, 11, 3, 4)
+		holidays = [nth_weekday(year, 9, 0, 1), thanksgiving - timedelta(1), thanksgiving, thanksgiving + timedelta(1),
+			nth_weekday(year + 1, 1, 0, 3), nth_weekday(year + 1, 2, 0, 3), nth_weekday(year + 1, 4, 0, 3)]
+		for i in range(self.random.randint(0, 3)):	# Snow days
+			holidays.append(c_start + timedelta(self.random.randint(0, 45)))
+		for day in sorted(set(holidays)):
+			self.daysoff.append((day.isoformat(),))
+		
+		return [('fall_%d' % year, terms[0], terms[1]), ('spring_%d' % (year + 1), terms[2], terms[3])]
+	
+	def add_group(self, name, semester, roster, term_one, term_two, weekday, hour, minute):
+		group_id = len(self.groups) + 1
+		self.groups.append((group_id, name, semester, '%s %s' % (name, semester), None))
+		for rfid in roster:
+			self.group_memberships.append((rfid, group_id, int(self.random.random() < 0.5)))
+		
+		daysoff = set(row[0] for row in self.daysoff)
+		for term in (term_one, term_two):
+			day = next_weekday(convert_date(term[1]), weekday)
+			last = convert_date(term[2])
+			while day <= last:
+				if day.isoformat() not in daysoff:
+					start = datetime(day.year, day.month, day.day, hour, minute, tzinfo=TZ_EST)
+					self.add_event(group_id, name, semester, roster, 'Rehearsal', Event.TYPE_REHEARSAL, start, timedelta(hours=2))
+				day += timedelta(7)
+			# A dress rehearsal and concert on the Friday and Saturday of the term's last week
+			concert = next_weekday(last - timedelta(6), 5)
+			dress = concert - timedelta(1)
+			self.add_event(group_id, name, semester, roster, 'Dress Rehearsal', Event.TYPE_DRESS,
+				datetime(dress.year, dress.month, dress.day, 18, 0, tzinfo=TZ_EST), timedelta(hours=3))
+			self.add_event(group_id, name, semester, roster, '%s Concert' % name, Event.TYPE_CONCERT,
+				datetime(concert.year, concert.month, concert.day, 19, 30, tzinfo=TZ_EST), timedelta(hours=2))
+	
+	def add_event(self, group_id, name, semester, roster, event_name, event_type, start, length):
+		event_id = len(self.events) + 1
+		self.events.append((event_id, event_name, None, 'Alden Memorial', start.isoformat(), (start + length).isoformat(),
+			event_type, group_id, semester, None))
+		boost = 0.1 if event_type != Event.TYPE_REHEARSAL else 0.0
+		for rfid in roster:
+			if self.random.random() < self.reliability[rfid] + boost:
+				# Most arrive a few minutes early; some run late
+				offset = self.random.gauss(-4, 5)
+				if self.random.random() < 0.1:
+					offset += self.random.expovariate(1 / 10.0)
+				when = start + timedelta(seconds=int(max(-30, min(90, offset)) * 60))
+				self.taps.append((when, event_id, rfid, self.random.randrange(self.readers)))
+				if self.random.random() < self.duplicate_rate:
+					again = when + timedelta(seconds=self.random.randint(5, 300))
+					self.taps.append((again, event_id, rfid, self.random.randrange(self.readers)))
+			elif self.random.random() < self.excuse_rate:
+				sent = start - timedelta(minutes=self.random.randint(30, 48 * 60))
+				self.excuses.append((sent.isoformat(), event_id, self.random.choice(EXCUSE_REASONS), rfid))
+		if self.random.random() < self.unknown_rate:
+			when = start + timedelta(seconds=self.random.randint(-900, 900))
+			self.taps.append((when, None, self.random.randint(1000000, 9999999), self.random.randrange(self.readers)))
+	
+	def write_db(self, connection, batch_size=5000, signins=True):
+		"""Write the dataset into a connection with create_tables() already run, in one transaction.
+		
+		Signins go through SigninMerge.write, so unknown cards get blank
+		Student rows and repeat taps keep the earliest per Event, as they
+		would from the importers.
+		@param signins: False to leave the taps for the importers.
+		@return: Dict of table name -> rows written.
+		"""
+		
+		tables = [('organizations', self.organizations),
+			('optional_member_orgs', self.optional_member_orgs),
+			('mandatory_member_orgs', self.mandatory_member_orgs),
+			('terms', self.terms),
+			('semesters', self.semesters),
+			('daysoff', self.daysoff),
+			('students', self.students),
+			('groups', self.groups),
+			('events', self.events)]
+		counts = {}
+		with AttendanceDB.transaction(connection):
+			try:
+				cur = AttendanceDB.cursor(connection)
+				
+				for (table, rows) in tables:
+					if len(rows) > 0:
+						cur.executemany('INSERT INTO %s VALUES (%s)' % (table, ','.join('?' * len(rows[0]))), rows)
+					counts[table] = len(rows)
+				cur.executemany('INSERT INTO group_memberships (student, group_id, credit) VALUES (?,?,?)', self.group_memberships)
+				counts['group_memberships'] = len(self.group_memberships)
+				cur.executemany('INSERT INTO excuses (dt, event, reason, student) VALUES (?,?,?,?)', self.excuses)
+				counts['excuses'] = len(self.excuses)
+			
+			finally:
+				AttendanceDB.release(cur)
+			
+			if signins:
+				merge = SigninMerge(connection)
+				for start in xrange(0, len(self.taps), batch_size):
+					merge.write([(when.isoformat(), event_id, rfid) for (when, event_id, rfid, reader_id) in self.taps[start:start + batch_size]])
+				counts['taps'] = len(self.taps)
+		AcademicCalendar.invalidate(connection)
+		return counts
+	
+	def write_rfid_exports(self, folder):
+		"""Write the taps as one RFID reader export per Semester and reader.
+		
+		@return: Dict of Semester name -> list of export paths, one per reader.
+		"""
+		
+		semester_of = dict((row[0], row[8]) for row in self.events)
+		# Unknown cards go in the export of the last Semester to start before the tap
+		term_starts = dict((name, convert_date(start)) for (name, start, end) in self.terms)
+		starts = sorted((term_starts[term_one], name) for (name, term_one, term_two) in self.semesters)
+		exports = {}
+		writers = {}
+		files = []
+		try:
+			for (when, event_id, rfid, reader_id) in self.taps:
+				if event_id is not None:
+					semester = semester_of[event_id]
+				else:
+					semester = [name for (start, name) in starts if start <= when.date()][-1]
+				if (semester, reader_id) not in writers:
+					path = os.path.join(folder, 'rfid-%s-reader%d.csv' % (semester, reader_id))
+					f = open(path, 'wb')
+					files.append(f)
+					writers[(semester, reader_id)] = csv.writer(f)
+					exports.setdefault(semester, []).append(path)
+				# Mystery blank column, M/D/YYYY, HH:MM, RFID
+				row = ['', '%d/%d/%d' % (when.month, when.day, when.year), '%02d:%02d' % (when.hour, when.minute), rfid]
+				writers[(semester, reader_id)].writerow(row)
+		finally:
+			for f in files:
+				f.close()
+		for paths in exports.values():
+			paths.sort()
+		return exports
+	
+	def write_rosters(self, folder):
+		"""Write each Group's members as a Glee Club format xlsx roster.
+		
+		@return: Dict of group ID -> roster path.
+		"""
+		
+		students = dict((row[0], row) for row in self.students)
+		members = {}
+		for (rfid, group_id, credit) in self.group_memberships:
+			members.setdefault(group_id, []).append((rfid, credit))
+		rosters = {}
+		for (group_id, organization, semester, name, parent_id) in self.groups:
+			rows = [ROSTER_HEADER]
+			for (rfid, credit) in members.get(group_id, []):
+				student = students[rfid]
+				rows.append([str(rfid), student[1], student[2], student[3], 'N', 'Y' if credit else 'N', 'N'])
+			path = os.path.join(folder, 'roster-%s.xlsx' % re.sub(r'\W', '_', name.lower()))
+			write_xlsx(path, rows)
+			rosters[group_id] = path
+		return rosters
+
+def main(argv=None):
+	"""Command line entry point."""
+	
+	parser = argparse.ArgumentParser(description='Generate a synthetic attendance dataset.')
+	parser.add_argument('--seed', type=int, default=2011)
+	parser.add_argument('--years', type=int, default=10)
+	parser.add_argument('--organizations', type=int, default=5, choices=range(1, len(ORGANIZATIONS) + 1))
+	parser.add_argument('--students', type=int, default=150, help='students entering each year')
+	parser.add_argument('--group-size', type=int, default=60)
+	parser.add_argument('--db', help='write the dataset into this SQLite database')
+	parser.add_argument('--files', help='write RFID exports and xlsx rosters into this folder')
+	args = parser.parse_args(argv)
+	
+	dataset = Dataset(args.seed, args.years, args.organizations, args.students, args.group_size)
+	if args.db is not None:
+		db = AttendanceDB(args.db)
+		connection = db.connect(db.disk_db)
+		db.create_tables(connection)
+		for (table, count) in sorted(dataset.write_db(connection).items()):
+			print '%s: %d' % (table, count)
+		connection.close()
+	if args.files is not None:
+		exports = dataset.write_rfid_exports(args.files)
+		rosters = dataset.write_rosters(args.files)
+		print '%d RFID exports, %d rosters' % (sum(len(paths) for paths in exports.values()), len(rosters))
+
+if __name__ == '__main__':
+	main()
@@ -1,25 +1,231 @@
 import csv
 import shutil
 import os
+import sys
+import argparse
+import Queue
+import struct
+import heapq
+import errno
+import getpass
+import glob
+import re
+import time as _time
+import mmap
+from calendar import timegm
+from collections import deque, namedtuple, OrderedDict
 from datetime import *
 import types
+import bisect
+import weakref
+import json
+import socket
+import threading
+import base64
+import gzip
+import traceback
+import itertools
+import array
+import zipfile
+from contextlib import contextmanager
+import email
+import email.utils
 
-import xlsx
 import apsw
-from dateutil.parser import *
 from dateutil.tz import *
-# Google stuff
-import httplib2
-from apiclient.discovery import build
-from apiclient.errors import *
-from oauth2client.file import Storage
-from oauth2client.client import OAuth2WebServerFlow
-from oauth2client.client import flow_from_clientsecrets
-from oauth2client.tools import run
-
-TZ_EST = tzstr('EST+05EDT,M4.1.0,M10.5.0')
+from dateutil.relativedelta import relativedelta, SU
+# The Google API client and dateutil.parser are slow to import, and most
+# runs never use them, so they are imported where they are used.
+
+# EST/EDT from the first Sunday in April to the last Sunday in October, as the
+# string 'EST+05EDT,M4.1.0,M10.5.0'. Built with tzrange, as tzstr imports
+# dateutil.parser to read its string.
+TZ_EST = tzrange('EST', -18000, 'EDT', -14400, 
+	start=relativedelta(hours=+2, month=4, day=1, weekday=SU(+1)), 
+	end=relativedelta(hours=+1, month=10, day=31, weekday=SU(-1)))
 TIMEZONES = {'EST' : TZ_EST, 'UTC' : tzutc()}
 
+def parse(timestr, **kwargs):
+	"""dateutil.parser.parse, imported on the first call."""
+	
+	global parse
+	from dateutil.parser import parse	# Replaces this function for later calls
+	return parse(timestr, **kwargs)
+
+def convert_date(text):
+	"""Convert a YYYY-MM-DD date column to a date object."""
+	
+	return datetime.strptime(text[:10], '%Y-%m-%d').date()
+
+def relation(slot, factory=list):
+	"""A property over a model's __slots__ slot that creates its container on first use.
+	
+	Model objects are hydrated by the thousand and most never have their
+	related lists fetched, so they hold None until then.
+	"""
+	
+	def get(self):
+		value = getattr(self, slot)
+		if value is None:
+			value = factory()
+			setattr(self, slot, value)
+		return value
+	
+	def set(self, value):
+		setattr(self, slot, value)
+	
+	return property(get, set, doc='Created empty on first use.')
+
+def read_rfid_export(infile):
+	"""Yield (datetime, RFID) for each row of an RFID reader export file."""
+	
+	with open(infile, 'rb') as f:
+		reader = csv.reader(f, delimiter=',')
+		for row in reader:
+			# row[0] is the mystery blank column
+			# row[1] is the date MM/D/YYYY
+			# row[2] is the 24-hour time HH:MM 
+			# row[3] is the RFID number
+			date = row[1].split('/')
+			time = row[2].split(':')
+			yield datetime(int(date[2]), int(date[0]), int(date[1]), int(time[0]), int(time[1]), tzinfo=TIMEZONES['EST']), int(row[3])
+
+def read_rfid_timestamps(infile, timestamps=None):
+	"""Yield (Unix time, ISO datetime, RFID) for each row of an RFID reader export file.
+	
+	The same times as read_rfid_export(), decoded by an RfidTimestamps
+	rather than built as datetimes.
+	"""
+	
+	decode = (timestamps or RfidTimestamps()).decode
+	with open(infile, 'rb') as f:
+		for row in csv.reader(f, delimiter=','):
+			(when, dt) = decode(row[1], row[2])
+			yield (when, dt, int(row[3]))
+
+class RfidTimestamps(object):
+	
+	"""Decodes the RFID export's M/D/YYYY and HH:MM columns to Unix times and ISO strings.
+	
+	An export repeats a handful of dates thousands of times, so each date's
+	local midnight is resolved to a Unix time once, with its UTC offset (or,
+	on a DST changeover day, both offsets and the minute the change takes
+	effect). Each row is then a dict lookup and an addition, with no tzinfo
+	calls. The results match datetime(..., tzinfo=tz) as read_rfid_export()
+	builds them, changeover minutes included.
+	"""
+	
+	__slots__ = ["tz", "days", "times"]
+	
+	def __init__(self, tz=TZ_EST):
+		self.tz = tz
+		# Date column -> (midnight's Unix time before the change, after it, minute of the change,
+		# ISO date, ISO offset before, after)
+		self.days = {}
+		self.times = {}		# Time column -> (minute of the day, ISO time)
+	
+	@staticmethod
+	def iso_offset(offset):
+		"""Format a UTC offset as datetime.isoformat() does, e.g. '-05:00'."""
+		
+		minutes = offset.days * 1440 + offset.seconds // 60
+		return '%s%02d:%02d' % ('-' if minutes < 0 else '+', abs(minutes) // 60, abs(minutes) % 60)
+	
+	def add_day(self, text):
+		(month, day, year) = [int(part) for part in text.split('/')]
+		
+		def offset(minute):
+			return datetime(year, month, day, minute // 60, minute % 60, tzinfo=self.tz).utcoffset()
+		
+		before = offset(0)
+		after = offset(1439)
+		change = 1440
+		if before != after:
+			# First minute with the new offset
+			(low, high) = (0, 1439)
+			while low < high:
+				middle = (low + high) // 2
+				if offset(middle) == after:
+					high = middle
+				else:
+					low = middle + 1
+			change = low
+		midnight = timegm((year, month, day, 0, 0, 0))
+		entry = (midnight - (before.days * 86400 + before.seconds), midnight - (after.days * 86400 + after.seconds), change, 
+			'%04d-%02d-%02dT' % (year, month, day), RfidTimestamps.iso_offset(before), RfidTimestamps.iso_offset(after))
+		self.days[text] = entry
+		return entry
+	
+	def add_time(self, text):
+		(hour, minute) = [int(part) for part in text.split(':')]
+		entry = (hour * 60 + minute, '%02d:%02d:00' % (hour, minute))
+		self.times[text] = entry
+		return entry
+	
+	def decode(self, date_text, time_text):
+		"""Return (Unix time, ISO datetime) for an export row's date and time columns."""
+		
+		day = self.days.get(date_text) or self.add_day(date_text)
+		time = self.times.get(time_text) or self.add_time(time_text)
+		if time[0] < day[2]:
+			return (day[0] + time[0] * 60, day[3] + time[1] + day[4])
+		return (day[1] + time[0] * 60, day[3] + time[1] + day[5])
+
+def read_xlsx_rows(infile, sheet=None):
+	"""Yield the rows of an xlsx worksheet as lists of cell strings (None for empty cells).
+	
+	The sheet XML is streamed with iterparse and each row is cleared once
+	yielded, so only the shared strings table is held in memory.
+	@param sheet: Worksheet name; the first sheet by default.
+	"""
+	
+	from xml.etree.cElementTree import iterparse, fromstring
+	
+	main = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+	relationships = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+	with zipfile.ZipFile(infile) as book:
+		targets = dict((rel.get('Id'), rel.get('Target')) for rel in fromstring(book.read('xl/_rels/workbook.xml.rels')))
+		sheets = [(element.get('name'), targets[element.get(relationships + 'id')]) for element in fromstring(book.read('xl/workbook.xml')).iter(main + 'sheet')]
+		if sheet is None:
+			path = sheets[0][1]
+		elif sheet in dict(sheets):
+			path = dict(sheets)[sheet]
+		else:
+			raise RosterException(read_xlsx_rows.__name__, "No sheet named %s in %s" % (sheet, infile))
+		path = path.lstrip('/') if path.startswith('/') else 'xl/' + path
+		
+		strings = []
+		if 'xl/sharedStrings.xml' in book.namelist():
+			for (event, element) in iterparse(book.open('xl/sharedStrings.xml')):
+				if element.tag == main + 'si':
+					strings.append(''.join(text.text or '' for text in element.iter(main + 't')))
+					element.clear()
+		
+		for (event, element) in iterparse(book.open(path)):
+			if element.tag != main + 'row':
+				continue
+			cells = []
+			for cell in element.iter(main + 'c'):
+				# Column letters of the reference, e.g. AB12 -> 27
+				column = 0
+				for letter in cell.get('r', ''):
+					if not letter.isalpha():
+						break
+					column = column * 26 + ord(letter.upper()) - ord('A') + 1
+				if column == 0:
+					column = len(cells) + 1
+				kind = cell.get('t')
+				if kind == 'inlineStr':
+					value = ''.join(text.text or '' for text in cell.iter(main + 't'))
+				else:
+					value = cell.findtext(main + 'v')
+					if value is not None and kind == 's':
+						value = strings[int(value)]
+				cells.extend([None] * (column - 1 - len(cells)))
+				cells.append(value)
+			element.clear()
+			yield cells
+
 class GCal(object):
 	
 	"""Container class for Google Calendar API-related objects."""
@@ -28,42 +234,490 @@ class GCal(object):
 
 	@staticmethod
 	def get_credentials(credentials_file='credentials.dat'):
+		from oauth2client.file import Storage
+		from oauth2client.client import flow_from_clientsecrets
+		from oauth2client.tools import run
+		
 		storage = Storage(credentials_file)
 		credentials = storage.get()
 		
 		if credentials is None or credentials.invalid == True:
 			flow = flow_from_clientsecrets('client_secrets.json', scope='https://www.googleapis.com/auth/calendar')
-		
-		credentials = run(flow, storage)
+			credentials = run(flow, storage)
 		return credentials
 	
 	def __init__(self, credentials_file='credentials.dat'):
+		import httplib2
+		from apiclient.discovery import build
+		
 		self.credentials = GCal.get_credentials(credentials_file)
-		self.http = credentials.authorize(httplib2.Http(cache=".cache"))
+		self.http = self.credentials.authorize(httplib2.Http(cache=".cache"))
 		self.service = build("calendar", "v3", http=self.http)
+	
+	def new_batch(self):
+		"""Return an empty BatchHttpRequest, to be executed with self.http."""
+		
+		from apiclient.http import BatchHttpRequest
+		return BatchHttpRequest()
+
+class DatabaseLock(object):
+	
+	"""Advisory lock file saying who has the shared database open for writing.
+	
+	The lock file sits next to the database in the Dropbox folder, so it
+	reaches the other officers' computers along with the database. It holds
+	the host, user and process ID of the holder as JSON.
+	"""
+	
+	__slots__ = ["path", "held"]
+	
+	STALE_AFTER = timedelta(0, 12 * 3600)	# A lock this old is assumed abandoned
+	
+	def __init__(self, path):
+		self.path = path
+		self.held = False
+	
+	@staticmethod
+	def describe_self():
+		"""Return the holder record for this process."""
+		
+		return {'host' : socket.gethostname(), 'user' : getpass.getuser(), 'pid' : os.getpid(), 'since' : datetime.now(TZ_EST).isoformat()}
+	
+	def holder(self):
+		"""Return the current holder record, or None if the database is not locked."""
+		
+		try:
+			with open(self.path, 'rb') as f:
+				return json.loads(f.read())
+		except (IOError, OSError, ValueError):
+			return None
+	
+	def is_stale(self, holder):
+		"""Return whether a holder record belongs to a process that is gone."""
+		
+		if holder is None:
+			return True
+		if holder.get('host') == socket.gethostname():
+			try:
+				os.kill(holder['pid'], 0)
+			except OSError as e:
+				return e.errno == errno.ESRCH
+			return False
+		since = parse(holder.get('since', ''), tzinfos=TIMEZONES)
+		return datetime.now(TZ_EST) - since > DatabaseLock.STALE_AFTER
+	
+	def acquire(self):
+		"""Try to take the lock, breaking it if its holder is gone. Returns whether it was taken."""
+		
+		for attempt in range(2):
+			try:
+				fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+			except OSError as e:
+				if e.errno != errno.EEXIST or attempt > 0 or not self.is_stale(self.holder()):
+					return False
+				os.remove(self.path)
+				continue
+			os.write(fd, json.dumps(DatabaseLock.describe_self()))
+			os.close(fd)
+			self.held = True
+			return True
+		return False
+	
+	def release(self):
+		"""Remove the lock file if this process holds it."""
+		
+		if self.held:
+			self.held = False
+			if os.path.exists(self.path):
+				os.remove(self.path)
 
 class AttendanceDB(object):
 	
 	"""Base class for the attendance database."""
 	
 	db0 = os.path.join(os.getcwd(), 'gc-attendance.sqlite')
-	__slots__ = ["disk_db", "memory"]
+	__slots__ = ["disk_db", "_memory", "lock"]
+	
+	# Busy handler retries: waits of 50ms, doubling up to 1s, about 12s in total
+	BUSY_RETRIES = 16
+	# Prepared statements apsw keeps per connection; above the module's count of distinct queries
+	STATEMENT_CACHE_SIZE = 256
+	# Idle cursors kept per connection by cursor()/release()
+	CURSOR_POOL_SIZE = 8
+	# Oldest SQLite apsw may be built with: SigninMerge's upsert has two ON CONFLICT clauses
+	MIN_SQLITE_VERSION = (3, 35, 0)
+	
+	cursors = weakref.WeakKeyDictionary()	# connection -> list of idle cursors
+	savepoints = itertools.count()		# Numbers for transaction() savepoint names
+	
+	# Tables merged from Dropbox conflicted copies, parents first: (table, key columns, references).
+	# References are (column, table) pairs translated from the copy's IDs to the main DB's. Both
+	# copies hand out the same surrogate IDs independently, so tables with one are keyed on their
+	# natural key, and list ('id', themselves) to have added rows renumbered.
+	MERGE_KEYS = [
+		('organizations', ('name',), ()), 
+		('optional_member_orgs', ('parent', 'child',), (('id', 'optional_member_orgs'),)), 
+		('mandatory_member_orgs', ('parent', 'child',), (('id', 'mandatory_member_orgs'),)), 
+		('terms', ('name',), ()), 
+		('semesters', ('name',), ()), 
+		('daysoff', ('date',), ()), 
+		('students', ('id',), ()), 
+		('groups', ('organization', 'semester', 'name',), (('id', 'groups'), ('parent_id', 'groups'),)), 
+		('group_memberships', ('student', 'group_id',), (('id', 'group_memberships'), ('group_id', 'groups'),)), 
+		('events', ('group_id', 'start',), (('id', 'events'), ('group_id', 'groups'),)), 
+		('excuses', ('student', 'dt',), (('id', 'excuses'), ('event', 'events'),)), 
+		('absences', ('event', 'student',), (('event', 'events'), ('excuseid', 'excuses'),)), 
+		('signins', ('dt', 'student',), (('event', 'events'),)), 
+		('event_outcomes', ('event', 'student',), (('event', 'events'),)), 
+		('rollups', ('semester',), ())]
 	
 	def __init__(self, db_file=db0):
 		self.disk_db = db_file
-		self.memory = self.connect(":memory:")
+		self._memory = None
+		self.lock = None
+	
+	@property
+	def memory(self):
+		"""A scratch in-memory connection, opened on first use."""
+		
+		if self._memory is None:
+			self._memory = self.connect(":memory:")
+		return self._memory
+	
+	@staticmethod
+	def busy_handler(count):
+		"""apsw busy handler: back off and retry a bounded number of times."""
+		
+		if count >= AttendanceDB.BUSY_RETRIES:
+			return False
+		_time.sleep(min(0.05 * 2 ** count, 1.0))
+		return True
 	
-	def connect(self, db):
+	def connect(self, db, readonly=False):
 		"""Connect to the DB, enable foreign keys, and return the opened connection."""
 		
-		con = apsw.Connection(db)
+		version = tuple(int(part) for part in apsw.sqlitelibversion().split('.')[:3])
+		if version < AttendanceDB.MIN_SQLITE_VERSION:
+			raise DatabaseException(self.connect.__name__, "apsw is built with SQLite %s; %s or later is required." % (
+				apsw.sqlitelibversion(), '.'.join(str(part) for part in AttendanceDB.MIN_SQLITE_VERSION)))
+		if readonly:
+			flags = apsw.SQLITE_OPEN_READONLY
+		else:
+			flags = apsw.SQLITE_OPEN_READWRITE | apsw.SQLITE_OPEN_CREATE
+		con = apsw.Connection(db, flags=flags, statementcachesize=AttendanceDB.STATEMENT_CACHE_SIZE)
+		con.setbusyhandler(AttendanceDB.busy_handler)
 		cur = con.cursor()
 		cur.execute('PRAGMA foreign_keys = ON')
 		cur.close()
 		return con
 	
-	def create_tables(self, connection):
-		"""Create the database tables."""
+	@staticmethod
+	def cursor(connection):
+		"""Return an idle cursor of a connection, or a new one if none are idle.
+		
+		Give it back with release() once its results have been read. The model
+		classes use these rather than connection.cursor(), so lookups in a
+		tight loop don't create and tear down a cursor each time.
+		"""
+		
+		idle = AttendanceDB.cursors.get(connection)
+		if idle:
+			return idle.pop()
+		return connection.cursor()
+	
+	@staticmethod
+	def release(cur):
+		"""Return a cursor to its connection's idle pool.
+		
+		A cursor with unread rows is closed instead, so that it doesn't hold a
+		read transaction open while idle.
+		"""
+		
+		try:
+			cur.getdescription()	# Raises unless a statement is still running
+		except apsw.ExecutionCompleteError:
+			idle = AttendanceDB.cursors.setdefault(cur.getconnection(), [])
+			if len(idle) < AttendanceDB.CURSOR_POOL_SIZE:
+				idle.append(cur)
+				return
+		except apsw.CursorClosedError:
+			return
+		cur.close()
+	
+	@staticmethod
+	@contextmanager
+	def transaction(connection):
+		"""Run a with block as one transaction, or as a savepoint of the enclosing one.
+		
+		The outermost block starts with BEGIN IMMEDIATE, so it takes the write
+		lock up front, and commits once when the block ends. Nested blocks are
+		savepoints, which roll back on their own if they raise; the
+		connection's ChangeBus is told, as SQLite has no hook for that. Use
+		this rather than apsw's "with connection:" inside a transaction.
+		"""
+		
+		def execute(sql):
+			try:
+				cur = AttendanceDB.cursor(connection)
+				cur.execute(sql)
+			finally:
+				AttendanceDB.release(cur)
+		
+		if connection.getautocommit():
+			execute('BEGIN IMMEDIATE')
+			try:
+				yield connection
+				execute('COMMIT')
+			except:
+				if not connection.getautocommit():
+					execute('ROLLBACK')
+				raise
+		else:
+			name = 'gc_%d' % next(AttendanceDB.savepoints)
+			bus = ChangeBus.buses.get(connection)
+			execute('SAVEPOINT ' + name)
+			if bus is not None:
+				bus.savepoint()
+			try:
+				yield connection
+			except:
+				execute('ROLLBACK TO ' + name)
+				execute('RELEASE ' + name)
+				if bus is not None:
+					bus.release(rolled_back=True)
+				raise
+			execute('RELEASE ' + name)
+			if bus is not None:
+				bus.release()
+	
+	@staticmethod
+	def batch(connection, size=1000):
+		"""Return a WriteBatch: a transaction that commits every size tick()s."""
+		
+		return WriteBatch(connection, size)
+	
+	def open_shared(self):
+		"""Open the disk DB for use from a shared Dropbox folder.
+		
+		The first instance takes the lock file and gets a writable connection;
+		any other instance gets a read-only one (check self.lock is None, and
+		DatabaseLock(...).holder() for who has it).
+		"""
+		
+		lock = DatabaseLock(self.disk_db + '.lock')
+		if lock.acquire():
+			self.lock = lock
+			return self.connect(self.disk_db)
+		return self.connect(self.disk_db, readonly=True)
+	
+	def open_partitioned(self, current_semester, connection=None):
+		"""Open the disk DB as the core file of a SemesterPartitions layout.
+		
+		@param current_semester: Name of the Semester that unqualified SQL should use.
+		@param connection: An already open connection to the core file (e.g. from
+		open_shared); one is opened if not given.
+		"""
+		
+		if connection is None:
+			connection = self.connect(self.disk_db)
+		self.create_tables(connection, partitioned=True)
+		SemesterPartitions(self.disk_db, current_semester).enable(connection)
+		return connection
+	
+	def connect_thread(self, semester=None):
+		"""Open a background thread's own connection to the disk DB.
+		
+		A thread never writes through another thread's connection: its
+		autocommit statements would land in whatever transaction the other
+		thread has open, and transaction() can't tell the two apart.
+		@param semester: The current Semester of a partitioned DB, as given to open_partitioned().
+		"""
+		
+		connection = self.connect(self.disk_db)
+		if semester is not None:
+			SemesterPartitions(self.disk_db, semester).enable(connection)
+		return connection
+	
+	@staticmethod
+	def close_thread(connection):
+		"""Close a connection from connect_thread."""
+		
+		AttendanceDB.cursors.pop(connection, None)
+		connection.close()
+	
+	def close_shared(self, connection):
+		"""Close a connection from open_shared and release the lock."""
+		
+		AttendanceDB.cursors.pop(connection, None)
+		connection.close()
+		if self.lock is not None:
+			self.lock.release()
+			self.lock = None
+	
+	@staticmethod
+	def bus(connection):
+		"""Return the ChangeBus that publishes a connection's committed changes."""
+		
+		return ChangeBus.for_connection(connection)
+	
+	@staticmethod
+	@contextmanager
+	def profile(connection):
+		"""Trace the statements a with block runs on a connection; yields the QueryProfiler."""
+		
+		profiler = QueryProfiler(connection)
+		profiler.install()
+		try:
+			yield profiler
+		finally:
+			profiler.uninstall()
+	
+	@staticmethod
+	def columns(table, connection, semester=None, start=None, end=None, as_numpy=False):
+		"""Return a table's analytics columns as typed arrays, filtered by Semester or datetime range.
+		
+		See ColumnExport for the tables and columns.
+		"""
+		
+		return ColumnExport.select(table, connection, semester, start, end, as_numpy)
+	
+	def find_conflicted_copies(self):
+		"""Return the paths of Dropbox "conflicted copy" versions of the disk DB."""
+		
+		base, extension = os.path.splitext(self.disk_db)
+		pattern = glob.escape(base) if hasattr(glob, 'escape') else base
+		return sorted(glob.glob(pattern + ' (*conflicted copy*)' + extension))
+	
+	@staticmethod
+	def sqlite_order(row, width):
+		"""Sort key matching SQLite's ORDER BY for the first width columns of a row."""
+		
+		key = []
+		for value in row[:width]:
+			if value is None:
+				key.append((0, None))
+			elif isinstance(value, (int, long, float)):
+				key.append((1, value))
+			elif isinstance(value, basestring):
+				key.append((2, value))
+			else:
+				key.append((3, value))
+		return key
+	
+	def merge_conflicted_copy(self, path, connection):
+		"""Merge a conflicted copy of the DB into connection, then rename it to *.merged.
+		
+		Each table in MERGE_KEYS is read from both databases in key order and
+		diffed in one pass, with the copy's references translated to the main
+		DB's IDs. Rows only in the copy are added (under new IDs, for tables
+		that have them); rows whose key is in both but whose contents differ
+		keep the main DB's version and are reported as conflicts, as are rows
+		whose parent row wasn't merged or that the main DB ignored.
+		@return: Dict of table name -> (rows added, list of conflicting keys).
+		"""
+		
+		summary = {}
+		cur = connection.cursor()
+		cur.execute('ATTACH ? AS conflict', (path,))
+		try:
+			with AttendanceDB.transaction(connection):
+				# Copy's ID -> main DB's ID, per table; NULL for rows that weren't merged
+				cur.execute('CREATE TEMP TABLE IF NOT EXISTS merge_ids (tbl TEXT, old INTEGER, new INTEGER, PRIMARY KEY (tbl, old))')
+				cur.execute('DELETE FROM temp.merge_ids')
+				for (table, key, references) in AttendanceDB.MERGE_KEYS:
+					# Per-Semester tables are absent from a partitioned core file
+					sql = "SELECT (SELECT COUNT(*) FROM main.sqlite_master WHERE name=?1) * (SELECT COUNT(*) FROM conflict.sqlite_master WHERE name=?1)"
+					if list(cur.execute(sql, (table,)))[0][0] == 0:
+						continue
+					summary[table] = AttendanceDB.merge_table(table, key, references, connection)
+				cur.execute('DROP TABLE temp.merge_ids')
+		finally:
+			cur.execute('DETACH conflict')
+			cur.close()
+		os.rename(path, path + '.merged')
+		return summary
+	
+	@staticmethod
+	def merge_table(table, key, references, connection):
+		"""Merge one table of the attached conflicted copy; see merge_conflicted_copy()."""
+		
+		cur = connection.cursor()
+		info = list(cur.execute('PRAGMA main.table_info(%s)' % table))
+		columns = [row[1] for row in info]
+		types = dict((row[1], row[2]) for row in info)
+		
+		def translated(column, target):
+			return "(SELECT new FROM temp.merge_ids WHERE tbl='%s' AND old=theirs.%s)" % (target, column)
+		
+		def select(translate):
+			"""SQL for the copy's rows with the given references translated, after a flag for a missing parent."""
+			
+			missing = ' OR '.join('(theirs.%s IS NOT NULL AND %s IS NULL)' % (column, translated(column, target)) 
+				for (column, target) in translate if column != 'id') or '0'
+			targets = dict(translate)
+			fields = [('CAST(%s AS %s) AS %s' % (translated(column, targets[column]), types[column], column)) if column in targets else 'theirs.%s AS %s' % (column, column) 
+				for column in columns]
+			return 'SELECT %s AS merge_orphan, %s FROM conflict.%s AS theirs' % (missing, ', '.join(fields), table)
+		
+		remapped = ('id', table) in references
+		if remapped:
+			# Copy rows matching a main row on the key take its ID, the rest new ones after the main DB's
+			parents = [(column, target) for (column, target) in references if target != table]
+			join = ' AND '.join('copy.%s IS mine.%s' % (column, column) for column in key)
+			cur.execute('INSERT OR IGNORE INTO temp.merge_ids SELECT ?, copy.id, mine.id FROM (%s) AS copy JOIN main.%s AS mine ON %s WHERE NOT copy.merge_orphan' % (
+				select(parents), table, join), (table,))
+			last = list(cur.execute('SELECT IFNULL(MAX(id), 0) FROM main.%s' % table))[0][0]
+			unmatched = list(cur.execute('SELECT id FROM conflict.%s WHERE id NOT IN (SELECT old FROM temp.merge_ids WHERE tbl=?) ORDER BY id' % table, (table,)))
+			if len(unmatched) > 0:
+				cur.executemany('INSERT INTO temp.merge_ids VALUES (?,?,?)', [(table, row[0], last + 1 + i) for (i, row) in enumerate(unmatched)])
+		
+		order = ', '.join(key)
+		fields = ', '.join(columns)
+		main_cur = connection.cursor()
+		copy_cur = connection.cursor()
+		main_rows = main_cur.execute('SELECT %s, %s FROM main.%s ORDER BY %s' % (order, fields, table, order))
+		copy_rows = copy_cur.execute('SELECT merge_orphan, %s, %s FROM (%s) ORDER BY %s' % (order, fields, select(references), order))
+		added = []
+		conflicts = []
+		dropped = []		# Rows of the copy that won't be merged, so their children aren't either
+		width = len(key)
+		mine = next(main_rows, None)
+		for row in copy_rows:
+			theirs = row[1:]
+			if row[0]:
+				conflicts.append(theirs[:width])
+				dropped.append(theirs)
+				continue
+			while mine is not None and AttendanceDB.sqlite_order(mine, width) < AttendanceDB.sqlite_order(theirs, width):
+				mine = next(main_rows, None)
+			if mine is None or AttendanceDB.sqlite_order(mine, width) > AttendanceDB.sqlite_order(theirs, width):
+				added.append(theirs)
+			elif mine[width:] != theirs[width:]:
+				conflicts.append(theirs[:width])
+		main_cur.close()
+		copy_cur.close()
+		
+		count = 0
+		sql = 'INSERT OR IGNORE INTO main.%s (%s) VALUES (%s)' % (table, fields, ','.join('?' * len(columns)))
+		for theirs in added:
+			cur.execute(sql, theirs[width:])
+			if connection.changes() > 0:
+				count += 1
+			else:
+				conflicts.append(theirs[:width])
+				dropped.append(theirs)
+		if remapped and len(dropped) > 0:
+			position = width + columns.index('id')
+			cur.executemany('UPDATE temp.merge_ids SET new=NULL WHERE tbl=? AND new=?', [(table, theirs[position]) for theirs in dropped])
+		cur.close()
+		return (count, conflicts)
+	
+	def create_tables(self, connection, partitioned=False):
+		"""Create the database tables.
+		
+		With partitioned=True the per-Semester tables are left out; they live in
+		SemesterPartitions files instead.
+		"""
 		
 		try:
 			cur = connection.cursor()
@@ -106,91 +760,197 @@ class AttendanceDB(object):
 			credit INTEGER NOT NULL, 
 			UNIQUE(student ASC, group_id ASC) ON CONFLICT REPLACE)''')
 
-			cur.execute('''CREATE TABLE IF NOT EXISTS absences
-			(student INTEGER REFERENCES students(id) ON DELETE CASCADE ON UPDATE CASCADE, 
+			cur.execute('''CREATE TABLE IF NOT EXISTS terms
+			(name TEXT PRIMARY KEY,
+			startdate TEXT UNIQUE,
+			enddate TEXT UNIQUE)''')
+			
+			cur.execute('''CREATE TABLE IF NOT EXISTS semesters
+			(name TEXT PRIMARY KEY,
+			termone TEXT REFERENCES terms(name) ON DELETE RESTRICT ON UPDATE CASCADE,
+			termtwo TEXT REFERENCES terms(name) ON DELETE RESTRICT ON UPDATE CASCADE)''')
+			
+			# Days where WPI closed (holidays, snow days, etc)
+			cur.execute('CREATE TABLE IF NOT EXISTS daysoff (date TEXT PRIMARY KEY)')
+			
+			if not partitioned:
+				AttendanceDB.create_semester_tables(connection)
+			
+			# Semesters whose signins SemesterRollup has compacted
+			cur.execute('''CREATE TABLE IF NOT EXISTS rollups
+			(semester TEXT PRIMARY KEY REFERENCES semesters(name) ON DELETE CASCADE ON UPDATE CASCADE, 
+			rolled_up TEXT NOT NULL, 
+			archived INTEGER NOT NULL, 
+			archive TEXT)''')
+			
+			# Positions reached by incremental importers, see ImportCheckpoint
+			cur.execute('''CREATE TABLE IF NOT EXISTS import_checkpoints
+			(source TEXT PRIMARY KEY, 
+			position TEXT, 
+			updated TEXT)''')
+			
+			# Excuse mail from senders who aren't Students (yet); see ExcuseImporter
+			cur.execute('''CREATE TABLE IF NOT EXISTS pending_excuses
+			(id INTEGER PRIMARY KEY, 
+			source TEXT NOT NULL, 
+			sender TEXT NOT NULL, 
+			dt TEXT NOT NULL, 
+			reason TEXT)''')
+			
+			# Google Calendar mutations waiting for the network, one pending insert or update per
+			# Event. event isn't a foreign key, as a pending delete outlives its Event.
+			cur.execute('''CREATE TABLE IF NOT EXISTS gcal_outbox
+			(id INTEGER PRIMARY KEY, 
+			event INTEGER NOT NULL, 
+			operation TEXT NOT NULL, 
+			calendar TEXT NOT NULL, 
+			resource TEXT NOT NULL, 
+			queued TEXT NOT NULL, 
+			attempts INTEGER NOT NULL DEFAULT 0, 
+			last_error TEXT)''')
+			cur.execute('CREATE INDEX IF NOT EXISTS gcal_outbox_event ON gcal_outbox (event)')
+		
+		
+		finally:
+			cur.close()
+		ChangeLog.create(connection, ChangeLog.CORE_KEYS)
+	
+	@staticmethod
+	def create_semester_tables(connection, schema='main', id_base=None):
+		"""Create the tables that hold one Semester's data: events, signins, excuses and absences.
+		
+		In the main DB these reference students, groups and semesters. A
+		SemesterPartitions file gets the same tables without those references,
+		since SQLite can't enforce foreign keys across files, and its event and
+		excuse IDs start after id_base so they are unique across partitions.
+		"""
+		
+		def core(reference):
+			if schema == 'main':
+				return reference
+			return ''
+		if id_base is None:
+			key = 'INTEGER PRIMARY KEY'
+		else:
+			key = 'INTEGER PRIMARY KEY AUTOINCREMENT'
+		tables = {'schema' : schema, 'key' : key,
+			'students' : core('REFERENCES students(id) ON DELETE CASCADE ON UPDATE CASCADE'),
+			'groups' : core('REFERENCES groups(id) ON DELETE CASCADE ON UPDATE CASCADE'),
+			'semesters' : core('REFERENCES semesters(name) ON DELETE CASCADE ON UPDATE CASCADE')}
+		
+		try:
+			cur = connection.cursor()
+			cur.execute('''CREATE TABLE IF NOT EXISTS %(schema)s.absences
+			(student INTEGER %(students)s, 
 			type TEXT, 
 			event INTEGER REFERENCES events(id) ON DELETE CASCADE ON UPDATE CASCADE, 
 			excuseid TEXT REFERENCES excuses(id) ON DELETE CASCADE ON UPDATE CASCADE, 
-			CONSTRAINT pk_absence PRIMARY KEY (event, student))''')
+			CONSTRAINT pk_absence PRIMARY KEY (event, student))''' % tables)
 			
-			cur.execute('''CREATE TABLE IF NOT EXISTS excuses
-			(id INTGER PRIMARY KEY, 
+			cur.execute('''CREATE TABLE IF NOT EXISTS %(schema)s.excuses
+			(id %(key)s, 
 			dt TEXT, 
 			event INTEGER REFERENCES events(id) ON DELETE CASCADE ON UPDATE CASCADE,
 			reason TEXT, 
-			student INTEGER REFERENCES students(id) ON DELETE CASCADE ON UPDATE CASCADE)''')
+			student INTEGER %(students)s)''' % tables)
 			
-			cur.execute('''CREATE TABLE IF NOT EXISTS signins
+			cur.execute('''CREATE TABLE IF NOT EXISTS %(schema)s.signins
 			(dt TEXT, 
 			event INTEGER REFERENCES events(id) ON DELETE CASCADE ON UPDATE CASCADE,
-			student INTEGER REFERENCES students(id) ON DELETE CASCADE ON UPDATE CASCADE, 
+			student INTEGER %(students)s, 
 			CONSTRAINT pk_signin PRIMARY KEY (dt, student), 
 			UNIQUE(event ASC, student ASC), 
-			UNIQUE(student ASC, dt ASC) )''')
+			UNIQUE(student ASC, dt ASC) )''' % tables)
 			
-			cur.execute('''CREATE TABLE IF NOT EXISTS events
-			(id INTEGER PRIMARY KEY, 
+			cur.execute('''CREATE TABLE IF NOT EXISTS %(schema)s.events
+			(id %(key)s, 
 			eventname TEXT NOT NULL, 
 			description TEXT, 
 			location TEXT, 
 			start TEXT NOT NULL, 
 			end TEXT NOT NULL, 
 			eventtype TEXT, 
-			group_id INTEGER REFERENCES groups(id) ON DELETE CASCADE ON UPDATE CASCADE, 
-			semester TEXT REFERENCES semesters(name) ON DELETE CASCADE ON UPDATE CASCADE,
+			group_id INTEGER %(groups)s, 
+			semester TEXT %(semesters)s,
 			gcal_id TEXT UNIQUE, 
-			UNIQUE(group_id ASC, start ASC) )''')
+			UNIQUE(group_id ASC, start ASC) )''' % tables)
 			
-			cur.execute('''CREATE TABLE IF NOT EXISTS terms
-			(name TEXT PRIMARY KEY,
-			startdate TEXT UNIQUE,
-			enddate TEXT UNIQUE)''')
+			ChangeLog.create(connection, ChangeLog.SEMESTER_KEYS, schema)
 			
-			cur.execute('''CREATE TABLE IF NOT EXISTS semesters
-			(name TEXT PRIMARY KEY,
-			termone TEXT REFERENCES terms(name) ON DELETE RESTRICT ON UPDATE CASCADE,
-			termtwo TEXT REFERENCES terms(name) ON DELETE RESTRICT ON UPDATE CASCADE)''')
+			if id_base is not None:
+				for table in ('events', 'excuses'):
+					if len(list(cur.execute('SELECT seq FROM %s.sqlite_sequence WHERE name=?' % schema, (table,)))) == 0:
+						cur.execute('INSERT INTO %s.sqlite_sequence VALUES (?,?)' % schema, (table, id_base,))
 			
-			# Days where WPI closed (holidays, snow days, etc)
-			cur.execute('CREATE TABLE IF NOT EXISTS daysoff (date TEXT PRIMARY KEY)')
+			# Full-text index over excuse reasons, kept in sync with excuses by triggers
+			indexed = len(list(cur.execute("SELECT name FROM %s.sqlite_master WHERE name='excuses_fts'" % schema))) == 1
+			cur.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS %(schema)s.excuses_fts 
+			USING fts5(reason, content='excuses', content_rowid='id')''' % tables)
+			cur.execute('''CREATE TRIGGER IF NOT EXISTS %(schema)s.excuses_fts_insert AFTER INSERT ON excuses BEGIN 
+			INSERT INTO excuses_fts(rowid, reason) VALUES (new.id, new.reason); END''' % tables)
+			cur.execute('''CREATE TRIGGER IF NOT EXISTS %(schema)s.excuses_fts_delete AFTER DELETE ON excuses BEGIN 
+			INSERT INTO excuses_fts(excuses_fts, rowid, reason) VALUES ('delete', old.id, old.reason); END''' % tables)
+			cur.execute('''CREATE TRIGGER IF NOT EXISTS %(schema)s.excuses_fts_update AFTER UPDATE OF id, reason ON excuses BEGIN 
+			INSERT INTO excuses_fts(excuses_fts, rowid, reason) VALUES ('delete', old.id, old.reason); 
+			INSERT INTO excuses_fts(rowid, reason) VALUES (new.id, new.reason); END''' % tables)
+			if not indexed:	# Index excuses written before the index existed
+				cur.execute("INSERT INTO %s.excuses_fts(excuses_fts) VALUES ('rebuild')" % schema)
 			
+			# Per-(event, student) outcomes of a rolled-up Semester, see SemesterRollup
+			cur.execute('''CREATE TABLE IF NOT EXISTS %(schema)s.event_outcomes
+			(event INTEGER REFERENCES events(id) ON DELETE CASCADE ON UPDATE CASCADE, 
+			student INTEGER %(students)s, 
+			outcome TEXT NOT NULL, 
+			minutes_late INTEGER, 
+			PRIMARY KEY (event, student)) WITHOUT ROWID''' % tables)
+		
 		finally:
 			cur.close()
 	
 	def read_attendance(self, infile):
-		"""Parse the attendance record spreadsheet and write to the database."""
-		
-		try:
-			signins = []
-			with open(infile, 'rb') as f:
-				reader = csv.reader(f, delimiter=',')
-				for row in reader:
-					# row[0] is the mystery blank column
-					# row[1] is the date MM/D/YYYY
-					# row[2] is the 24-hour time HH:MM 
-					# row[3] is the RFID number
-					date = row[1].split('/')
-					time = row[2].split(':')
-					dt = datetime.datetime(int(date[2]), int(date[0]), int(date[1]), int(time[0]), int(time[1]), tzinfo=TIMEZONES['EST'])
-					# The record variable formatting matches the Sigin.__init__ arguments list
-					record = (dt, None, int(row[3]))
-					signins.append(record)
-			
-			cur = self.memory.cursor()
-			
-			for t in signins:
-				# Check that student ID is in DB, if not, create a blank entry
-				if Student.select_by_id(t[3]) is None:
-					new_student = Student(t[3], None, None, None)
-					print 'Adding unknown member to database, RFID# = ', t[3]
-					new_student.insert(self.memory)
-			cur.executemany('INSERT OR ABORT INTO signins VALUES (?,?,?)', signins)
-			
-		finally:
-			cur.close()
+		"""Parse the attendance record spreadsheet and write to the database.
+		
+		Returns the SigninMerge counts.
+		"""
+		
+		return SigninMerge(self.memory).run([infile])
 
 gcdb = AttendanceDB()
 
+class WriteBatch(object):
+	
+	"""A long run of writes committed in transactions of about size operations each.
+	
+	Call tick() after each write (or tick(n) after n). Nested inside another
+	transaction it never commits early; the enclosing transaction decides.
+	"""
+	
+	def __init__(self, connection, size=1000):
+		self.connection = connection
+		self.size = size
+		self.count = 0
+		self.outermost = False
+		self.context = None
+	
+	def __enter__(self):
+		self.outermost = self.connection.getautocommit()
+		self.context = AttendanceDB.transaction(self.connection)
+		self.context.__enter__()
+		return self
+	
+	def __exit__(self, exc_type, exc_value, tb):
+		return self.context.__exit__(exc_type, exc_value, tb)
+	
+	def tick(self, count=1):
+		"""Count writes, committing and starting a new transaction every size of them."""
+		
+		self.count += count
+		if self.outermost and self.count >= self.size:
+			self.context.__exit__(None, None, None)
+			self.context = AttendanceDB.transaction(self.connection)
+			self.context.__enter__()
+			self.count = 0
+
 class RosterException(Exception):
 	
 	"""Exception raised when something goes wrong parsing a roster spreadsheet."""
@@ -217,70 +977,728 @@ class DatabaseException(Exception):
 	def __str__(self):
 		return repr(self.text)
 
-class Term(object):
+class ImportCheckpoint(object):
 	
-	"""Corresponds to one 7-week term on WPI's academic calendar."""
+	"""How far an incremental importer got through one of its sources.
 	
-	__slots__ = ["name", "start_date", "end_date", "days_off"]
+	Positions are opaque strings owned by the importer (a byte offset, a
+	Maildir key, a Gmail history ID, ...) stored in the import_checkpoints table.
+	"""
 	
-	@classmethod
-	def new_from_row(cls, row):
-		"""Given a terms row from the DB, returns a Term object."""
+	@staticmethod
+	def get(source, connection):
+		"""Return the saved position for a source, or None if it was never imported."""
 		
-		return cls(row[0], convert_date(row[1]), convert_date(row[2]))
+		try:
+			cur = AttendanceDB.cursor(connection)
+			position = None
+			rows = list(cur.execute('SELECT position FROM import_checkpoints WHERE source=?', (source,)))
+			if len(rows) == 1:
+				position = rows[0][0]
+		
+		finally:
+			AttendanceDB.release(cur)
+			return position
 	
 	@staticmethod
-	def select_by_name(name, connection):
-		"""Return the Term of given name."""
+	def set(source, position, connection):
+		"""Save the position reached in a source."""
 		
 		try:
-			cur = connection.cursor()
-			term = None
-			rows = list(cur.execute('SELECT * FROM terms WHERE name=?', (name,)))
-			if len(rows) > 1 or len(rows) < 0:
-				raise DatabaseException(Term.select_by_name.__name__, "Query returned %s rows, expected one." % len(rows))
-			elif len(rows) == 1:
-				#print 'No term row found!'
-				term = Term.new_from_row(rows[0], connection)
-			elif len(rows) == 0:
-				#print 'No term rows found'
-				term = None
+			cur = AttendanceDB.cursor(connection)
+			
+			params = (source, position, datetime.now(TZ_EST).isoformat(),)
+			cur.execute('INSERT OR REPLACE INTO import_checkpoints VALUES (?,?,?)', params)
+		
+		finally:
+			AttendanceDB.release(cur)
+
+# One ChangeLog row: key is the changed row's key columns, as a list
+Change = namedtuple('Change', ['seq', 'table', 'key', 'operation'])
+
+class ChangeLog(object):
+	
+	"""Trigger-maintained log of inserts, updates and deletes, for incremental consumers.
 	
+	Each logged table gets triggers that append (table, key, operation) to the
+	changelog table of the same DB file, under an AUTOINCREMENT sequence
+	number. OP_INSERT and OP_UPDATE both mean "the row with this key now
+	exists"; an update that changes the key also logs OP_DELETE for the old
+	key. Consumers read the log through a ChangeCursor. Only changes made
+	after the triggers were created are logged, so a new consumer should load
+	the tables once, then follow the log.
+	"""
+	
+	OP_INSERT = 'I'
+	OP_UPDATE = 'U'
+	OP_DELETE = 'D'
+	
+	# Logged tables of the core DB file and of each Semester's tables, with their key columns
+	CORE_KEYS = [
+		('students', ('id',)), 
+		('group_memberships', ('student', 'group_id',))]
+	SEMESTER_KEYS = [
+		('events', ('id',)), 
+		('signins', ('dt', 'student',)), 
+		('excuses', ('id',)), 
+		('absences', ('event', 'student',))]
+	
+	@staticmethod
+	def create(connection, keys, schema='main'):
+		"""Create the changelog table of a schema and the triggers of its logged tables."""
+		
+		try:
+			cur = AttendanceDB.cursor(connection)
+			cur.execute('''CREATE TABLE IF NOT EXISTS %s.changelog
+			(seq INTEGER PRIMARY KEY AUTOINCREMENT, 
+			tbl TEXT NOT NULL, 
+			pk TEXT NOT NULL, 
+			op TEXT NOT NULL)''' % schema)
+			
+			for (table, columns) in keys:
+				names = {'schema' : schema, 'table' : table, 
+					'old' : 'json_array(%s)' % ', '.join('old.' + column for column in columns), 
+					'new' : 'json_array(%s)' % ', '.join('new.' + column for column in columns), 
+					'insert' : ChangeLog.OP_INSERT, 'update' : ChangeLog.OP_UPDATE, 'delete' : ChangeLog.OP_DELETE}
+				cur.execute('''CREATE TRIGGER IF NOT EXISTS %(schema)s.changelog_%(table)s_insert AFTER INSERT ON %(table)s BEGIN 
+				INSERT INTO changelog (tbl, pk, op) VALUES ('%(table)s', %(new)s, '%(insert)s'); END''' % names)
+				cur.execute('''CREATE TRIGGER IF NOT EXISTS %(schema)s.changelog_%(table)s_update AFTER UPDATE ON %(table)s BEGIN 
+				INSERT INTO changelog (tbl, pk, op) SELECT '%(table)s', %(old)s, '%(delete)s' WHERE %(old)s IS NOT %(new)s; 
+				INSERT INTO changelog (tbl, pk, op) VALUES ('%(table)s', %(new)s, '%(update)s'); END''' % names)
+				cur.execute('''CREATE TRIGGER IF NOT EXISTS %(schema)s.changelog_%(table)s_delete AFTER DELETE ON %(table)s BEGIN 
+				INSERT INTO changelog (tbl, pk, op) VALUES ('%(table)s', %(old)s, '%(delete)s'); END''' % names)
+		
 		finally:
-			cur.close()
-			return term
+			AttendanceDB.release(cur)
 	
 	@staticmethod
-	def select_by_date(start_date, end_date, connection):
-		"""Return the list of Terms in a given datetime range. 
+	def logs(connection):
+		"""Return (name, changelog table) pairs for every log a connection's DB has.
 		
-		Any Term whose startdate or enddate column falls within the
-		given range will be returned.
+		The core file's log is named 'main'; with SemesterPartitions each
+		Semester's file has its own log, named after the Semester.
 		"""
 		
-		terms = []
-		
-		if type(start_date == date):
-			start_date = start_date.isoformat()
-		if type(end_date == date):
-			end_date = end_date.isoformat()
+		if SemesterPartitions.for_connection(connection) is None:
+			return [('main', 'changelog')]
+		logs = [('main', 'main.changelog')]
+		try:
+			cur = AttendanceDB.cursor(connection)
+			
+			semesters = [row[0] for row in cur.execute('SELECT semester FROM main.partitions ORDER BY ordinal')]
 		
+		finally:
+			AttendanceDB.release(cur)
+		for semester in semesters:
+			logs.append((semester, SemesterPartitions.tables('changelog', connection, semester=semester)[0]))
+		return logs
+	
+	@staticmethod
+	def changes(log, since, connection, limit=None):
+		"""Return the list of Changes in a changelog table after sequence number since."""
+		
+		changes = []
+		sql = 'SELECT seq, tbl, pk, op FROM %s WHERE seq > ? ORDER BY seq' % log
+		params = (since,)
+		if limit is not None:
+			sql += ' LIMIT ?'
+			params = (since, limit,)
 		try:
-			cur = connection.cursor()
-			sql = 'SELECT * FROM terms WHERE startdate BETWEEN ?1 AND ?2 UNION SELECT * FROM terms WHERE enddate BETWEEN ?1 AND ?2'
-			params = (start_date, end_date,)
+			cur = AttendanceDB.cursor(connection)
+			
 			for row in cur.execute(sql, params):
-				terms.append(Term.new_from_row(row, connection))
-				
+				changes.append(Change(row[0], row[1], json.loads(row[2]), row[3]))
+		
 		finally:
-			cur.close()
-			return terms
+			AttendanceDB.release(cur)
+		return changes
 	
 	@staticmethod
-	def select_by_all(name, start_date, end_date, connection):
-		"""Return a list of Terms using any combination of filters."""
+	def prune(connection):
+		"""Delete the changes every ChangeCursor has saved past, and return how many."""
 		
-		terms = []
+		pruned = 0
+		positions = []
+		try:
+			cur = AttendanceDB.cursor(connection)
+			
+			for row in cur.execute('SELECT position FROM import_checkpoints WHERE source LIKE ?', (ChangeCursor.PREFIX + '%',)):
+				positions.append(json.loads(row[0]))
+			if len(positions) == 0:
+				return 0
+			for (name, log) in ChangeLog.logs(connection):
+				seq = min(position.get(name, 0) for position in positions)
+				cur.execute('DELETE FROM %s WHERE seq <= ?' % log, (seq,))
+				pruned += connection.changes()
+		
+		finally:
+			AttendanceDB.release(cur)
+		return pruned
+
+class ChangeCursor(object):
+	
+	"""A named consumer's position in the ChangeLog.
+	
+	read() returns the changes since the last read and advances the cursor in
+	memory; commit() saves it as an ImportCheckpoint, ideally in the same
+	transaction as whatever the consumer did with the changes.
+	"""
+	
+	PREFIX = 'changelog:'
+	
+	def __init__(self, consumer, connection):
+		self.source = ChangeCursor.PREFIX + consumer
+		self.connection = connection
+		position = ImportCheckpoint.get(self.source, connection)
+		if position is None:
+			self.positions = {}		# Log name -> last sequence number read
+		else:
+			self.positions = json.loads(position)
+	
+	def read(self, limit=None):
+		"""Return the list of Changes since the last read, at most limit per log."""
+		
+		changes = []
+		for (name, log) in ChangeLog.logs(self.connection):
+			batch = ChangeLog.changes(log, self.positions.get(name, 0), self.connection, limit)
+			if len(batch) > 0:
+				self.positions[name] = batch[-1].seq
+			changes.extend(batch)
+		return changes
+	
+	def commit(self):
+		"""Save the cursor position."""
+		
+		ImportCheckpoint.set(self.source, json.dumps(self.positions), self.connection)
+
+class ChangeBus(object):
+	
+	"""In-process publish/subscribe of committed row changes on one connection.
+	
+	Built on apsw's update, commit and rollback hooks, which are only
+	installed while there are subscribers, so an unwatched connection (e.g.
+	bulk ingest) pays nothing. Row changes are coalesced per transaction
+	(an insert then update is an insert, an insert then delete is nothing) and
+	delivered once, on commit, as a dict of table -> {rowid: ChangeLog.OP_*}.
+	Tables outside the main schema are named 'schema.table'.
+	
+	SQLite reports no rollback to a savepoint, so AttendanceDB.transaction()
+	calls savepoint() and release() around its nested blocks; changes rolled
+	back by apsw's "with connection:" inside a transaction are still
+	delivered. SQLite's update hook also misses some changes: a row deleted
+	by REPLACE conflict resolution (INSERT OR REPLACE, group_memberships'
+	ON CONFLICT REPLACE) isn't reported, only the row that replaced it, and
+	WITHOUT ROWID tables (event_outcomes) aren't reported at all. A
+	subscriber that needs every removed row should re-read the table when it
+	is reported; writers of a WITHOUT ROWID table call touch().
+	
+	Subscribers run inside the commit hook, so they must not use the
+	connection; a GUI should hand the notification to its event loop (e.g.
+	wx.CallAfter) and query from there.
+	"""
+	
+	__slots__ = ["connection", "subscribers", "pending", "undo", "generations", "installed", "__weakref__"]
+	
+	OPERATIONS = {apsw.SQLITE_INSERT : ChangeLog.OP_INSERT, 
+		apsw.SQLITE_UPDATE : ChangeLog.OP_UPDATE, 
+		apsw.SQLITE_DELETE : ChangeLog.OP_DELETE}
+	
+	# (operation so far, new operation) -> coalesced operation, None to forget the row
+	COALESCE = {(ChangeLog.OP_INSERT, ChangeLog.OP_UPDATE) : ChangeLog.OP_INSERT, 
+		(ChangeLog.OP_INSERT, ChangeLog.OP_DELETE) : None, 
+		(ChangeLog.OP_DELETE, ChangeLog.OP_INSERT) : ChangeLog.OP_UPDATE}
+	
+	buses = weakref.WeakKeyDictionary()	# connection -> ChangeBus
+	
+	@staticmethod
+	def for_connection(connection):
+		"""Return the ChangeBus of a connection, creating it if needed."""
+		
+		bus = ChangeBus.buses.get(connection)
+		if bus is None:
+			bus = ChangeBus(connection)
+			ChangeBus.buses[connection] = bus
+		return bus
+	
+	def __init__(self, connection):
+		self.connection = weakref.ref(connection)	# The registry keeps the bus alive, not the connection
+		self.subscribers = []	# (callback, set of table names or None for all)
+		self.pending = {}		# table -> {rowid: operation} for the open transaction
+		self.undo = []			# Per open savepoint, {(table, rowid): operation before it, or None}
+		self.generations = {}	# table -> number of committed transactions that changed it
+		self.installed = False
+	
+	def subscribe(self, callback, tables=None):
+		"""Call callback(changes) after each commit that changes one of tables (default all)."""
+		
+		if tables is not None:
+			tables = set(tables)
+		self.subscribers.append((callback, tables))
+		if not self.installed:
+			connection = self.connection()
+			connection.setupdatehook(self.on_update)
+			connection.setcommithook(self.on_commit)
+			connection.setrollbackhook(self.on_rollback)
+			self.installed = True
+	
+	def unsubscribe(self, callback):
+		"""Stop calling callback, removing the hooks if it was the last subscriber."""
+		
+		self.subscribers = [(subscriber, tables) for (subscriber, tables) in self.subscribers if subscriber != callback]
+		if len(self.subscribers) == 0 and self.installed:
+			connection = self.connection()
+			if connection is not None:
+				connection.setupdatehook(None)
+				connection.setcommithook(None)
+				connection.setrollbackhook(None)
+			self.installed = False
+			self.pending = {}
+			self.undo = []
+	
+	def savepoint(self):
+		"""Note that a savepoint was opened, so changes after it can be forgotten."""
+		
+		self.undo.append({})
+	
+	def release(self, rolled_back=False):
+		"""Note that the innermost savepoint was released, after rolling back to it if rolled_back."""
+		
+		if len(self.undo) == 0:		# Subscribed inside the savepoint
+			return
+		undo = self.undo.pop()
+		if rolled_back:
+			for ((table, rowid), operation) in undo.items():
+				rows = self.pending.get(table, {})
+				if operation is None:
+					rows.pop(rowid, None)
+				else:
+					rows[rowid] = operation
+				if len(rows) == 0:
+					self.pending.pop(table, None)
+		elif len(self.undo) > 0:
+			for (key, operation) in undo.items():
+				self.undo[-1].setdefault(key, operation)
+	
+	def touch(self, table):
+		"""Report a change the update hook doesn't see, e.g. to a WITHOUT ROWID table, with a rowid of None.
+		
+		@param table: A table name, schema-qualified outside main.
+		"""
+		
+		if self.installed:
+			(database, dot, name) = table.rpartition('.')
+			self.on_update(apsw.SQLITE_UPDATE, database or 'main', name, None)
+	
+	def on_update(self, type, database, table, rowid):
+		if database != 'main':
+			table = '%s.%s' % (database, table)
+		rows = self.pending.setdefault(table, {})
+		if len(self.undo) > 0:
+			self.undo[-1].setdefault((table, rowid), rows.get(rowid))
+		operation = ChangeBus.OPERATIONS[type]
+		if rowid in rows:
+			operation = ChangeBus.COALESCE.get((rows[rowid], operation), rows[rowid] if operation == ChangeLog.OP_UPDATE else operation)
+			if operation is None:
+				del rows[rowid]
+				return
+		rows[rowid] = operation
+	
+	def on_commit(self):
+		changes = dict((table, rows) for (table, rows) in self.pending.items() if len(rows) > 0)
+		self.pending = {}
+		self.undo = []
+		for table in changes:
+			self.generations[table] = self.generations.get(table, 0) + 1
+		if len(changes) > 0:
+			for (callback, tables) in list(self.subscribers):
+				if tables is not None:
+					wanted = dict((table, rows) for (table, rows) in changes.items() if table.split('.')[-1] in tables)
+				else:
+					wanted = changes
+				if len(wanted) == 0:
+					continue
+				try:
+					callback(wanted)
+				except Exception:
+					# An exception here would roll back a transaction that has nothing wrong with it
+					traceback.print_exc()
+		return False	# Let the commit go ahead
+	
+	def on_rollback(self):
+		self.pending = {}
+		self.undo = []
+
+class QueryCache(object):
+	
+	"""Per-connection LRU cache of select_by_* results.
+	
+	Entries are keyed on the SQL text and parameters and remember the
+	generation of the tables they were built from: PRAGMA data_version (which
+	moves when another connection commits) plus this connection's ChangeBus
+	counter for each table. A lookup whose tables haven't changed is served
+	from memory; the cache also drops entries as soon as the bus reports a
+	commit to one of their tables. Queries on tables with uncommitted changes
+	in the open transaction bypass the cache.
+	
+	Cached model objects are shared between callers, so copy one before
+	changing it without writing it back to the DB.
+	"""
+	
+	__slots__ = ["connection", "entries", "max_entries", "max_bytes", "bytes", "hits", "misses", "evictions", "__weakref__"]
+	
+	MAX_ENTRIES = 1024
+	MAX_BYTES = 8 * 1024 * 1024
+	
+	caches = weakref.WeakKeyDictionary()	# connection -> QueryCache
+	
+	@staticmethod
+	def for_connection(connection):
+		"""Return the QueryCache of a connection, creating it if needed."""
+		
+		cache = QueryCache.caches.get(connection)
+		if cache is None:
+			cache = QueryCache(connection)
+			QueryCache.caches[connection] = cache
+		return cache
+	
+	@staticmethod
+	def sizeof(rows):
+		"""Estimate the memory held by a list of rows, in bytes."""
+		
+		size = sys.getsizeof(rows)
+		for row in rows:
+			size += sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row)
+		return size
+	
+	def __init__(self, connection, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES):
+		self.connection = weakref.ref(connection)
+		self.entries = OrderedDict()	# (sql, params) -> (generation, result, size, tables), least recently used first
+		self.max_entries = max_entries
+		self.max_bytes = max_bytes
+		self.bytes = 0
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		ChangeBus.for_connection(connection).subscribe(self.on_change)
+	
+	def generation(self, tables):
+		"""Return the current generation of tables, or None if the open transaction changed one."""
+		
+		connection = self.connection()
+		bus = ChangeBus.for_connection(connection)
+		for table in tables:
+			if table in bus.pending:
+				return None
+		try:
+			cur = AttendanceDB.cursor(connection)
+			
+			version = list(cur.execute('PRAGMA data_version'))[0][0]
+		
+		finally:
+			AttendanceDB.release(cur)
+		return (version,) + tuple(bus.generations.get(table, 0) for table in tables)
+	
+	def select(self, sql, params, tables, build):
+		"""Return build(rows), where rows are the results of sql, from the cache if possible.
+		
+		@param tables: Every table the result depends on, including those build() reads.
+		@param build: Callable turning the list of rows into the result list.
+		"""
+		
+		key = (sql, params)
+		generation = self.generation(tables)
+		entry = self.entries.pop(key, None)
+		if entry is not None:
+			self.bytes -= entry[2]
+			if entry[0] == generation:
+				self.hits += 1
+				self.entries[key] = entry
+				self.bytes += entry[2]
+				return list(entry[1])
+		self.misses += 1
+		
+		try:
+			cur = AttendanceDB.cursor(self.connection())
+			
+			rows = list(cur.execute(sql, params))
+		
+		finally:
+			AttendanceDB.release(cur)
+		result = build(rows)
+		size = QueryCache.sizeof(rows)
+		if generation is not None and size <= self.max_bytes:
+			self.entries[key] = (generation, result, size, tables)
+			self.bytes += size
+			while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+				self.bytes -= self.entries.popitem(last=False)[1][2]
+				self.evictions += 1
+		return list(result)
+	
+	def on_change(self, changes):
+		"""ChangeBus subscriber: drop the entries built from the changed tables."""
+		
+		for (key, entry) in self.entries.items():
+			if any(table in changes for table in entry[3]):
+				del self.entries[key]
+				self.bytes -= entry[2]
+	
+	def clear(self):
+		"""Drop every entry."""
+		
+		self.entries.clear()
+		self.bytes = 0
+	
+	def stats(self):
+		"""Return a dict of hits, misses, evictions, entries and bytes."""
+		
+		return {'hits' : self.hits, 'misses' : self.misses, 'evictions' : self.evictions, 
+			'entries' : len(self.entries), 'bytes' : self.bytes}
+
+# One profiled statement: calls, total nanoseconds and rows returned
+StatementStats = namedtuple('StatementStats', ['caller', 'sql', 'calls', 'nanoseconds', 'rows'])
+# A statement run at least N_PLUS_ONE times by one caller inside a single outer call
+NPlusOne = namedtuple('NPlusOne', ['outer', 'caller', 'sql', 'calls'])
+
+class QueryProfiler(object):
+	
+	"""Opt-in attribution of every SQL statement on a connection to the model method that ran it.
+	
+	Uses apsw's exec tracer to note the calling stack as each statement
+	starts, its row tracer to count rows returned and the profile callback to
+	time the statement when it finishes. Only frames in this module make up
+	the stack (e.g. Absence.select_by_student;Absence.new_from_row), under the
+	outside function that called in. Statements are aggregated per innermost
+	model method and SQL text; report() lists the top ones and folded()
+	gives flame graph input. A statement run N_PLUS_ONE or more times by the
+	same caller within one outermost model call is flagged as an N+1.
+	
+	Tracing costs a stack walk per statement, so only install it while profiling.
+	"""
+	
+	__slots__ = ["connection", "filename", "names", "stats", "stacks", "pending", "active", 
+		"call_frame", "call_counts", "n_plus_one", "previous", "lock"]
+	
+	N_PLUS_ONE = 10
+	
+	def __init__(self, connection):
+		self.connection = connection
+		self.filename = sys._getframe(0).f_code.co_filename
+		self.names = QueryProfiler.code_names()
+		self.stats = {}			# (caller, sql) -> [calls, nanoseconds, rows]
+		self.stacks = {}		# (stack tuple, sql) -> nanoseconds
+		self.pending = {}		# (thread ID, sql) -> stack of [stack, rows] for running statements
+		self.active = {}		# cursor -> [stack, rows] of its running statement
+		self.call_frame = None	# Outermost module frame of the call being watched for N+1s
+		self.call_counts = {}	# (caller, sql) -> executions within call_frame
+		self.n_plus_one = {}	# (outer, caller, sql) -> most executions within one call
+		self.previous = None
+		self.lock = threading.Lock()
+	
+	@staticmethod
+	def code_names():
+		"""Return a dict of code object -> 'Class.method' for the classes in this module."""
+		
+		names = {}
+		for (class_name, value) in globals().items():
+			if not isinstance(value, type) or value.__module__ != __name__:
+				continue
+			for (name, attribute) in value.__dict__.items():
+				functions = [getattr(attribute, '__func__', attribute)]
+				if isinstance(attribute, property):
+					functions = [attribute.fget, attribute.fset, attribute.fdel]
+				for function in functions:
+					if hasattr(function, '__code__'):
+						names[function.__code__] = '%s.%s' % (class_name, name)
+		return names
+	
+	def install(self):
+		"""Start tracing the connection, chaining any exec tracer already set."""
+		
+		self.previous = self.connection.getexectrace()
+		self.connection.setexectrace(self.on_execute)
+		self.connection.setrowtrace(self.on_row)
+		self.connection.setprofile(self.on_profile)
+	
+	def uninstall(self):
+		"""Stop tracing and restore the previous exec tracer."""
+		
+		self.connection.setexectrace(self.previous)
+		self.connection.setrowtrace(None)
+		self.connection.setprofile(None)
+		with self.lock:
+			self.finish_call()
+			self.call_frame = None
+			self.pending = {}
+			self.active = {}
+	
+	def stack(self, frame):
+		"""Return (stack of frame names, outermost module frame) for a caller's frame.
+		
+		Statements run from outside the module count the caller's frame as outermost.
+		"""
+		
+		names = []
+		outermost = None
+		caller = frame
+		while frame is not None:
+			code = frame.f_code
+			if code.co_filename == self.filename:
+				names.append(self.names.get(code, code.co_name))
+				outermost = frame
+			elif outermost is not None or len(names) == 0:
+				names.append('<%s>' % code.co_name)
+				break
+			frame = frame.f_back
+		names.reverse()
+		return (tuple(names), outermost or caller)
+	
+	def finish_call(self):
+		outer = self.names.get(self.call_frame.f_code, self.call_frame.f_code.co_name) if self.call_frame is not None else None
+		for ((caller, sql), count) in self.call_counts.items():
+			if count >= QueryProfiler.N_PLUS_ONE:
+				key = (outer, caller, sql)
+				self.n_plus_one[key] = max(count, self.n_plus_one.get(key, 0))
+		self.call_counts = {}
+	
+	def on_execute(self, cursor, sql, bindings):
+		if self.previous is not None and not self.previous(cursor, sql, bindings):
+			return False
+		(stack, outermost) = self.stack(sys._getframe(1))
+		record = [stack, 0]
+		with self.lock:
+			self.pending.setdefault((threading.current_thread().ident, sql), []).append(record)
+			self.active[cursor] = record
+			if outermost is not self.call_frame:
+				self.finish_call()
+				self.call_frame = outermost
+			key = (stack[-1], sql)
+			self.call_counts[key] = self.call_counts.get(key, 0) + 1
+		return True
+	
+	def on_row(self, cursor, row):
+		record = self.active.get(cursor)
+		if record is not None:
+			record[1] += 1
+		return row
+	
+	def on_profile(self, sql, nanoseconds):
+		with self.lock:
+			records = self.pending.get((threading.current_thread().ident, sql))
+			if not records:
+				return
+			(stack, rows) = records.pop()
+			stats = self.stats.setdefault((stack[-1], sql), [0, 0, 0])
+			stats[0] += 1
+			stats[1] += nanoseconds
+			stats[2] += rows
+			self.stacks[(stack, sql)] = self.stacks.get((stack, sql), 0) + nanoseconds
+	
+	def statements(self, order='time'):
+		"""Return StatementStats, most total time (or with order='count', most calls) first."""
+		
+		stats = [StatementStats(caller, sql, calls, nanoseconds, rows) for ((caller, sql), (calls, nanoseconds, rows)) in self.stats.items()]
+		if order == 'count':
+			stats.sort(key=lambda s: (-s.calls, -s.nanoseconds))
+		else:
+			stats.sort(key=lambda s: (-s.nanoseconds, -s.calls))
+		return stats
+	
+	def n_plus_ones(self):
+		"""Return the flagged NPlusOnes, most executions first."""
+		
+		with self.lock:
+			self.finish_call()
+		return sorted((NPlusOne(outer, caller, sql, calls) for ((outer, caller, sql), calls) in self.n_plus_one.items()), 
+			key=lambda n: -n.calls)
+	
+	def report(self, limit=20):
+		"""Return the top statements by time and by count, and the N+1s, as text."""
+		
+		def line(s):
+			return '%8d %10.2f %10.1f %8d  %-40s %s' % (s.calls, s.nanoseconds / 1e6, s.nanoseconds / 1e3 / s.calls, s.rows, 
+				s.caller, ' '.join(s.sql.split())[:80])
+		
+		header = '%8s %10s %10s %8s  %-40s %s' % ('calls', 'total ms', 'mean us', 'rows', 'caller', 'statement')
+		lines = ['Top statements by total time', header]
+		lines.extend(line(s) for s in self.statements('time')[:limit])
+		lines.extend(['', 'Top statements by count', header])
+		lines.extend(line(s) for s in self.statements('count')[:limit])
+		for n in self.n_plus_ones():
+			lines.append('N+1: %s runs "%s" %d times in one %s call' % (n.caller, ' '.join(n.sql.split())[:80], n.calls, n.outer))
+		return '\n'.join(lines)
+	
+	def folded(self):
+		"""Return the stacks in flame graph "folded" format, one 'a;b;statement microseconds' line each."""
+		
+		lines = []
+		for ((stack, sql), nanoseconds) in sorted(self.stacks.items()):
+			lines.append('%s;%s %d' % (';'.join(stack), ' '.join(sql.split())[:80].replace(';', ','), nanoseconds // 1000))
+		return '\n'.join(lines)
+
+class Term(object):
+	
+	"""Corresponds to one 7-week term on WPI's academic calendar."""
+	
+	__slots__ = ["name", "start_date", "end_date", "days_off"]
+	
+	@classmethod
+	def new_from_row(cls, row, connection=None):
+		"""Given a terms row from the DB, returns a Term object."""
+		
+		return cls(row[0], convert_date(row[1]), convert_date(row[2]))
+	
+	@staticmethod
+	def select_by_name(name, connection):
+		"""Return the Term of given name."""
+		
+		try:
+			cur = AttendanceDB.cursor(connection)
+			term = None
+			rows = list(cur.execute('SELECT * FROM terms WHERE name=?', (name,)))
+			if len(rows) > 1 or len(rows) < 0:
+				raise DatabaseException(Term.select_by_name.__name__, "Query returned %s rows, expected one." % len(rows))
+			elif len(rows) == 1:
+				#print 'No term row found!'
+				term = Term.new_from_row(rows[0], connection)
+			elif len(rows) == 0:
+				#print 'No term rows found'
+				term = None
+	
+		finally:
+			AttendanceDB.release(cur)
+			return term
+	
+	@staticmethod
+	def select_by_date(start_date, end_date, connection):
+		"""Return the list of Terms in a given datetime range. 
+		
+		Any Term whose startdate or enddate column falls within the
+		given range will be returned.
+		"""
+		
+		terms = []
+		
+		if type(start_date == date):
+			start_date = start_date.isoformat()
+		if type(end_date == date):
+			end_date = end_date.isoformat()
+		
+		try:
+			cur = AttendanceDB.cursor(connection)
+			sql = 'SELECT * FROM terms WHERE startdate BETWEEN ?1 AND ?2 UNION SELECT * FROM terms WHERE enddate BETWEEN ?1 AND ?2'
+			params = (start_date, end_date,)
+			for row in cur.execute(sql, params):
+				terms.append(Term.new_from_row(row, connection))
+				
+		finally:
+			AttendanceDB.release(cur)
+			return terms
+	
+	@staticmethod
+	def select_by_all(name, start_date, end_date, connection):
+		"""Return a list of Terms using any combination of filters."""
+		
+		terms = []
 		
 		if type(start_date == date):
 			start_date = start_date.isoformat()
@@ -288,7 +1706,7 @@ class Term(object):
 			end_date = end_date.isoformat()
 			
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			sql = '''SELECT * FROM terms WHERE startdate BETWEEN ?1 AND ?2 UNION
 			SELECT * FROM terms WHERE enddate BETWEEN ?1 AND ?2 INTERSECT
 			SELECT * FROM terms WHERE name=?3'''
@@ -297,7 +1715,7 @@ class Term(object):
 				terms.append(Term.new_from_row(row, connection))
 				
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 			return terms
 	
 	def __init__(self, name, start_date, end_date, days_off=[]):
@@ -309,71 +1727,52 @@ class Term(object):
 			self.days_off.append(d)	
 	
 	def fetch_days_off(self, connection):
-		"""Fetch all daysoff table entries for this Term from the database.
-		 
-		Returns a list of date objects.
-		"""
+		"""Return the daysoff table entries for this Term as a list of date objects.
 		
-		result = []
-		try:
-			if type(self.start_date == date):
-				start = self.start_date.isoformat()
-			elif type(self.start_date == str):
-				start = self.start_date
-			else:
-				raise TypeError
-				
-			if type(self.end_date == date):
-				end = self.end_date.isoformat()
-			elif type(self.end_date == str):
-				end = self.end_date
-			else:
-				raise TypeError
+		Looked up in the AcademicCalendar for the connection.
+		"""
 		
-			cur = connection.cursor()
-			
-			for row in cur.execute('SELECT * FROM daysoff WHERE date BETWEEN ? AND ?', (start, end,)):
-				result.append(convert_date(row[0]))
-				
-		finally:
-			cur.close()
-			return result
+		calendar = AcademicCalendar.for_connection(connection)
+		return calendar.days_off_between(self.start_date, self.end_date)
 			
 	def update(self, connection):
 		"""Update an existing Term record in the DB."""
 		
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
 			params = (self.name, self.start_date.isoformat(), self.end_date.isoformat(),)
 			cur.execute('UPDATE terms SET name=?1, startdate=?2, enddate=?3 WHERE name=?1', params)
+			AcademicCalendar.invalidate(connection)
 				
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 	
 	def insert(self, connection):
 		"""Write the Term to the DB."""
 		
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
 			params = (self.name, self.start_date.isoformat(), self.end_date.isoformat(), )
 			cur.execute('INSERT INTO terms VALUES (?,?,?)', params)
+			AcademicCalendar.invalidate(connection)
 				
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 	
 	def delete(self, connection):
 		"""Delete the Term from the DB."""
 		
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
 			params = (self.name,)
 			cur.execute('DELETE FROM terms WHERE name=?', params)
+			AcademicCalendar.invalidate(connection)
 				
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 
 class Semester(object):
 	
@@ -385,19 +1784,21 @@ class Semester(object):
 	def new_from_row(cls, row, connection):
 		"""Given a semester row from the DB, returns a Semester object."""
 		
-		t1 = Term.select_by_name(row[1], connnection)
-		t2 = Term.select_by_name(row[2], connnection)
-		semester = cls(row[0], t1, t2)
+		# Terms come from the in-memory calendar rather than two more queries
+		calendar = AcademicCalendar.for_connection(connection)
+		t1 = calendar.term_by_name(row[1])
+		t2 = calendar.term_by_name(row[2])
+		return cls(row[0], t1, t2)
 				
 	@staticmethod
 	def select_by_name(name, connection):
 		"""Return the Semester of given name."""
 		
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
 			params = (name,)
-			rows = list(cur.execute('SELECT * FROM semester WHERE name=?', params))
+			rows = list(cur.execute('SELECT * FROM semesters WHERE name=?', params))
 			if len(rows) > 1 or len(rows) < 0:
 				raise DatabaseException(Semester.select_by_name.__name__, "Query returned %s rows, expected one." % len(rows))
 			elif len(rows) == 1:
@@ -406,7 +1807,7 @@ class Semester(object):
 				semester = None
 				
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 			return semester
 	
 	@staticmethod
@@ -424,7 +1825,7 @@ class Semester(object):
 			end_date = end_date.isoformat()
 			
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
 			sql = '''
 			SELECT * from semesters WHERE termone IN 
@@ -439,7 +1840,7 @@ class Semester(object):
 				semesters.append(Semester.new_from_row(row, connection))
 							
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 			return semesters
 	
 	@staticmethod
@@ -454,7 +1855,7 @@ class Semester(object):
 			end_date = end_date.isoformat()
 			
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
 			sql = '''SELECT * from semesters WHERE termone IN 
 			(SELECT name FROM terms WHERE startdate BETWEEN ?1 AND ?2 UNION 
@@ -469,7 +1870,7 @@ class Semester(object):
 				semesters.append(Semester.new_from_row(row, connection))
 				
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 			return semesters
 	
 	def __init__(self, name, term_one, term_two):
@@ -478,184 +1879,586 @@ class Semester(object):
 		self.term_two = term_two	# B or D term
 		
 	def fetch_days_off(self, connection):
-		"""Fetch all daysoff table entries for this Semester from the database. 
+		"""Return the daysoff table entries for this Semester as a list of date objects.
 		
-		Returns a list of date objects.
+		Looked up in the AcademicCalendar for the connection.
 		"""
 		
-		result = []
-		try:
-			if type(self.term_one.start_date == date):
-				start = self.term_one.start_date.isoformat()
-			elif type(self.term_one.start_date == str):
-				start = self.term_one.start_date
-			else:
-				raise TypeError
-				
-			if type(self.term_two.end_date == date):
-				end = self.term_two.end_date.isoformat()
-			elif type(self.term_two.end_date == str):
-				end = self.term_two.end_date
-			else:
-				raise TypeError
-		
-			cur = connection.cursor()
-			
-			for row in cur.execute('SELECT * FROM daysoff WHERE date BETWEEN ? AND ?', (start, end,)):
-				result.append(convert_date(row[0]))
-				
-		finally:
-			cur.close()
-			return result
+		calendar = AcademicCalendar.for_connection(connection)
+		return calendar.days_off_between(self.term_one.start_date, self.term_two.end_date)
 			
 	def update(self, connection):
 		"""Update an existing Semester record in the DB."""
 		
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
 			params = (self.name, self.term_one.name, self.term_two.name,)
 			cur.execute('UPDATE semesters SET name=?1 termone=?2, termtwo=?3 WHERE name=?1', params)
+			AcademicCalendar.invalidate(connection)
 				
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 	
 	def insert(self, connection):
 		"""Write the Semester to the DB."""
 		
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
 			params = (self.name, self.term_one.name, self.term_two.name,)
 			cur.execute('INSERT INTO semesters VALUES (?,?,?)', params)
+			AcademicCalendar.invalidate(connection)
 				
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 	
 	def delete(self, connection):
 		"""Delete the Semester from the DB."""
 		
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
 			params = (self.name,)
 			cur.execute('DELETE FROM semesters WHERE name=?', params)
+			AcademicCalendar.invalidate(connection)
 				
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 
-class Student(object):
+class AcademicCalendar(object):
 	
-	"""A Student who has signed into the attendance system. 
+	"""In-memory copy of the terms, semesters and daysoff tables.
 	
-	The student's RFID ID number is the primary key column.
+	Answers "which Term/Semester is this date in, and is it a day off" with a
+	bisect over sorted start dates instead of a query. There is one calendar
+	per connection, loaded on first use and reloaded after Term, Semester or
+	day off writes call invalidate().
 	"""
-
-	@classmethod
-	def new_from_row(cls, row):
-		"""Given a students row from the DB, returns a Student object."""
-		
-		return cls(row[0], row[1], row[2], row[3], row[4], row[5])
-
+	
+	__slots__ = ["terms", "term_starts", "semesters", "semester_starts", "days_off", "sorted_days_off", "loaded", "__weakref__"]
+	
+	calendars = weakref.WeakKeyDictionary()	# connection -> AcademicCalendar
+	
 	@staticmethod
-	def select_by_id(id, connection):
-		"""Return the Student of given ID."""
+	def for_connection(connection):
+		"""Return the loaded AcademicCalendar for a connection."""
 		
-		try:
-			cur = connection.cursor()
-			
-			rows = list(cur.execute('SELECT * FROM students WHERE id=?', (id,)))
-			if len(rows) > 1 or len(rows) < 0:
-				raise DatabaseException(Student.select_by_id.__name__, "Query returned %s rows, expected one." % len(rows))
-			elif len(rows) == 1:
-				student = Student.new_from_row(rows[0], connection)
-			elif len(rows) == 0:
-				student = None
-			
-		finally:
-			cur.close()
-			return student
+		calendar = AcademicCalendar.calendars.get(connection)
+		if calendar is None:
+			calendar = AcademicCalendar()
+			AcademicCalendar.calendars[connection] = calendar
+		if not calendar.loaded:
+			calendar.load(connection)
+		return calendar
 	
 	@staticmethod
-	def select_by_name(fname, lname, connection):
-		"""Return the Student(s) of given name."""
+	def invalidate(connection):
+		"""Mark a connection's calendar stale so the next lookup reloads it."""
 		
-		students = []
-		try:
-			cur = connection.cursor()
-			for row in cur.execute('SELECT * FROM students WHERE fname=? AND lname=?', (fname, lname,)):
-				students.append(Student.new_from_row(row, connection))
-				
-		finally:
-			cur.close()
-			return students
+		calendar = AcademicCalendar.calendars.get(connection)
+		if calendar is not None:
+			calendar.loaded = False
 	
 	@staticmethod
-	def select_by_email(email, connection):
-		"""Return the Student(s) with given email address."""
+	def insert_day_off(day, connection):
+		"""Write a day that WPI is closed to the DB."""
 		
-		students = []
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
-			for row in cur.execute('SELECT * FROM students WHERE email=?', (email,)):
-				students.append(Student.new_from_row(row, connection))
-				
+			cur.execute('INSERT OR IGNORE INTO daysoff VALUES (?)', (day.isoformat(),))
+			AcademicCalendar.invalidate(connection)
+		
 		finally:
-			cur.close()
-			return students
+			AttendanceDB.release(cur)
 	
 	@staticmethod
-	def select_by_standing(good_standing, connection):
-		"""Return the list of Students of given standing."""
+	def delete_day_off(day, connection):
+		"""Delete a day off from the DB."""
 		
-		students = []
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
-			for row in cur.execute('SELECT * FROM students WHERE goodstanding=?', (int(good_standing),)):
-				students.append(Student.new_from_row(row, connection))
-				
+			cur.execute('DELETE FROM daysoff WHERE date=?', (day.isoformat(),))
+			AcademicCalendar.invalidate(connection)
+		
 		finally:
-			cur.close()
-			return students
+			AttendanceDB.release(cur)
 	
 	@staticmethod
-	def select_by_group(group, in_group, connection):
-		"""Return the list of Students in some group (or not)."""
+	def as_date(day):
+		"""Return the (Eastern) date of a date or datetime."""
+		
+		if isinstance(day, datetime):
+			if day.tzinfo is not None:
+				day = day.astimezone(TZ_EST)
+			return day.date()
+		return day
+	
+	def __init__(self):
+		self.terms = []				# Terms sorted by start_date
+		self.term_starts = []		# Their start dates, for bisect
+		self.semesters = []			# Semesters sorted by term_one.start_date
+		self.semester_starts = []
+		self.days_off = set()
+		self.sorted_days_off = []
+		self.loaded = False
+	
+	def load(self, connection):
+		"""Read the terms, semesters and daysoff tables."""
 		
-		students = []
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
-			if in_group == True:
-				sql = '''SELECT * FROM students WHERE id IN
-				(SELECT DISTINCT student FROM group_memberships WHERE id=?)'''
-			else:
-				sql = '''SELECT * FROM students WHERE id NOT IN
-				(SELECT DISTINCT student FROM group_memberships WHERE id=?)'''
-
-			for row in cur.execute(sql, (group.id,)):
-				students.append(Student.new_from_row(row, connection))
-				
+			terms = {}
+			for row in cur.execute('SELECT * FROM terms ORDER BY startdate'):
+				terms[row[0]] = Term.new_from_row(row)
+			semesters = []
+			for row in cur.execute('SELECT * FROM semesters'):
+				if row[1] in terms and row[2] in terms:
+					semesters.append(Semester(row[0], terms[row[1]], terms[row[2]]))
+			days_off = [convert_date(row[0]) for row in cur.execute('SELECT date FROM daysoff ORDER BY date')]
+		
 		finally:
-			cur.close()
-			return students
+			AttendanceDB.release(cur)
+		
+		self.terms = sorted(terms.values(), key=lambda t: t.start_date)
+		self.term_starts = [t.start_date for t in self.terms]
+		self.semesters = sorted(semesters, key=lambda s: s.term_one.start_date)
+		self.semester_starts = [s.term_one.start_date for s in self.semesters]
+		self.sorted_days_off = days_off
+		self.days_off = set(days_off)
+		for term in self.terms:
+			term.days_off = self.days_off_between(term.start_date, term.end_date)
+		self.loaded = True
+	
+	def term_by_name(self, name):
+		"""Return the Term of given name, or None."""
+		
+		for term in self.terms:
+			if term.name == name:
+				return term
+		return None
+	
+	def semester_by_name(self, name):
+		"""Return the Semester of given name, or None."""
+		
+		for semester in self.semesters:
+			if semester.name == name:
+				return semester
+		return None
+	
+	def term_for(self, day):
+		"""Return the Term a date falls in, or None (breaks, summer)."""
+		
+		day = AcademicCalendar.as_date(day)
+		i = bisect.bisect_right(self.term_starts, day) - 1
+		if i >= 0 and day <= self.terms[i].end_date:
+			return self.terms[i]
+		return None
+	
+	def semester_for(self, day):
+		"""Return the Semester a date falls in, or None.
+		
+		The break between a Semester's two Terms counts as part of the Semester.
+		"""
+		
+		day = AcademicCalendar.as_date(day)
+		i = bisect.bisect_right(self.semester_starts, day) - 1
+		if i >= 0 and day <= self.semesters[i].term_two.end_date:
+			return self.semesters[i]
+		return None
 	
-	@staticmethod
-	def select_by_current(current, connection):
-		"""Return the list of current Students on the roster (or not)."""
+	def is_day_off(self, day):
+		"""Return whether WPI is closed on a date."""
 		
-		students = []
-		try:
-			cur = connection.cursor()
+		return AcademicCalendar.as_date(day) in self.days_off
+	
+	def days_off_between(self, start, end):
+		"""Return the sorted list of days off from start to end, inclusive."""
+		
+		lo = bisect.bisect_left(self.sorted_days_off, AcademicCalendar.as_date(start))
+		hi = bisect.bisect_right(self.sorted_days_off, AcademicCalendar.as_date(end))
+		return self.sorted_days_off[lo:hi]
+	
+	def classify(self, day):
+		"""Return the (Term, Semester, is_day_off) tuple for a date."""
+		
+		return (self.term_for(day), self.semester_for(day), self.is_day_off(day))
+
+class SemesterPartitions(object):
+	
+	"""Keeps each Semester's events, signins, excuses and absences in its own SQLite file.
+	
+	The shared tables stay in the core DB file. The current Semester's file
+	is ATTACHed first, and the core file has no per-Semester tables, so
+	unqualified SQL (the kiosk, and rows dated in no Semester) resolves to
+	the current Semester. Other Semesters are ATTACHed on demand: readers
+	ask tables() or each() which schema-qualified tables to read, and
+	writers ask table_for() or by_table() where each row belongs. Event and
+	excuse IDs carry their partition's ordinal in the bits above ID_BITS, so
+	an ID alone finds its partition.
+	"""
+	
+	__slots__ = ["core_path", "current", "attached", "__weakref__"]
+	
+	ID_BITS = 32
+	TABLES = ('events', 'signins', 'excuses', 'absences', 'event_outcomes')
+	
+	partitions = weakref.WeakKeyDictionary()	# connection -> SemesterPartitions
+	
+	@staticmethod
+	def for_connection(connection):
+		"""Return the SemesterPartitions of a connection, or None if it isn't partitioned."""
+		
+		return SemesterPartitions.partitions.get(connection)
+	
+	@staticmethod
+	def schema_name(semester_name):
+		"""Return the ATTACH schema name for a Semester, e.g. 'sem_fall_2011'."""
+		
+		return 'sem_' + re.sub(r'\W', '_', semester_name.lower())
+	
+	@staticmethod
+	def tables(table, connection, semester=None, start=None, end=None, row_id=None):
+		"""Return the list of (possibly schema-qualified) names to read a table from.
+		
+		Give a Semester (or name), a date/datetime range, or an event/excuse
+		ID. Without partitioning, or with no filter, this is just [table].
+		"""
+		
+		partitions = SemesterPartitions.for_connection(connection)
+		if partitions is None:
+			return [table]
+		if semester is not None:
+			if hasattr(semester, 'term_one'):	# Probably a Semester object
+				semester = semester.name
+			schemas = [partitions.attach(semester, connection)]
+		elif row_id is not None:
+			schemas = [partitions.schema_for_id(row_id, connection)]
+		elif start is not None:
+			schemas = partitions.schemas_for_range(start, end, connection)
+		else:
+			return [table]
+		return ['%s.%s' % (schema, table) for schema in schemas if schema is not None]
+	
+	@staticmethod
+	def each(table, connection):
+		"""Yield the (possibly schema-qualified) name of a table in every Semester's file.
+		
+		Each file is attached as it is reached, which may detach one reached
+		earlier, so read each table before taking the next.
+		"""
+		
+		partitions = SemesterPartitions.for_connection(connection)
+		if partitions is None:
+			yield table
+			return
+		try:
+			cur = AttendanceDB.cursor(connection)
+			
+			names = [row[0] for row in cur.execute('SELECT semester FROM main.partitions ORDER BY ordinal')]
+		
+		finally:
+			AttendanceDB.release(cur)
+		if partitions.current not in names:
+			names.append(partitions.current)
+		for name in names:
+			yield '%s.%s' % (partitions.attach(name, connection), table)
+	
+	@staticmethod
+	def table_for(table, connection, row_id=None, day=None):
+		"""Return the (possibly schema-qualified) table a row belongs in, for writes.
+		
+		The row is placed by its event or excuse ID, or else by the date or
+		datetime it happened on; with neither, it goes to the current Semester.
+		"""
+		
+		names = []
+		if row_id is not None:
+			names = SemesterPartitions.tables(table, connection, row_id=row_id)
+		if len(names) == 0 and day is not None:
+			names = SemesterPartitions.tables(table, connection, start=day, end=day)
+		if len(names) == 0:
+			return table
+		return names[0]
+	
+	@staticmethod
+	def by_table(table, rows, connection, event=1, dt=0):
+		"""Split rows bound for a per-Semester table by the table each belongs in.
+		
+		Rows are placed by their event ID column, or else by the date of their
+		ISO datetime column, as for table_for(). Yields (table name, rows);
+		each name is resolved as it is yielded, so write its rows before
+		taking the next.
+		"""
+		
+		if SemesterPartitions.for_connection(connection) is None:
+			yield (table, rows)
+			return
+		split = OrderedDict()		# (partition ordinal, None) or (None, date text) -> rows
+		for row in rows:
+			if row[event] is not None:
+				key = (row[event] >> SemesterPartitions.ID_BITS, None)
+			else:
+				key = (None, row[dt][:10])
+			split.setdefault(key, []).append(row)
+		for ((ordinal, day), part) in split.items():
+			if ordinal is not None:
+				yield (SemesterPartitions.table_for(table, connection, row_id=part[0][event]), part)
+			else:
+				yield (SemesterPartitions.table_for(table, connection, day=convert_date(day)), part)
+	
+	def __init__(self, core_path, current):
+		self.core_path = core_path
+		self.current = current		# Name of the Semester attached first
+		self.attached = []			# Attached Semester names, least recently used first
+	
+	def enable(self, connection):
+		"""Set up partitioning on a connection to the core DB file."""
+		
+		try:
+			cur = AttendanceDB.cursor(connection)
+			cur.execute('''CREATE TABLE IF NOT EXISTS partitions
+			(semester TEXT PRIMARY KEY, 
+			ordinal INTEGER UNIQUE NOT NULL, 
+			filename TEXT NOT NULL)''')
+		
+		finally:
+			AttendanceDB.release(cur)
+		SemesterPartitions.partitions[connection] = self
+		self.attach(self.current, connection)
+	
+	def filename(self, semester_name):
+		"""Return the partition file for a Semester, next to the core file."""
+		
+		base, extension = os.path.splitext(self.core_path)
+		return '%s-%s%s' % (base, re.sub(r'\W', '_', semester_name.lower()), extension)
+	
+	def ordinal(self, semester_name, connection):
+		"""Return a Semester's partition number, assigning the next one if it has none."""
+		
+		try:
+			cur = AttendanceDB.cursor(connection)
+			
+			rows = list(cur.execute('SELECT ordinal FROM main.partitions WHERE semester=?', (semester_name,)))
+			if len(rows) == 1:
+				ordinal = rows[0][0]
+			else:
+				ordinal = list(cur.execute('SELECT COALESCE(MAX(ordinal), 0) + 1 FROM main.partitions'))[0][0]
+				params = (semester_name, ordinal, os.path.basename(self.filename(semester_name)),)
+				cur.execute('INSERT INTO main.partitions VALUES (?,?,?)', params)
+		
+		finally:
+			AttendanceDB.release(cur)
+		return ordinal
+	
+	def attach(self, semester_name, connection):
+		"""ATTACH a Semester's file (creating it if needed) and return its schema name."""
+		
+		schema = SemesterPartitions.schema_name(semester_name)
+		if semester_name in self.attached:
+			self.attached.remove(semester_name)
+			self.attached.append(semester_name)
+			return schema
+		
+		# Make room under SQLite's ATTACH limit, never dropping the current Semester, nor one
+		# the open transaction has used (SQLite refuses to DETACH it)
+		limit = connection.limit(apsw.SQLITE_LIMIT_ATTACHED)
+		while len(self.attached) >= limit:
+			for oldest in [name for name in self.attached if name != self.current]:
+				try:
+					self.detach(oldest, connection)
+					break
+				except apsw.Error:
+					continue
+			else:
+				raise DatabaseException(self.attach.__name__, "Can't attach %s: every attached Semester is in use by the open transaction." % semester_name)
+		
+		ordinal = self.ordinal(semester_name, connection)
+		try:
+			cur = AttendanceDB.cursor(connection)
+			cur.execute('ATTACH ? AS %s' % schema, (self.filename(semester_name),))
+		
+		finally:
+			AttendanceDB.release(cur)
+		AttendanceDB.create_semester_tables(connection, schema, ordinal << SemesterPartitions.ID_BITS)
+		self.attached.append(semester_name)
+		return schema
+	
+	def detach(self, semester_name, connection):
+		"""DETACH a Semester's file."""
+		
+		try:
+			cur = AttendanceDB.cursor(connection)
+			cur.execute('DETACH %s' % SemesterPartitions.schema_name(semester_name))
+		
+		finally:
+			AttendanceDB.release(cur)
+		self.attached.remove(semester_name)
+	
+	def schema_for_id(self, row_id, connection):
+		"""Return the schema holding an event or excuse ID, or None for the core file."""
+		
+		try:
+			cur = AttendanceDB.cursor(connection)
+			
+			rows = list(cur.execute('SELECT semester FROM main.partitions WHERE ordinal=?', (row_id >> SemesterPartitions.ID_BITS,)))
+		
+		finally:
+			AttendanceDB.release(cur)
+		if len(rows) == 0:
+			return None
+		return self.attach(rows[0][0], connection)
+	
+	def schemas_for_range(self, start, end, connection):
+		"""Return the schemas of every Semester overlapping a date or datetime range."""
+		
+		calendar = AcademicCalendar.for_connection(connection)
+		start = AcademicCalendar.as_date(start)
+		end = AcademicCalendar.as_date(end)
+		schemas = []
+		for semester in calendar.semesters:
+			if semester.term_one.start_date <= end and start <= semester.term_two.end_date:
+				schemas.append(self.attach(semester.name, connection))
+		if len(schemas) == 0:
+			schemas.append(self.attach(self.current, connection))
+		return schemas
+
+class Student(object):
+	
+	"""A Student who has signed into the attendance system. 
+	
+	The student's RFID ID number is the primary key column.
+	"""
+	
+	__slots__ = ["rfid", "fname", "lname", "email", "good_standing", "current", "_signins", "_excuses", "_absences", "_groups"]
+	
+	signins = relation('_signins')
+	excuses = relation('_excuses')
+	absences = relation('_absences')
+	groups = relation('_groups')
+
+	@classmethod
+	def new_from_row(cls, row, connection=None):
+		"""Given a students row from the DB, returns a Student object."""
+		
+		return cls(row[0], row[1], row[2], row[3], row[4], row[5])
+
+	@staticmethod
+	def select_by_id(id, connection):
+		"""Return the Student of given ID."""
+		
+		try:
+			cur = AttendanceDB.cursor(connection)
+			
+			rows = list(cur.execute('SELECT * FROM students WHERE id=?', (id,)))
+			if len(rows) > 1 or len(rows) < 0:
+				raise DatabaseException(Student.select_by_id.__name__, "Query returned %s rows, expected one." % len(rows))
+			elif len(rows) == 1:
+				student = Student.new_from_row(rows[0], connection)
+			elif len(rows) == 0:
+				student = None
 			
-			for row in cur.execute('SELECT * FROM students WHERE current=?', (int(current),)):
+		finally:
+			AttendanceDB.release(cur)
+			return student
+	
+	@staticmethod
+	def select_by_name(fname, lname, connection):
+		"""Return the Student(s) of given name."""
+		
+		students = []
+		try:
+			cur = AttendanceDB.cursor(connection)
+			for row in cur.execute('SELECT * FROM students WHERE fname=? AND lname=?', (fname, lname,)):
 				students.append(Student.new_from_row(row, connection))
 				
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
+			return students
+	
+	@staticmethod
+	def select_by_email(email, connection):
+		"""Return the Student(s) with given email address."""
+		
+		students = []
+		try:
+			cur = AttendanceDB.cursor(connection)
+			
+			for row in cur.execute('SELECT * FROM students WHERE email=?', (email,)):
+				students.append(Student.new_from_row(row, connection))
+				
+		finally:
+			AttendanceDB.release(cur)
+			return students
+	
+	@staticmethod
+	def select_email_map(connection):
+		"""Return a dict of lowercased email address -> Student ID for every Student with an email.
+		
+		Used by bulk importers in place of one select_by_email query per message.
+		If an address belongs to several Students, the current one wins.
+		"""
+		
+		emails = {}
+		try:
+			cur = AttendanceDB.cursor(connection)
+			
+			for row in cur.execute('SELECT email, id FROM students WHERE email IS NOT NULL ORDER BY current ASC'):
+				emails[row[0].strip().lower()] = row[1]
+		
+		finally:
+			AttendanceDB.release(cur)
+			return emails
+	
+	@staticmethod
+	def select_by_standing(good_standing, connection):
+		"""Return the list of Students of given standing."""
+		
+		students = []
+		try:
+			cur = AttendanceDB.cursor(connection)
+			
+			for row in cur.execute('SELECT * FROM students WHERE goodstanding=?', (int(good_standing),)):
+				students.append(Student.new_from_row(row, connection))
+				
+		finally:
+			AttendanceDB.release(cur)
+			return students
+	
+	@staticmethod
+	def select_by_group(group, in_group, connection):
+		"""Return the list of Students in some group (or not)."""
+		
+		students = []
+		try:
+			cur = AttendanceDB.cursor(connection)
+			
+			if in_group == True:
+				sql = '''SELECT * FROM students WHERE id IN
+				(SELECT DISTINCT student FROM group_memberships WHERE id=?)'''
+			else:
+				sql = '''SELECT * FROM students WHERE id NOT IN
+				(SELECT DISTINCT student FROM group_memberships WHERE id=?)'''
+
+			for row in cur.execute(sql, (group.id,)):
+				students.append(Student.new_from_row(row, connection))
+				
+		finally:
+			AttendanceDB.release(cur)
 			return students
+	
+	@staticmethod
+	def select_by_current(current, connection):
+		"""Return the list of current Students on the roster (or not), through the QueryCache."""
+		
+		def build(rows):
+			return [Student.new_from_row(row) for row in rows]
+		
+		sql = 'SELECT * FROM students WHERE current=?'
+		return QueryCache.for_connection(connection).select(sql, (int(current),), ('students',), build)
 		
 	@staticmethod
 	def select_by_all(id, fname, lname, email, standing, current, connection):
@@ -668,7 +2471,7 @@ class Student(object):
 		students = []
 		
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
 			sql = 'SELECT * FROM students WHERE id=? AND fname=? AND lname=? AND email=? AND goodstanding=? AND current=?'
 			params = (id, fname, lname, email, standing, current,)
@@ -676,7 +2479,7 @@ class Student(object):
 				students.append(Student.new_from_row(row, connection))
 				
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 			return students
 	
 	@staticmethod
@@ -684,23 +2487,28 @@ class Student(object):
 		"""Merge the records of one student into another, deleting the first.
 		
 		This should be used when a student replaces their ID card, as the new
-		ID card will have a different RFID number.
+		ID card will have a different RFID number. Runs as one transaction,
+		over every Semester's partition.
 		"""
 		
-		try:
-			cur = connection.cursor()
-			
-			params = (new.rfid, old.rfid, )
-			cur.execute('UPDATE excuses SET student=? WHERE student=?', params)
-			cur.execute('UPDATE signins SET student=? WHERE student=?', params)
-			cur.execute('UPDATE absences SET student=? WHERE student=?', params)
+		with AttendanceDB.transaction(connection):
+			try:
+				cur = AttendanceDB.cursor(connection)
+				
+				params = (new.rfid, old.rfid, )
+				for signins in SemesterPartitions.each('signins', connection):
+					schema = signins[:-len('signins')]
+					cur.execute('UPDATE %sexcuses SET student=? WHERE student=?' % schema, params)
+					cur.execute('UPDATE %s SET student=? WHERE student=?' % signins, params)
+					cur.execute('UPDATE %sabsences SET student=? WHERE student=?' % schema, params)
+				cur.execute('UPDATE OR IGNORE group_memberships SET student=? WHERE student=?', params)
+				
+				old.delete(connection)
 			
-			old.delete()
-		
-		finally:
-			cur.close()
-			new.fetch_signins(db, connection)
-			new.fetch_excuses(db, connection)
+			finally:
+				AttendanceDB.release(cur)
+		new.fetch_signins(connection)
+		new.fetch_excuses(connection)
 	
 	def __init__(self, r, fn, ln, email, standing=True, current=True):
 		self.rfid = r		# Numeric ID seen by the RFID reader
@@ -709,10 +2517,10 @@ class Student(object):
 		self.email = email
 		self.good_standing = standing
 		self.current = current # Set false when no longer in active roster
-		self.signins = []
-		self.excuses = []
-		self.absences = []
-		self.groups = []
+		self._signins = None
+		self._excuses = None
+		self._absences = None
+		self._groups = None
 		
 	def fetch_signins(self, connection):
 		"""Fetch all Signins by this Student from the database."""
@@ -733,7 +2541,7 @@ class Student(object):
 		"""Fetch all Groups this Student is a member of from the database."""
 		
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
 			params = (self.name,)
 			cur.execute('''SELECT * FROM groups WHERE name IN
@@ -745,39 +2553,39 @@ class Student(object):
 				self.groups.append(group)
 			
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 	
 	def join_group(self, group, credit, connection):
 		"""Add the Student to a Group."""
 		
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
 			params = (self.name, group.id, int(credit))
 			cur.execute('INSERT INTO group_memberships VALUES (?,?,?)', params)
 				
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 			self.groups.append(group)
 	
 	def leave_group(self, group, connection):
 		"""Remove the Student from a Group."""
 		
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
 			params = (self.name, group.id,)
 			cur.execute('DELETE FROM group_memberships WHERE student=? AND group=?', params)
 			del self.groups[self.groups.index(group)]
 				
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 	
 	def update(self, connection):
 		"""Update an existing Student record in the DB."""
 		
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
 			params = (self.fname, self.lname, self.email, self.good_standing, self.current, self.rfid,)
 			cur.execute('''UPDATE students 
@@ -785,34 +2593,40 @@ class Student(object):
 			WHERE id=?''', params)
 				
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 	
 	def insert(self, connection):
 		"""Write the Student to the DB."""
 		
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
 			params = (self.rfid, self.fname, self.lname, self.email, self.good_standing, self.current,)
 			cur.execute('INSERT INTO students VALUES (?,?,?,?,?,?)', params)
 				
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 	
 	def delete(self, connection):
 		"""Delete the Student from the DB."""
 		
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
 			cur.execute('DELETE FROM students WHERE id=?', (self.rfid,))
 				
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 
 class Organization(object):
 	
 	"""An organization that uses the RFID reader for attendance."""
+	
+	__slots__ = ["name", "_calendar", "_optional_member_orgs", "_mandatory_member_orgs"]
+	
+	calendar = relation('_calendar', dict)
+	optional_member_orgs = relation('_optional_member_orgs')
+	mandatory_member_orgs = relation('_mandatory_member_orgs')
 
 	@classmethod
 	def new_from_row(cls, row):
@@ -825,7 +2639,7 @@ class Organization(object):
 		"""Return the Organization of given name."""
 		
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
 			rows = list(cur.execute('SELECT * FROM organizations WHERE name=?', (name,)))
 			if len(rows) > 1 or len(rows) < 0:
@@ -836,28 +2650,28 @@ class Organization(object):
 				organization = None
 				
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 			return organization
 
 	def __init__(self, name, gcal_id=None):
 		self.name = name
-		self.calendar = {}	
+		self._calendar = None
 		# Optional Google Calendar ID, e.g. wpigleeclub@gmail.com
 		if gcal_id is not None:
 			self.calendar['id'] = gcal_id
 		# Organizations whose members are granted "attendance optional" status
 		# for this Organization's events (if they are even on the roster)
-		self.optional_member_orgs = []
+		self._optional_member_orgs = None
 		# Similar to the above, but attendance is mandatory for members
 		# of organizations on this list
-		self.mandatory_member_orgs = []
+		self._mandatory_member_orgs = None
 	
 	def fetch_optional_member_orgs(self, connection):
 		"""Fetch all optional member Organizations from the database."""
 		
 		try:
 			orgs = []
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
 			sql = '''SELECT * FROM organizations WHERE name IN 
 				(SELECT child FROM optional_member_orgs WHERE parent=?)'''
@@ -865,32 +2679,32 @@ class Organization(object):
 				orgs.append(Organization.new_from_row(row))
 				
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 			self.optional_member_orgs = orgs
 	
 	def add_optional_member_org(self, org, connection):
 		"""Add an optional member Organization relationship."""
 		
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
 			cur.execute('INSERT INTO optional_member_orgs VALUES (NULL,?,?)', (self.name, org.name,))
 			self.optional_member_orgs.append(org)
 				
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 	
 	def remove_optional_member_org(self, org, connection):
 		"""Remove an optional member Organization relationship."""
 		
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
 			cur.execute('DELETE FROM optional_member_orgs WHERE parent=? AND child=?', (self.name, org.name,))
 			del self.optional_member_orgs[self.optional_member_orgs.index(org)]
 				
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 		
 			
 	def fetch_mandatory_member_orgs(self, connection):
@@ -898,7 +2712,7 @@ class Organization(object):
 		
 		try:
 			orgs = []
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
 			sql = '''SELECT * FROM organizations WHERE name IN 
 				(SELECT child FROM mandatory_member_orgs WHERE parent=?)'''
@@ -906,32 +2720,32 @@ class Organization(object):
 				orgs.append(Organization.new_from_row(row))
 				
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 			self.mandatory_member_orgs = orgs
 			
 	def add_mandatory_member_org(self, org, connection):
 		"""Add a mandatory member Organization relationship."""
 		
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
 			cur.execute('INSERT INTO mandatory_member_orgs VALUES (NULL,?,?)', (self.name, org.name,))
 			self.mandatory_member_orgs.append(org)
 				
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 	
 	def remove_mandatory_member_org(self, org, connection):
 		"""Remove a mandatory member Organization relationship."""
 		
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
 			cur.execute('DELETE FROM mandatory_member_orgs WHERE parent=? AND child=?', (self.name, org.name,))
 			del self.mandatory_member_orgs[self.mandatory_member_orgs.index(org)]
 				
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 		
 	def get_calendar(self, gcal):
 		"""Gets the Organization's Google calendar resource dictionary.
@@ -959,34 +2773,37 @@ class Organization(object):
 		"""Update an existing Organization record in the DB."""
 		
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
 			cur.execute('UPDATE organizations SET name=?1, gcal_id=?2 WHERE name=?1', (self.name, self.calendar['id'],))
 				
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 	
 	def insert(self, connection):
 		"""Write the Organization to the DB."""
 		
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
 			cur.execute('INSERT INTO organizations VALUES (?,?)', (self.name, self.calendar['id'],))
 				
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 	
 	def delete(self, connection):
 		"""Delete the Organization from the DB."""
 		
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
 			cur.execute('DELETE FROM organizations WHERE name=?', (self.name,))
 				
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
+
+# A roster import's changes, as lists of RFIDs. created are the added Students new to the DB.
+RosterDiff = namedtuple('RosterDiff', ['added', 'removed', 'changed', 'credit_changed', 'created'])
 
 class Group(object):
 	
@@ -996,6 +2813,15 @@ class Group(object):
 	Each Group has a parent Organization.
 	"""
 	
+	# Tables new_from_row reads, for QueryCache
+	DEPENDENCIES = ('groups', 'organizations', 'semesters', 'terms', 'daysoff',)
+	# RFIDs looked up per statement when diffing a roster, under SQLite's 999 parameter limit
+	ROSTER_CHUNK = 500
+	
+	__slots__ = ["id", "organization", "semester", "name", "parent_group", "_members"]
+	
+	members = relation('_members')
+	
 	@classmethod
 	def new_from_row(cls, row, connection):
 		"""Given a groups row from the DB, returns a Group object."""
@@ -1019,7 +2845,7 @@ class Group(object):
 		"""Return the Group of given ID."""
 		
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
 			rows = list(cur.execute('SELECT * FROM groups WHERE id=?', (gid,)))
 			if len(rows) > 1 or len(rows) < 0:
@@ -1030,7 +2856,7 @@ class Group(object):
 				group = None
 				
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 			return group
 	
 	@staticmethod
@@ -1046,35 +2872,45 @@ class Group(object):
 			else:
 				raise TypeError
 				
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
 			for row in cur.execute('SELECT * FROM groups WHERE organization=?', (org,)):
 				groups.append(Group.new_from_row(row, connection))
 				
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 			return groups
 		
 	@staticmethod
 	def select_by_semester(semester, connection):
-		"""Return the Group(s) of given Semester."""
+		"""Return the Group(s) of given Semester, through the QueryCache."""
 		
-		groups = []
+		if hasattr(semester, 'term_one'):	# Probably a Semester object
+			sem = semester.name
+		elif isinstance(semester, basestring):
+			sem = semester
+		else:
+			raise TypeError
+		
+		def build(rows):
+			return [Group.new_from_row(row, connection) for row in rows]
+		
+		sql = 'SELECT * FROM groups WHERE semester=?'
+		return QueryCache.for_connection(connection).select(sql, (sem,), Group.DEPENDENCIES, build)
+	
+	@staticmethod
+	def select_membership_map(connection):
+		"""Return a dict of Student ID -> set of the IDs of every Group they are in."""
+		
+		groups = {}
 		try:
-			if hasattr(semester, term_one):	# Probably a Semester object
-				sem = semester.name
-			elif isinstance(semester, basestring):
-				sem = semester
-			else:
-				raise TypeError
-			
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
-			for row in cur.execute('SELECT * FROM groups WHERE semester=?', (sem,)):
-				groups.append(Group.new_from_row(row, connection))
-				
+			for (student, group_id) in cur.execute('SELECT student, group_id FROM group_memberships'):
+				groups.setdefault(student, set()).add(group_id)
+		
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 			return groups
 	
 	def __init__(self, id, organization, semester, name, parent_id=None, students=[]):
@@ -1082,8 +2918,8 @@ class Group(object):
 		self.organization = organization
 		self.semester = semester
 		self.name = name
-		self.parent_group = parent	# Used if this group is a subgroup (for tour, etc)
-		self.members = students
+		self.parent_group = parent_id	# Used if this group is a subgroup (for tour, etc)
+		self._members = list(students) if len(students) > 0 else None
 		
 	def fetch_members(self, connection):
 		"""Fetch all Students in this group from the database."""
@@ -1094,44 +2930,44 @@ class Group(object):
 		"""Add a new member to the group."""
 		
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
-			cur.execute('INSERT OR ABORT INTO group_memberships VALUES (?,?,?)', (student.name, self.id, int(credit),))
+			cur.execute('INSERT INTO group_memberships (student, group_id, credit) VALUES (?,?,?)', (student.rfid, self.id, int(credit),))
 				
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 			self.members.append(student)
 	
 	def remove_member(self, student, connection):
 		"""Remove a member from the group."""
 		
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
 			params = (student.name, self.id,)
 			cur.execute('DELETE FROM group_memberships WHERE student=? AND group_id=?', params)
 			del self.members[self.members.index(student)]
 				
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 		
 	def update(self, connection):
 		"""Update an existing Group record in the DB."""
 		
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
 			params = (self.id, self.name, self.semester.name,)
 			cur.execute('UPDATE groups SET id=?1, name=?2, semester=?3 WHERE id=?1', params)
 				
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 	
 	def insert(self, connection):
 		"""Write the Group to the DB and retrieve the auto-assigned ID."""
 		
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
 			params = (self.name, self.semester.name,)
 			cur.execute('INSERT INTO groups VALUES (NULL,?,?)', params)
@@ -1145,18 +2981,18 @@ class Group(object):
 				raise DatabaseException(self.insert.__name__, "Could not retrieve group ID post-insert.")
 				
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 	
 	def delete(self, connection):
 		"""Delete the Group from the DB."""
 		
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
 			cur.execute('DELETE FROM groups WHERE id=?', (self.id,))
 				
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 	
 	def find_concurrent_optional_groups(self, connection):
 		"""Finds this Group's concurrent optional member Groups.
@@ -1168,7 +3004,7 @@ class Group(object):
 		
 		groups = []
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
 			sql = '''SELECT * FROM groups WHERE semester=? AND organization IN 
 			(SELECT child FROM optional_member_orgs WHERE parent=?)'''
@@ -1177,7 +3013,7 @@ class Group(object):
 				groups.append(Group.new_from_row(row, connection))
 		
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 			return groups
 		
 	def find_concurrent_mandatory_groups(self, connection):
@@ -1190,7 +3026,7 @@ class Group(object):
 		
 		groups = []
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
 			sql = '''SELECT * FROM groups WHERE semester=? AND organization IN 
 			(SELECT child FROM mandatory_member_orgs WHERE parent=?)'''
@@ -1199,7 +3035,7 @@ class Group(object):
 				groups.append(Group.new_from_row(row, connection))
 		
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 			return groups
 	
 	@property
@@ -1211,11 +3047,13 @@ class Group(object):
 		else:
 			return group.parent_group.root_group
 			
-	def read_gc_roster(self, infile, connection):
-		"""Parse the group's roster into the database using the Glee Club roster format."""
+	@staticmethod
+	def parse_gc_roster(rows):
+		"""Yield (rfid, fname, lname, email, credit) for the rows of a Glee Club format roster sheet.
+		
+		The first row is the header; rows without an RFID are skipped.
+		"""
 		
-		book = Workbook(infile)
-		sheet = book['Sheet1']
 		rfid_col = 0
 		fname_col = 1
 		lname_col = 2
@@ -1223,21 +3061,111 @@ class Group(object):
 		shm_col = 4
 		cred_col = 5
 		officer_col = 6
-		for row, cells in sheet.rows().iteritems():	# row is the row number
+		for (row, cells) in enumerate(rows, 1):
 			if row == 1: # skip header
 				continue
-			student = Student(cells[rfid_col].value, cells[fname_col].value, cells[lname_col].value, cells[email_col].value)
-			if Student.select_by_id(student.id, connection) is None:	# Not in DB
-				student.insert(connection)
-			else:
-				student.update(connection)
-			if '1' in cells[cred_col].value or 'y' in string.lower(cells[cred_col].value) or 't' in string.lower(cells[cred_col].value):
+			cells = cells + [None] * (officer_col + 1 - len(cells))
+			if cells[rfid_col] is None or len(cells[rfid_col].strip()) == 0:
+				continue
+			credit = (cells[cred_col] or '').lower()
+			if '1' in credit or 'y' in credit or 't' in credit:
 				credit = True
-			elif '0' in cells[cred_col].value or 'n' in string.lower(cells[cred_col].value) or 'f' in string.lower(cells[cred_col].value):
+			elif '0' in credit or 'n' in credit or 'f' in credit:
 				credit = False
 			else:
-				raise RosterException(self.read_gc_roster.__name__, "Failure parsing contents of credit column in roster row " + row)
-			self.add_member(student, credit, connection)
+				raise RosterException(Group.parse_gc_roster.__name__, "Failure parsing contents of credit column in roster row %s" % row)
+			yield (int(float(cells[rfid_col])), cells[fname_col], cells[lname_col], cells[email_col], credit)
+	
+	def read_gc_roster(self, infile, connection, sheet=None):
+		"""Stream a Glee Club format roster sheet into this Group; see apply_roster().
+		
+		@param sheet: Worksheet name; the first sheet by default.
+		@return: The RosterDiff applied.
+		"""
+		
+		return self.apply_roster(Group.parse_gc_roster(read_xlsx_rows(infile, sheet)), connection)
+	
+	@staticmethod
+	def read_gc_rosters(infile, groups, connection):
+		"""Import a workbook with one Glee Club format roster sheet per Group, in one transaction.
+		
+		@param groups: Dict of sheet name -> Group.
+		@return: Dict of sheet name -> RosterDiff.
+		"""
+		
+		diffs = {}
+		with AttendanceDB.transaction(connection):
+			for (sheet, group) in groups.items():
+				diffs[sheet] = group.read_gc_roster(infile, connection, sheet)
+		return diffs
+	
+	def diff_roster(self, rows, connection):
+		"""Compare (rfid, fname, lname, email, credit) roster rows with the DB.
+		
+		@return: (RosterDiff, OrderedDict of RFID -> (fname, lname, email, credit)); the last row for an RFID wins.
+		"""
+		
+		roster = OrderedDict((int(rfid), (fname, lname, email, bool(credit))) for (rfid, fname, lname, email, credit) in rows)
+		members = {}	# RFID -> credit
+		students = {}	# RFID -> (fname, lname, email, current)
+		try:
+			cur = AttendanceDB.cursor(connection)
+			
+			sql = '''SELECT students.id, fname, lname, email, current, credit FROM group_memberships 
+			JOIN students ON students.id = group_memberships.student WHERE group_id=?'''
+			for (rfid, fname, lname, email, current, credit) in cur.execute(sql, (self.id,)):
+				members[rfid] = bool(credit)
+				students[rfid] = (fname, lname, email, bool(current))
+			others = [rfid for rfid in roster if rfid not in members]
+			for start in xrange(0, len(others), Group.ROSTER_CHUNK):
+				chunk = others[start:start + Group.ROSTER_CHUNK]
+				sql = 'SELECT id, fname, lname, email, current FROM students WHERE id IN (%s)' % ','.join('?' * len(chunk))
+				for (rfid, fname, lname, email, current) in cur.execute(sql, chunk):
+					students[rfid] = (fname, lname, email, bool(current))
+		
+		finally:
+			AttendanceDB.release(cur)
+		
+		diff = RosterDiff(added=[rfid for rfid in roster if rfid not in members], 
+			removed=[rfid for rfid in members if rfid not in roster], 
+			changed=[rfid for (rfid, row) in roster.items() if rfid in students and students[rfid] != row[:3] + (True,)], 
+			credit_changed=[rfid for (rfid, row) in roster.items() if rfid in members and members[rfid] != row[3]], 
+			created=[rfid for rfid in roster if rfid not in students])
+		return (diff, roster)
+	
+	def apply_roster(self, rows, connection, archive=False):
+		"""Make this Group's memberships match (rfid, fname, lname, email, credit) roster rows.
+		
+		The rows are diffed against the DB and only the differences written, with
+		one bulk statement per kind of change, in one transaction. Students on
+		the roster are marked current; members not on it are removed.
+		
+		With archive=True (an old roster being loaded) only missing Students,
+		created non-current, and missing memberships are added; existing
+		Students and memberships are left alone.
+		@return: The RosterDiff applied.
+		"""
+		
+		with AttendanceDB.transaction(connection):
+			(diff, roster) = self.diff_roster(rows, connection)
+			if archive:
+				diff = diff._replace(removed=[], changed=[], credit_changed=[])
+			try:
+				cur = AttendanceDB.cursor(connection)
+				
+				writes = [('INSERT INTO students VALUES (?,?,?,?,1,%d)' % (not archive), [(rfid,) + roster[rfid][:3] for rfid in diff.created]), 
+					('UPDATE students SET fname=?, lname=?, email=?, current=1 WHERE id=?', [roster[rfid][:3] + (rfid,) for rfid in diff.changed]), 
+					('INSERT INTO group_memberships (student, group_id, credit) VALUES (?,?,?)', [(rfid, self.id, int(roster[rfid][3])) for rfid in diff.added]), 
+					('UPDATE group_memberships SET credit=? WHERE student=? AND group_id=?', [(int(roster[rfid][3]), rfid, self.id) for rfid in diff.credit_changed]), 
+					('DELETE FROM group_memberships WHERE student=? AND group_id=?', [(rfid, self.id) for rfid in diff.removed])]
+				for (sql, params) in writes:
+					if len(params) > 0:
+						cur.executemany(sql, params)
+			
+			finally:
+				AttendanceDB.release(cur)
+		self._members = None	# Stale; fetch_members() to see the new roster
+		return diff
 
 class Absence(object):
 	
@@ -1250,6 +3178,8 @@ class Absence(object):
 	TYPE_EXCUSED = "Excused"
 	TYPE_UNEXCUSED = "Unexcused"
 	
+	__slots__ = ["student", "type", "event", "excuse"]
+	
 	@classmethod
 	def new_from_row(cls, row, connection):
 		"""Given an absences row from the DB, returns an Absence object."""
@@ -1261,7 +3191,7 @@ class Absence(object):
 		if row[2] is None:
 			event = None
 		else:
-			event = Event.select_by_id(row[2], connection)[0]
+			event = Event.select_by_id(row[2], connection)
 		if row[3] is None:
 			excuse = None
 		else:
@@ -1274,13 +3204,16 @@ class Absence(object):
 		
 		absences = []
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
-			for row in cur.execute('SELECT * FROM absences WHERE student=?', (student.id,)):
+			rows = []
+			for table in SemesterPartitions.each('absences', connection):
+				rows.extend(cur.execute('SELECT * FROM %s WHERE student=?' % table, (student.rfid,)))
+			for row in rows:
 				absences.append(Absence.new_from_row(row, connection))
 				
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 			return absences
 	
 	@staticmethod
@@ -1289,13 +3222,16 @@ class Absence(object):
 		
 		absences = []
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
-			for row in cur.execute('SELECT * FROM absences WHERE type=?', (absence_type,)):
+			rows = []
+			for table in SemesterPartitions.each('absences', connection):
+				rows.extend(cur.execute('SELECT * FROM %s WHERE type=?' % table, (absence_type,)))
+			for row in rows:
 				absences.append(Absence.new_from_row(row, connection))
 				
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 			return absences
 		
 	@staticmethod
@@ -1304,13 +3240,16 @@ class Absence(object):
 		
 		absences = []
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
-			for row in cur.execute('SELECT * FROM absences WHERE event=?', (event.id,)):
+			rows = []
+			for table in SemesterPartitions.tables('absences', connection, row_id=event.id):
+				rows.extend(cur.execute('SELECT * FROM %s WHERE event=?' % table, (event.id,)))
+			for row in rows:
 				absences.append(Absence.new_from_row(row, connection))
 				
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 			return absences
 	
 	@staticmethod
@@ -1323,13 +3262,16 @@ class Absence(object):
 		
 		absences = []
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
-			for row in cur.execute('SELECT * FROM absences WHERE excuseid=?', (excuse_id,)):
+			rows = []
+			for table in SemesterPartitions.tables('absences', connection, row_id=excuse_id):
+				rows.extend(cur.execute('SELECT * FROM %s WHERE excuseid=?' % table, (excuse_id,)))
+			for row in rows:
 				absences.append(Absence.new_from_row(row, connection))
 				
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 			return absences
 	
 	@staticmethod
@@ -1338,17 +3280,54 @@ class Absence(object):
 		
 		absences = []
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
-			sql = 'SELECT * FROM absences WHERE student=? AND type=? AND event=? AND excuseid=?'
+			sql = 'SELECT * FROM %s WHERE student=? AND type=? AND event=? AND excuseid=?'
 			params = (student_id, absence_type, event_id, excuse_id,)
-			for row in cur.execute(sql, params):
+			rows = []
+			for table in SemesterPartitions.tables('absences', connection, row_id=event_id):
+				rows.extend(cur.execute(sql % table, params))
+			for row in rows:
 				absences.append(Absence.new_from_row(row, connection))
 				
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 			return absences
 	
+	@staticmethod
+	def generate(events, connection):
+		"""Record an Absence for each member of an Event's Group who didn't sign in.
+		
+		Members with an Excuse for the Event get a TYPE_PENDING Absence linked
+		to it, the others TYPE_UNEXCUSED. Existing Absences are kept. All the
+		Events are done in one transaction.
+		@return: The number of Absences added.
+		"""
+		
+		added = 0
+		with AttendanceDB.transaction(connection):
+			try:
+				cur = AttendanceDB.cursor(connection)
+				
+				for event in events:
+					if event.group is None:
+						continue
+					tables = {}
+					for table in ('absences', 'excuses', 'signins'):
+						tables[table] = SemesterPartitions.tables(table, connection, row_id=event.id)[0]
+					sql = '''INSERT OR IGNORE INTO %(absences)s (student, type, event, excuseid) 
+					SELECT memberships.student, CASE WHEN excuses.id IS NULL THEN ?4 ELSE ?3 END, ?1, excuses.id 
+					FROM group_memberships AS memberships 
+					LEFT JOIN %(excuses)s AS excuses ON excuses.event = ?1 AND excuses.student = memberships.student 
+					WHERE memberships.group_id = ?2 AND NOT EXISTS 
+						(SELECT 1 FROM %(signins)s AS signins WHERE signins.event = ?1 AND signins.student = memberships.student)''' % tables
+					cur.execute(sql, (event.id, event.group.id, Absence.TYPE_PENDING, Absence.TYPE_UNEXCUSED,))
+					added += connection.changes()
+			
+			finally:
+				AttendanceDB.release(cur)
+		return added
+	
 	def __init__(self, student, type, event, excuse=None):
 		self.student = student	# A Student object
 		self.type = type				# An Absence.TYPE_ string constant
@@ -1359,38 +3338,41 @@ class Absence(object):
 		"""Update an existing Absence record in the DB."""
 		
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
 			params = (self.student.rfid, self.type, self.event.id, self.excuse.id,)
 			cur.execute('UPDATE absences SET student=?1, type=?2, event=?3, excuseid=?4 WHERE student=?1 AND event=?3', params)
 				
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 	
 	def insert(self, connection):
 		"""Write the Absence to the DB."""
 		
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
 			params = (self.student, self.type, self.event.id, self.excuse_id,)
 			cur.execute('INSERT INTO absences VALUES (?,?,?,?)', params)
 				
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 	
 	def delete(self, connection):
 		"""Delete the Absence from the DB."""
 		
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
 			params = (self.student.rfid, self.event.id,)
 			cur.execute('DELETE FROM absences WHERE student=? AND eventdt=?', params)
 				
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 	
+# One Excuse.search hit: the excuses columns a report needs plus the matched text
+ExcuseMatch = namedtuple('ExcuseMatch', ['id', 'dt', 'event', 'student', 'snippet', 'rank'])
+
 class Excuse(object):
 	
 	"""A Student's excuse for missing an Event sent to gc-excuse.
@@ -1402,6 +3384,8 @@ class Excuse(object):
 	EXCUSES_OPENS = timedelta(-1, 0, 0, 0, 0, -18, 0)	# 1 day, 18 hours before
 	EXCUSES_CLOSES = timedelta(0, 0, 0, 0, 0, 6, 0)	# 6 hours after
 	
+	__slots__ = ["id", "excuse_dt", "event", "reason", "student"]
+	
 	@classmethod
 	def new_from_row(cls, row, connection):
 		"""Given an excuses row from the DB, returns an Excuse object."""
@@ -1409,7 +3393,7 @@ class Excuse(object):
 		if row[2] is None:
 			event = None
 		else:
-			event = Event.select_by_id(row[2], connection)[0]
+			event = Event.select_by_id(row[2], connection)
 		if row[4] is None:
 			student = None
 		else:
@@ -1421,9 +3405,11 @@ class Excuse(object):
 		"""Return the Excuse of given unique ID."""
 		
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
-			rows = list(cur.execute('SELECT * FROM excuses WHERE id=?', (excuse_id,)))
+			rows = []
+			for table in SemesterPartitions.tables('excuses', connection, row_id=excuse_id):
+				rows.extend(cur.execute('SELECT * FROM %s WHERE id=?' % table, (excuse_id,)))
 			if len(rows) > 1 or len(rows) < 0:
 				raise DatabaseException(Excuse.select_by_id.__name__, "Query returned %s rows, expected one." % len(rows))
 			elif len(rows) == 1:
@@ -1432,7 +3418,7 @@ class Excuse(object):
 				excuse = None
 				
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 			return excuse
 	
 	@staticmethod
@@ -1441,19 +3427,23 @@ class Excuse(object):
 		
 		excuses = []
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
-			for row in cur.execute('SELECT * FROM excuses WHERE student=?', (student.id,)):
+			rows = []
+			for table in SemesterPartitions.each('excuses', connection):
+				rows.extend(cur.execute('SELECT * FROM %s WHERE student=?' % table, (student.rfid,)))
+			for row in rows:
 				excuses.append(Excuse.new_from_row(row, connection))
 				
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 			return excuses
 	
 	@staticmethod
 	def select_by_datetime_range(start_dt, end_dt, connection):
 		"""Return the list of Excuses in a given datetime range."""
 		
+		tables = SemesterPartitions.tables('excuses', connection, start=start_dt, end=end_dt)
 		if type(start_dt == datetime):
 			start_dt = start_dt.isoformat()
 		if type(end_dt == datetime):
@@ -1461,14 +3451,15 @@ class Excuse(object):
 		
 		excuses = []
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
 			params = (start_dt, end_dt,)
-			for row in cur.execute('SELECT * FROM excuses WHERE dt BETWEEN ? AND ?', params):
-				excuses.append(Excuse.new_from_row(row, connection))
+			for table in tables:
+				for row in cur.execute('SELECT * FROM %s WHERE dt BETWEEN ? AND ?' % table, params):
+					excuses.append(Excuse.new_from_row(row, connection))
 				
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 			return excuses
 		
 	@staticmethod
@@ -1478,13 +3469,16 @@ class Excuse(object):
 		excuses = []
 		
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
-			for row in cur.execute('SELECT * FROM excuses WHERE event=?', (event.id,)):
+			rows = []
+			for table in SemesterPartitions.tables('excuses', connection, row_id=event.id):
+				rows.extend(cur.execute('SELECT * FROM %s WHERE event=?' % table, (event.id,)))
+			for row in rows:
 				excuses.append(Excuse.new_from_row(row, connection))
 				
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 			return excuses
 		
 	@staticmethod
@@ -1499,17 +3493,70 @@ class Excuse(object):
 			end_dt = end_dt.isoformat()
 		
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
-			sql = '''SELECT * FROM excuses WHERE id=? AND student=? AND (dt BETWEEN ? AND ?) AND event=?''' 
+			sql = '''SELECT * FROM %s WHERE id=? AND student=? AND (dt BETWEEN ? AND ?) AND event=?''' 
 			params = (excuse_id, student_id, start_dt, end_dt, event_id,)
-			for row in cur.execute(sql, params):
+			rows = []
+			for table in SemesterPartitions.tables('excuses', connection, row_id=excuse_id):
+				rows.extend(cur.execute(sql % table, params))
+			for row in rows:
 				excuses.append(Excuse.new_from_row(row, connection))
 				
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 			return excuses
 	 
+	@staticmethod
+	def search(query, connection, semester=None, student=None, limit=50):
+		"""Full-text search over excuse reasons, best matches first.
+		
+		@param query: An FTS5 query string, e.g. 'rbe OR exam', 'sick*'.
+		@param semester: Optional Semester (or semester name) to search within.
+		@param student: Optional Student (or RFID number) to search within.
+		@return: A list of ExcuseMatch tuples. dt is the ISO format string and
+		event/student are IDs; no Excuse objects are built.
+		"""
+		
+		matches = []
+		# A partitioned DB keeps each Semester's excuses (and index) in its own file
+		if semester is None:
+			tables = SemesterPartitions.each('excuses', connection)
+		else:
+			tables = SemesterPartitions.tables('excuses', connection, semester=semester)
+		sql = '''SELECT x.id, x.dt, x.event, x.student,
+		snippet(excuses_fts, 0, '[', ']', '...', 12), bm25(excuses_fts)
+		FROM %(schema)sexcuses_fts JOIN %(schema)sexcuses x ON x.id = excuses_fts.rowid'''
+		where = ' WHERE excuses_fts MATCH ?'
+		params = [query]
+		if semester is not None:
+			if hasattr(semester, 'term_one'):	# Probably a Semester object
+				semester = semester.name
+			sql += ''' JOIN semesters s ON s.name = ?
+			JOIN terms t1 ON t1.name = s.termone JOIN terms t2 ON t2.name = s.termtwo'''
+			where += ' AND substr(x.dt, 1, 10) BETWEEN t1.startdate AND t2.enddate'
+			params.insert(0, semester)
+		if student is not None:
+			if hasattr(student, 'rfid'):	# Probably a Student object
+				student = student.rfid
+			where += ' AND x.student = ?'
+			params.append(student)
+		params.append(limit)
+		
+		try:
+			cur = AttendanceDB.cursor(connection)
+			
+			for table in tables:
+				query_sql = (sql + where + ' ORDER BY bm25(excuses_fts) LIMIT ?') % {'schema' : table[:-len('excuses')]}
+				for row in cur.execute(query_sql, params):
+					matches.append(ExcuseMatch(*row))
+		
+		finally:
+			AttendanceDB.release(cur)
+		# Each partition gave its own best matches; keep the best overall
+		matches.sort(key=lambda match: match.rank)
+		return matches[:limit]
+	
 	def __init__(self, id, dt, event, reason, s):
 		self.id = id				# Unique primary key
 		self.excuse_dt = dt			# a datetime object
@@ -1521,19 +3568,19 @@ class Excuse(object):
 		"""Update an existing Excuse record in the DB."""
 		
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
 			params = (self.excuse_dt.isoformat(), self.event.id, self.reason, self.student.rfid, self.id,)
 			cur.execute('UPDATE excuses SET dt=?, event=?, reason=?, student=? WHERE id=?', params)
 				
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 	
 	def insert(self, connection):
 		"""Write the Excuse to the DB and retrieve the auto-assigned ID."""
 		
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
 			params = (self.excuse_dt.isoformat(), self.event.id, self.reason, self.student.rfid,)
 			# INSERTing 'NULL' for the integer primary key column autogenerates an id
@@ -1549,19 +3596,300 @@ class Excuse(object):
 				raise DatabaseException(self.insert.__name__, "Could not retrieve excuse ID post-insert.")
 				
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 	
 	def delete(self, connection):
 		"""Delete the Excuse from the DB."""
 		
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
 			cur.execute('DELETE FROM excuses WHERE id=?', (self.id,))
 				
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
+	
+class MboxSource(object):
+	
+	"""Streams messages from an mbox export, starting at a byte offset.
+	
+	The position of each message is the byte offset just past it, so a later
+	run picks up whatever was appended to the file since.
+	"""
+	
+	def __init__(self, path):
+		self.path = path
+		self.source_id = 'mbox:' + os.path.abspath(path)
+	
+	def messages(self, position):
+		"""Yield (position, email.message.Message) for each message after position."""
+		
+		offset = 0
+		if position is not None:
+			offset = int(position)
+		with open(self.path, 'rb') as f:
+			if offset > os.fstat(f.fileno()).st_size:	# File was replaced; start over
+				offset = 0
+			f.seek(offset)
+			lines = []
+			previous_blank = True
+			while True:
+				line = f.readline()
+				if line == '' or (line.startswith('From ') and previous_blank):
+					if len(lines) > 0:
+						yield str(f.tell() - len(line)), email.message_from_string(''.join(lines))
+					if line == '':
+						return
+					lines = []
+				else:
+					lines.append(line)
+				previous_blank = (line.strip() == '')
+
+class MaildirSource(object):
+	
+	"""Streams messages from a Maildir folder in delivery order.
+	
+	Maildir file names start with the delivery timestamp, so the position is
+	the (timestamp, name) sort key of the last message read.
+	"""
+	
+	def __init__(self, path):
+		self.path = path
+		self.source_id = 'maildir:' + os.path.abspath(path)
+	
+	@staticmethod
+	def sort_key(name):
+		"""Return the (timestamp, unique name) ordering key for a Maildir file name."""
+		
+		unique = name.split(':')[0]		# Drop the ":2,S"-style flags added when a message is read
+		stamp = unique.split('.')[0]
+		if stamp.isdigit():
+			return (int(stamp), unique)
+		return (0, unique)
+	
+	def messages(self, position):
+		"""Yield (position, email.message.Message) for each message after position."""
+		
+		last = None
+		if position is not None:
+			stamp, unique = position.split(' ', 1)
+			last = (int(stamp), unique)
+		keys = []
+		for subdir in ('cur', 'new'):
+			folder = os.path.join(self.path, subdir)
+			if not os.path.isdir(folder):
+				continue
+			for name in os.listdir(folder):
+				key = MaildirSource.sort_key(name)
+				if last is None or key > last:
+					keys.append((key, os.path.join(folder, name)))
+		keys.sort()
+		for key, filename in keys:
+			with open(filename, 'rb') as f:
+				message = email.message_from_file(f)
+			yield '%d %s' % key, message
+
+class GmailSource(object):
+	
+	"""Streams messages from the Gmail API using history IDs as positions.
+	
+	@param service: A Gmail service from apiclient.discovery.build("gmail", "v1", ...),
+	or anything with the same users().messages()/history() interface.
+	"""
+	
+	def __init__(self, service, user_id='me', query=None):
+		self.service = service
+		self.user_id = user_id
+		self.query = query	# Gmail search used on the first run, e.g. 'to:gc-excuse@wpi.edu'
+		self.source_id = 'gmail:' + user_id
+	
+	def message_ids(self, position):
+		"""Return (IDs of messages added after position, oldest first, each once; the position after them).
+		
+		A message can be listed by several history records, on different pages.
+		Message history IDs aren't in order, so the position after a full
+		listing is the mailbox's history ID read before it, and after a history
+		listing the largest history ID seen.
+		"""
+		
+		ids = []
+		token = None
+		if position is None:
+			latest = self.service.users().getProfile(userId=self.user_id).execute()['historyId']
+		else:
+			latest = position
+		while True:
+			if position is None:
+				response = self.service.users().messages().list(userId=self.user_id, q=self.query, pageToken=token).execute()
+				ids.extend(m['id'] for m in response.get('messages', []))
+			else:
+				response = self.service.users().history().list(userId=self.user_id, startHistoryId=position, pageToken=token).execute()
+				for history in response.get('history', []):
+					latest = max(latest, history['id'], key=int)
+					for added in history.get('messagesAdded', []):
+						ids.append(added['message']['id'])
+			token = response.get('nextPageToken')
+			if token is None:
+				break
+		if position is None:
+			ids.reverse()	# messages().list is newest first
+		seen = set()
+		unique = []
+		for message_id in ids:
+			if message_id not in seen:
+				seen.add(message_id)
+				unique.append(message_id)
+		return (unique, str(latest))
+	
+	def messages(self, position):
+		"""Yield (position, email.message.Message) for each message after position.
+		
+		The position only moves on with the last message, so a run that stops
+		part way reads the whole listing again.
+		"""
+		
+		(message_ids, latest) = self.message_ids(position)
+		for (i, message_id) in enumerate(message_ids):
+			response = self.service.users().messages().get(userId=self.user_id, id=message_id, format='raw').execute()
+			raw = base64.urlsafe_b64decode(str(response['raw']))
+			if i + 1 == len(message_ids):
+				position = latest
+			yield position, email.message_from_string(raw)
+
+class ExcuseImporter(object):
+	
+	"""Reads mail sent to an -excuse alias into the excuses table.
+	
+	Messages are taken from an MboxSource, MaildirSource or GmailSource,
+	starting where the previous run left off. Senders are matched to
+	Students by email address; Excuses are inserted without an Event, to be
+	associated with one later. The checkpoint moves past mail from unknown
+	senders too, so it is kept in the pending_excuses table and imported by
+	a later run once the sender is added as a Student.
+	"""
+	
+	def __init__(self, connection, alias=None, batch_size=500):
+		self.connection = connection
+		self.alias = alias				# e.g. 'gc-excuse'; None accepts every message
+		self.batch_size = batch_size
+	
+	@staticmethod
+	def message_text(message):
+		"""Return the subject and first plain text part of a message as unicode."""
+		
+		body = u''
+		for part in message.walk():
+			if part.get_content_type() == 'text/plain' and part.get_filename() is None:
+				payload = part.get_payload(decode=True)
+				if payload is not None:
+					body = payload.decode(part.get_content_charset() or 'ascii', 'replace')
+				break
+		subject = (message.get('Subject') or '').decode('ascii', 'replace')
+		return (subject + u'\n\n' + body).strip()
+	
+	def is_excuse(self, message):
+		"""Return whether the message was sent to self.alias."""
+		
+		if self.alias is None:
+			return True
+		headers = message.get_all('To', []) + message.get_all('Cc', []) + message.get_all('Delivered-To', [])
+		for (name, address) in email.utils.getaddresses(headers):
+			if address.lower().split('@')[0] == self.alias:
+				return True
+		return False
+	
+	def run(self, source):
+		"""Import every new message in a source, and its pending ones whose sender is now a Student.
+		
+		@return: A dict of counts ('messages', 'imported', 'skipped', and
+		'pending' for messages still waiting on their sender) and the set of
+		'unknown' sender addresses that did not match any Student.
+		"""
+		
+		emails = Student.select_email_map(self.connection)
+		result = {'messages' : 0, 'imported' : self.retry(source, emails), 'skipped' : 0, 'pending' : 0, 'unknown' : set()}
+		start = ImportCheckpoint.get(source.source_id, self.connection)
+		position = start
+		excuses = []
+		pending = []
+		for position, message in source.messages(start):
+			result['messages'] += 1
+			sender = email.utils.parseaddr(message.get('From', ''))[1].lower()
+			sent = email.utils.parsedate_tz(message.get('Date', ''))
+			if sent is None or not self.is_excuse(message):
+				result['skipped'] += 1
+			else:
+				dt = datetime.fromtimestamp(email.utils.mktime_tz(sent), TZ_EST)
+				if sender in emails:
+					# The record variable formatting matches the excuses columns after id
+					excuses.append((dt.isoformat(), None, ExcuseImporter.message_text(message), emails[sender]))
+				else:
+					result['unknown'].add(sender)
+					pending.append((source.source_id, sender, dt.isoformat(), ExcuseImporter.message_text(message)))
+			if result['messages'] % self.batch_size == 0:
+				result['imported'] += self.flush(source, excuses, pending, position)
+				excuses = []
+				pending = []
+		if position != start:
+			result['imported'] += self.flush(source, excuses, pending, position)
+		
+		try:
+			cur = AttendanceDB.cursor(self.connection)
+			
+			result['pending'] = list(cur.execute('SELECT COUNT(*) FROM pending_excuses WHERE source=?', (source.source_id,)))[0][0]
+		
+		finally:
+			AttendanceDB.release(cur)
+		return result
 	
+	def retry(self, source, emails):
+		"""Import a source's pending messages whose sender is now in emails, in one transaction.
+		
+		@return: The number imported.
+		"""
+		
+		try:
+			cur = AttendanceDB.cursor(self.connection)
+			
+			rows = list(cur.execute('SELECT id, sender, dt, reason FROM pending_excuses WHERE source=? ORDER BY id', (source.source_id,)))
+		
+		finally:
+			AttendanceDB.release(cur)
+		matched = [row for row in rows if row[1] in emails]
+		if len(matched) == 0:
+			return 0
+		with AttendanceDB.transaction(self.connection):
+			self.insert([(dt, None, reason, emails[sender]) for (row_id, sender, dt, reason) in matched])
+			try:
+				cur = AttendanceDB.cursor(self.connection)
+				cur.executemany('DELETE FROM pending_excuses WHERE id=?', [(row[0],) for row in matched])
+			finally:
+				AttendanceDB.release(cur)
+		return len(matched)
+	
+	def insert(self, excuses):
+		"""Insert excuses rows, each in its date's Semester partition."""
+		
+		try:
+			cur = AttendanceDB.cursor(self.connection)
+			for (table, rows) in SemesterPartitions.by_table('excuses', excuses, self.connection):
+				cur.executemany('INSERT INTO %s (dt, event, reason, student) VALUES (?,?,?,?)' % table, rows)
+		finally:
+			AttendanceDB.release(cur)
+	
+	def flush(self, source, excuses, pending, position):
+		"""Insert a batch of excuses and pending_excuses rows and move the checkpoint in one transaction."""
+		
+		with AttendanceDB.transaction(self.connection):
+			self.insert(excuses)
+			try:
+				cur = AttendanceDB.cursor(self.connection)
+				cur.executemany('INSERT INTO pending_excuses (source, sender, dt, reason) VALUES (?,?,?,?)', pending)
+			finally:
+				AttendanceDB.release(cur)
+			ImportCheckpoint.set(source.source_id, position, self.connection)
+		return len(excuses)
+
 class Signin(object):
 	
 	"""Corresponds to a row in the RFID output record file. 
@@ -1569,6 +3897,8 @@ class Signin(object):
 	The datetime and student ID are the primary key colums.
 	"""
 	
+	__slots__ = ["signin_dt", "event", "student"]
+	
 	@classmethod
 	def new_from_row(cls, row, connection):
 		"""Given a signins row from the DB, returns a signin object."""
@@ -1576,7 +3906,7 @@ class Signin(object):
 		if row[1] is None:
 			event = None
 		else:
-			event = Event.select_by_id(row[1], connection)[0]
+			event = Event.select_by_id(row[1], connection)
 		if row[2] is None:
 			student = None
 		else:
@@ -1589,13 +3919,16 @@ class Signin(object):
 		
 		signins = []
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
-			for row in cur.execute('SELECT * FROM signins WHERE student=?', (student.id,)):
+			rows = []
+			for table in SemesterPartitions.each('signins', connection):
+				rows.extend(cur.execute('SELECT * FROM %s WHERE student=?' % table, (student.rfid,)))
+			for row in rows:
 				signins.append(Signin.new_from_row(row, connection))
 				
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 			return signins
 	
 	@staticmethod
@@ -1603,20 +3936,22 @@ class Signin(object):
 		"""Return the list of Signins in a given datetime range."""
 		
 		signins = []
+		tables = SemesterPartitions.tables('signins', connection, start=start_dt, end=end_dt)
 		if type(start_dt == datetime):
 			start_dt = start_dt.isoformat()
 		if type(end_dt == datetime):
 			end_dt = end_dt.isoformat()
 		
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
 			params = (start_dt, end_dt,)
-			for row in cur.execute('SELECT * FROM signins WHERE dt BETWEEN ? AND ?', params):
-				signins.append(Signin.new_from_row(row, connection))
+			for table in tables:
+				for row in cur.execute('SELECT * FROM %s WHERE dt BETWEEN ? AND ?' % table, params):
+					signins.append(Signin.new_from_row(row, connection))
 				
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 			return signins
 	
 	@staticmethod
@@ -1625,13 +3960,16 @@ class Signin(object):
 		
 		signins = []
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
-			for row in cur.execute('SELECT * FROM signins WHERE event=?', (event.id,)):
+			rows = []
+			for table in SemesterPartitions.tables('signins', connection, row_id=event.id):
+				rows.extend(cur.execute('SELECT * FROM %s WHERE event=?' % table, (event.id,)))
+			for row in rows:
 				signins.append(Signin.new_from_row(row, connection))
 				
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 			return signins
 	
 	@staticmethod
@@ -1645,15 +3983,18 @@ class Signin(object):
 			end_dt = end_dt.isoformat()
 			
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
-			sql = 'SELECT * FROM signins WHERE student=? AND (dt BETWEEN ? AND ?) AND event=?'
+			sql = 'SELECT * FROM %s WHERE student=? AND (dt BETWEEN ? AND ?) AND event=?'
 			params = (id, start_dt, end_dt, event_id,)
-			for row in cur.execute(sql, params):
+			rows = []
+			for table in SemesterPartitions.tables('signins', connection, row_id=event_id):
+				rows.extend(cur.execute(sql % table, params))
+			for row in rows:
 				signins.append(Signin.new_from_row(row, connection))
 				
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 			return signins
 	
 	def __init__(self, dt, event, student):
@@ -1673,7 +4014,7 @@ class Signin(object):
 		time_window = datetime.timedelta(0, 0, 0, 0, 0, 2, 0)	# 2 hours
 		try:
 			events = []
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
 			sql = 'SELECT * FROM events WHERE (dt BETWEEN ? AND ?) AND group IN (SELECT group FROM group_memberships WHERE student=?)'
 			params = ((self.signin_dt - time_window).isoformat(), (self.signin_dt + time_window).isoformat(), self.student.rfid,) 
@@ -1690,44 +4031,44 @@ class Signin(object):
 				events.append(event)
 		
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 			return events
 	
 	def update(self, connection):
 		"""Update an existing Signin record in the DB."""
 		
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
 			params = (self.signin_dt.isoformat(), self.event.id, self.student.rfid,)
 			cur.execute('UPDATE signins SET dt=?1, event=?2, student=?3 WHERE dt=?1 AND student=?3', params)
 				
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 	
 	def insert(self, connection):
 		"""Write the Signin to the DB."""
 		
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
 			params = (self.signin_dt.isoformat(), self.event.id, self.student.rfid,)
 			cur.execute('INSERT OR ABORT INTO signins VALUES (?,?,?)', params)
 				
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 	
 	def delete(self, connection):
 		"""Delete the Signin from the DB."""
 		
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
 			params = (self.signin_dt.isoformat(), self.student.rfid,)
 			cur.execute('DELETE FROM signins WHERE dt=? AND student=?', params)
 				
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 
 class Event(object):
 	
@@ -1745,6 +4086,13 @@ class Event(object):
 	ATTENDANCE_OPENS = timedelta(0, 0, 0, 0, -30, 0, 0)	# 30 minutes before
 	ATTENDANCE_CLOSES = timedelta(0, 0, 0, 0, 30, 1, 0)	# 90 minutes after
 	
+	__slots__ = ["id", "event_name", "description", "location", "start", "end", "event_type", "group", "semester", "gcal_id", 
+		"_signins", "_excuses", "_absences"]
+	
+	signins = relation('_signins')
+	excuses = relation('_excuses')
+	absences = relation('_absences')
+	
 	@classmethod
 	def new_from_row(cls, row, connection):
 		"""Given an events row from the DB, returns an Event object."""
@@ -1757,16 +4105,18 @@ class Event(object):
 			semester = None
 		else:
 			semester = Semester.select_by_name(row[8], connection)
-		return cls(row[0], row[1], row[2], parse(row[4], tzinfos=TIMEZONES), parse(row[5], tzinfos=TIMEZONES), row[6], group, semester, row[9])
+		return cls(row[0], row[1], row[2], row[3], parse(row[4], tzinfos=TIMEZONES), parse(row[5], tzinfos=TIMEZONES), row[6], group, semester, row[9])
 
 	@staticmethod
 	def select_by_id(event_id, connection):
 		"""Return the Event of given unique ID."""
 		
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
-			rows = list(cur.execute('SELECT * FROM events WHERE id=?', (event_id,)))
+			rows = []
+			for table in SemesterPartitions.tables('events', connection, row_id=event_id):
+				rows.extend(cur.execute('SELECT * FROM %s WHERE id=?' % table, (event_id,)))
 			if len(rows) > 1 or len(rows) < 0:
 				raise DatabaseException(Event.select_by_id.__name__, "Query returned %s rows, expected one." % len(rows))
 			elif len(rows) == 1:
@@ -1775,7 +4125,7 @@ class Event(object):
 				event = None
 				
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 			return event
 	
 	@staticmethod
@@ -1784,13 +4134,16 @@ class Event(object):
 		
 		events = []
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
-			for row in cur.execute('SELECT * FROM events WHERE eventname=?', (name,)):
+			rows = []
+			for table in SemesterPartitions.each('events', connection):
+				rows.extend(cur.execute('SELECT * FROM %s WHERE eventname=?' % table, (name,)))
+			for row in rows:
 				events.append(Event.new_from_row(row, connection))
 				
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 			return events
 	
 	@staticmethod
@@ -1798,17 +4151,21 @@ class Event(object):
 		"""Return the list of Events starting at a specific datetime."""
 		
 		events = []
+		tables = SemesterPartitions.tables('events', connection, start=event_dt, end=event_dt)
 		if type(event_dt == datetime):
 			event_dt = event_dt.isoformat()
 		
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
-			for row in cur.execute('SELECT * FROM events WHERE start=?', (event_dt,)):
+			rows = []
+			for table in tables:
+				rows.extend(cur.execute('SELECT * FROM %s WHERE start=?' % table, (event_dt,)))
+			for row in rows:
 				events.append(Event.new_from_row(row, connection))
 				
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 			return events
 	
 	@staticmethod
@@ -1816,20 +4173,22 @@ class Event(object):
 		"""Return the list of Events in a given datetime range."""
 		
 		events = []
+		tables = SemesterPartitions.tables('events', connection, start=start_dt, end=end_dt)
 		if type(start_dt == datetime):
 			start_dt = start_dt.isoformat()
 		if type(end_dt == datetime):
 			end_dt = end_dt.isoformat()
 		
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
 			params = (start_dt, end_dt,)
-			for row in cur.execute('SELECT * FROM events WHERE start BETWEEN ? AND ?', params):
-				events.append(Event.new_from_row(row, connection))
+			for table in tables:
+				for row in cur.execute('SELECT * FROM %s WHERE start BETWEEN ? AND ?' % table, params):
+					events.append(Event.new_from_row(row, connection))
 				
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 			return events
 	
 	@staticmethod
@@ -1838,13 +4197,16 @@ class Event(object):
 		
 		events = []
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
-			for row in cur.execute('SELECT * FROM events WHERE eventtype=?', (type,)):
+			rows = []
+			for table in SemesterPartitions.each('events', connection):
+				rows.extend(cur.execute('SELECT * FROM %s WHERE eventtype=?' % table, (type,)))
+			for row in rows:
 				events.append(Event.new_from_row(row, connection))
 				
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 			return events
 	
 	@staticmethod
@@ -1853,38 +4215,45 @@ class Event(object):
 		
 		events = []
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
-			for row in cur.execute('SELECT * FROM events WHERE group_id=?', (group,)):
+			rows = []
+			for table in SemesterPartitions.each('events', connection):
+				rows.extend(cur.execute('SELECT * FROM %s WHERE group_id=?' % table, (group,)))
+			for row in rows:
 				events.append(Event.new_from_row(row, connection))
 				
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 			return events
 	
 	@staticmethod
 	def select_by_semester(semester, connection):
-		"""Return the list of Events in a given Semester."""
+		"""Return the list of Events in a given Semester, through the QueryCache."""
 		
 		events = []
-		try:
-			cur = connection.cursor()
-			
-			for row in cur.execute('SELECT * FROM events WHERE semester=?', (semester,)):
-				events.append(Event.new_from_row(row, connection))
-				
-		finally:
-			cur.close()
-			return events
+		if hasattr(semester, 'term_one'):	# Probably a Semester object
+			semester = semester.name
+		
+		def build(rows):
+			return [Event.new_from_row(row, connection) for row in rows]
+		
+		cache = QueryCache.for_connection(connection)
+		for table in SemesterPartitions.tables('events', connection, semester=semester):
+			sql = 'SELECT * FROM %s WHERE semester=?' % table
+			events.extend(cache.select(sql, (semester,), (table,) + Group.DEPENDENCIES, build))
+		return events
 	
 	@staticmethod
 	def select_by_gcal_id(gcal_id, connection):
 		"""Return the Event of a given Google Calendar event ID."""
 		
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			event = None
-			rows = list(cur.execute('SELECT * FROM events WHERE gcal_id=?', (gcal_id,)))
+			rows = []
+			for table in SemesterPartitions.each('events', connection):
+				rows.extend(cur.execute('SELECT * FROM %s WHERE gcal_id=?' % table, (gcal_id,)))
 			if len(rows) > 1 or len(rows) < 0:
 				raise DatabaseException(Event.select_by_gcal_id.__name__, "Query returned %s rows, expected one." % len(rows))
 			elif len(rows) == 1:
@@ -1893,7 +4262,7 @@ class Event(object):
 				event = None
 				
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 			return event
 	
 	@staticmethod
@@ -1907,15 +4276,18 @@ class Event(object):
 			end_dt = end_dt.isoformat()
 		
 		try:
-			cur = connection.cursor()
+			cur = AttendanceDB.cursor(connection)
 			
-			sql = 'SELECT * FROM events WHERE eventname=? AND (start BETWEEN ? AND ?) AND eventtype=? AND group_id=? AND semester=? AND gcal_id=?'
+			sql = 'SELECT * FROM %s WHERE eventname=? AND (start BETWEEN ? AND ?) AND eventtype=? AND group_id=? AND semester=? AND gcal_id=?'
 			params = (name, start_dt, end_dt, type, group, semester, gcal_id,)
-			for row in cur.execute(sql, params):
+			rows = []
+			for table in SemesterPartitions.tables('events', connection, semester=semester):
+				rows.extend(cur.execute(sql % table, params))
+			for row in rows:
 				events.append(Event.new_from_row(row, connection))
 				
 		finally:
-			cur.close()
+			AttendanceDB.release(cur)
 			return events
 	
 	def __init__(self, id, name, description, location, start, end, type, group, semester, gcal_id):
@@ -1929,19 +4301,19 @@ class Event(object):
 		self.group = group			# Roster to check against
 		self.semester = semester	# A Semester object
 		self.gcal_id = gcal_id		# Google Calendar event ID
-		self.signins = []
-		self.excuses = []
-		self.absences = []
+		self._signins = None
+		self._excuses = None
+		self._absences = None
 	
 	def fetch_signins(self, connection):
 		"""Fetch all Signins for this Event from the database."""
 		
-		self.signins = Signin.select_by_start(self.event_dt+Event.ATTENDANCE_OPENS, self.event_dt+Event.ATTENDANCE_CLOSES, connection)
+		self.signins = Signin.select_by_start(self.start+Event.ATTENDANCE_OPENS, self.start+Event.ATTENDANCE_CLOSES, connection)
 	
 	def fetch_excuses(self, connection):
 		"""Fetch all Excuses for this Event from the database."""
 		
-		self.excuses = Excuse.select_by_start(self.event_dt+Excuse.EXCUSES_OPENS, self.event_dt+Excuse.EXCUSES_CLOSES, connection)
+		self.excuses = Excuse.select_by_datetime_range(self.start+Excuse.EXCUSES_OPENS, self.start+Excuse.EXCUSES_CLOSES, connection)
 		
 	def fetch_absences(self, connection):
 		"""Fetch all Absences for this Event from the database."""
@@ -1956,19 +4328,22 @@ class Event(object):
 		optional_attendees = set()
 		mandatory_attendees = set()
 		for group in self.group.find_concurrent_optional_groups(connection):
-			for member in group.members:
-				optional_attendees.add(member)
-		
-		for group in self.group.find_mandatory_optional_groups(connection):
-			for member in group.members:
-				mandatory_attendees.add(member)
-		
-		# Set attendee 'optional' flag 
-		for member in self.group.members:
-			attendee = {
-					'email' : member.email, 
-					'displayName' : member.lname + ', ' + member.fname }
-			if member in optional_attendees and member not in mandatory_attendees:
+			for member in Student.select_by_group(group, True, connection):
+				optional_attendees.add(member.rfid)
+		
+		for group in self.group.find_concurrent_mandatory_groups(connection):
+			for member in Student.select_by_group(group, True, connection):
+				mandatory_attendees.add(member.rfid)
+		
+		# Set attendee 'optional' flag; students made from unknown cards have no name or email yet
+		for member in Student.select_by_group(self.group, True, connection):
+			if not member.email:
+				continue
+			attendee = {'email' : member.email}
+			name = ', '.join(part for part in (member.lname, member.fname) if part)
+			if len(name) > 0:
+				attendee['displayName'] = name
+			if member.rfid in optional_attendees and member.rfid not in mandatory_attendees:
 				attendee['optional'] = True
 			else:
 				attendee['optional'] = False
@@ -1981,12 +4356,12 @@ class Event(object):
 		event['status'] = 'confirmed'
 		if self.description is not None and len(self.description) > 0:
 			event['description'] = self.description
-		if self.loctaion is not None and len(self.location) > 0:
+		if self.location is not None and len(self.location) > 0:
 			event['location'] = self.location
 		if self.gcal_id is not None:
 			event['id'] = self.gcal_id
 		
-		event = simplejson.dumps(event)
+		event = json.dumps(event)
 		return event
 	
 	def gcal_get(self, gcal):
@@ -2033,47 +4408,1589 @@ class Event(object):
 			self.gcal_id = inserted_event['id']
 			return inserted_event
 	
-	def update(self, connection):
-		"""Update an existing Event record in the DB."""
+	def calendar_id(self):
+		"""Return the ID of the Google calendar this Event belongs on, or None if its Organization has none."""
+		
+		if self.group is None or self.group.organization is None:
+			return None
+		return self.group.organization.calendar.get('id')
+	
+	def gcal_push(self, connection, resource=None):
+		"""Queue this Event's resource for the Google calendar without touching the network.
 		
+		The mutation is stored in the gcal_outbox table and sent later by
+		GCalOutbox.drain (or an OutboxDrainer thread). Nothing is queued for
+		an Event whose Organization has no calendar. A failure to build or
+		queue the resource is printed and rolled back on its own, leaving the
+		caller's write to the Event in place.
+		@param resource: A gcal event resource in dict format; make_json()'s by default.
+		"""
+		
+		calendar_id = self.calendar_id()
+		if calendar_id is None:
+			return
 		try:
-			cur = connection.cursor()
-			
-			sql = 'UPDATE events SET eventname=?, description=?, location=? start=?, end=?, type=?, group_id=?, gcal_id=? WHERE id=?'
-			params = (self.name, self.description, self.location, self.start.isoformat(), self.end.isoformat(), self.event_type, self.group.id, self.gcal_id, self.id,)
-			cur.execute(sql, params)
+			with AttendanceDB.transaction(connection):
+				if resource is None:
+					resource = json.loads(self.make_json(connection))
+				if self.gcal_id is not None and len(self.gcal_id) > 0:
+					operation = GCalOutbox.OP_UPDATE
+				else:
+					operation = GCalOutbox.OP_INSERT
+				GCalOutbox.enqueue(self.id, operation, calendar_id, resource, connection)
+		except Exception:
+			traceback.print_exc()
+	
+	def gcal_remove(self, connection):
+		"""Queue this Event's removal from the Google calendar, dropping anything pending for it.
+		
+		As for gcal_push(), a failure leaves the caller's write in place.
+		"""
+		
+		calendar_id = self.calendar_id()
+		if calendar_id is None:
+			return
+		try:
+			with AttendanceDB.transaction(connection):
+				GCalOutbox.enqueue(self.id, GCalOutbox.OP_DELETE, calendar_id, {'id' : self.gcal_id}, connection)
+		except Exception:
+			traceback.print_exc()
+	
+	def update(self, connection):
+		"""Update an existing Event record in the DB and queue the change for the Google calendar.
+		
+		A gcal_id of None leaves the stored one alone, as the outbox may have set it since this Event was read.
+		"""
+		
+		with AttendanceDB.transaction(connection):
+			try:
+				cur = AttendanceDB.cursor(connection)
 				
-		finally:
-			cur.close()
+				sql = '''UPDATE %s SET eventname=?, description=?, location=?, start=?, end=?, eventtype=?, group_id=?, semester=?, 
+				gcal_id=IFNULL(?, gcal_id) WHERE id=?''' % SemesterPartitions.table_for('events', connection, row_id=self.id)
+				params = (self.event_name, self.description, self.location, self.start.isoformat(), self.end.isoformat(), self.event_type, 
+					getattr(self.group, 'id', None), getattr(self.semester, 'name', None), self.gcal_id, self.id,)
+				cur.execute(sql, params)
+					
+			finally:
+				AttendanceDB.release(cur)
+			self.gcal_push(connection)
 	
 	def insert(self, connection):
-		"""Write the Event to the DB and retrieve the auto-assigned ID."""
+		"""Write the Event to the DB, retrieve the auto-assigned ID and queue it for the Google calendar."""
 		
-		try:
-			cur = connection.cursor()
-			
-			params = (self.name, self.description, self.location, self.start.isoformat(), self.end.isoformat(), self.event_type, self.group.id, self.gcal_id,)
-			cur.execute('INSERT INTO events VALUES (NULL,?,?,?,?,?,?,?,?)', params)
-			
-			params = (self.name, self.start.isoformat(), self.end.isoformat(), self.event_type, self.group.id, self.gcal_id,)
-			rows = list(cur.execute('SELECT id FROM events WHERE eventname=? AND start=? AND end=? AND type=? AND group_id=? AND gcal_id=?', params))
-			if len(rows) > 1 or len(rows) < 0:
-				raise DatabaseException(self.insert.__name__, "Query returned %s rows, expected one." % len(rows))
-			elif len(rows) == 1:
-				self.id = rows[0][0]
-			elif len(rows) == 0:
-				raise DatabaseException(self.insert.__name__, "Could not retrieve event ID post-insert.")
+		with AttendanceDB.transaction(connection):
+			try:
+				cur = AttendanceDB.cursor(connection)
 				
-		finally:
-			cur.close()
+				params = (self.event_name, self.description, self.location, self.start.isoformat(), self.end.isoformat(), self.event_type, 
+					getattr(self.group, 'id', None), getattr(self.semester, 'name', None), self.gcal_id,)
+				# A partitioned DB keeps the Event in its Semester's file, or else the one its start date falls in
+				if self.semester is not None:
+					table = SemesterPartitions.tables('events', connection, semester=self.semester)[0]
+				else:
+					table = SemesterPartitions.table_for('events', connection, day=self.start)
+				sql = 'INSERT INTO %s (eventname, description, location, start, end, eventtype, group_id, semester, gcal_id) VALUES (?,?,?,?,?,?,?,?,?)' % table
+				cur.execute(sql, params)
+				self.id = connection.last_insert_rowid()
+					
+			finally:
+				AttendanceDB.release(cur)
+			self.gcal_push(connection)
 	
 	def delete(self, connection):
-		"""Delete the Event from the DB."""
+		"""Delete the Event from the DB and queue its removal from the Google calendar."""
 		
-		try:
-			cur = connection.cursor()
-			
-			cur.execute('DELETE FROM events WHERE id=?', (self.id,))
+		with AttendanceDB.transaction(connection):
+			try:
+				cur = AttendanceDB.cursor(connection)
 				
-		finally:
-			cur.close()
+				# The outbox may have inserted the Event into the calendar since it was read
+				table = SemesterPartitions.table_for('events', connection, row_id=self.id)
+				rows = list(cur.execute('SELECT gcal_id FROM %s WHERE id=?' % table, (self.id,)))
+				if len(rows) == 1 and rows[0][0] is not None:
+					self.gcal_id = rows[0][0]
+				cur.execute('DELETE FROM %s WHERE id=?' % table, (self.id,))
+					
+			finally:
+				AttendanceDB.release(cur)
+			self.gcal_remove(connection)
+
+class WeeklyRule(object):
+	
+	"""A weekly Event slot for a Group, e.g. Tuesdays 18:30-20:30.
+	
+	generate() expands the rule over a Semester's two Terms, skipping days
+	off and the break between Terms, and brings the events table in line with
+	the result.
+	"""
+	
+	def __init__(self, weekday, start_time, end_time, group_id, name='Rehearsal', event_type=Event.TYPE_REHEARSAL, location=None, description=None):
+		self.weekday = weekday			# 0 is Monday, as in date.weekday()
+		self.start_time = start_time	# a time object
+		self.end_time = end_time		# a time object
+		self.group_id = group_id
+		self.name = name
+		self.event_type = event_type	# One of the Event.TYPE_ constants
+		self.location = location
+		self.description = description
+	
+	def dates(self, semester, calendar):
+		"""Return the dates this rule falls on in a Semester, less days off."""
+		
+		dates = []
+		for term in (semester.term_one, semester.term_two):
+			day = term.start_date + timedelta((self.weekday - term.start_date.weekday()) % 7)
+			while day <= term.end_date:
+				if not calendar.is_day_off(day):
+					dates.append(day)
+				day += timedelta(7)
+		return dates
+	
+	def expand(self, semester, calendar):
+		"""Return the list of (start, end) datetimes for a Semester."""
+		
+		times = []
+		for day in self.dates(semester, calendar):
+			start = datetime.combine(day, self.start_time).replace(tzinfo=TZ_EST)
+			end = datetime.combine(day, self.end_time).replace(tzinfo=TZ_EST)
+			times.append((start, end))
+		return times
+	
+	def generate(self, semester, connection):
+		"""Create, move and remove this rule's Events for a Semester in one transaction.
+		
+		Running it again after the calendar changes only touches Events whose
+		date moved: they keep their ID (and Google Calendar ID) and get new
+		start/end times. Surplus Events are deleted unless they already have
+		signins, excuses or absences. Inserts, moves and deletes are queued in
+		the GCalOutbox in the same transaction.
+		@param semester: A Semester; its Terms are read afresh from the
+		calendar, so an object held across a Term change still works.
+		@return: A dict of counts: 'inserted', 'moved', 'deleted', 'unchanged'
+		and 'kept' (surplus Events left in place because they have records).
+		"""
+		
+		calendar = AcademicCalendar.for_connection(connection)
+		name = semester.name
+		semester = calendar.semester_by_name(name)
+		if semester is None:
+			raise DatabaseException(self.generate.__name__, "No such semester: %s" % name)
+		wanted = {}
+		for (start, end) in self.expand(semester, calendar):
+			wanted[start.isoformat()] = end.isoformat()
+		
+		result = {'inserted' : 0, 'moved' : 0, 'deleted' : 0, 'unchanged' : 0, 'kept' : 0}
+		with AttendanceDB.transaction(connection):
+			# A partitioned DB keeps the Semester's Events in its own file, current or not
+			tables = dict((table, SemesterPartitions.tables(table, connection, semester=semester)[0]) for table in ('events', 'signins', 'excuses', 'absences'))
+			events = tables['events']
+			try:
+				cur = AttendanceDB.cursor(connection)
+				
+				sql = '''SELECT id, start, EXISTS (SELECT 1 FROM %(signins)s WHERE event=events.id) 
+					OR EXISTS (SELECT 1 FROM %(excuses)s WHERE event=events.id) 
+					OR EXISTS (SELECT 1 FROM %(absences)s WHERE event=events.id) 
+				FROM %(events)s AS events WHERE group_id=? AND semester=? AND eventname=? AND eventtype=? ORDER BY start''' % tables
+				params = (self.group_id, semester.name, self.name, self.event_type,)
+				surplus = []
+				for (event_id, start, used) in list(cur.execute(sql, params)):
+					if start in wanted:
+						del wanted[start]
+						result['unchanged'] += 1
+					else:
+						surplus.append((event_id, used))
+				missing = sorted(wanted.keys())
+				
+				# Reuse surplus Events with no signins, excuses or absences for the new dates
+				movable = [event_id for (event_id, used) in surplus if not used]
+				result['kept'] = len(surplus) - len(movable)
+				moves = []
+				while len(missing) > 0 and len(movable) > 0:
+					start = missing.pop(0)
+					moves.append((start, wanted[start], movable.pop(0),))
+				cur.executemany('UPDATE %s SET start=?, end=? WHERE id=?' % events, moves)
+				result['moved'] = len(moves)
+				pushed = [event_id for (start, end, event_id) in moves]
+				
+				sql = '''INSERT INTO %s (eventname, description, location, start, end, eventtype, group_id, semester) 
+				VALUES (?,?,?,?,?,?,?,?)''' % events
+				for start in missing:
+					cur.execute(sql, (self.name, self.description, self.location, start, wanted[start], self.event_type, self.group_id, semester.name,))
+					pushed.append(connection.last_insert_rowid())
+				result['inserted'] = len(missing)
+				
+				# Read the surplus Events (and their Google Calendar IDs) before they go
+				removed = [Event.select_by_id(event_id, connection) for event_id in movable]
+				cur.executemany('DELETE FROM %s WHERE id=?' % events, [(event_id,) for event_id in movable])
+				result['deleted'] = len(movable)
+			
+			finally:
+				AttendanceDB.release(cur)
+			for event_id in pushed:
+				Event.select_by_id(event_id, connection).gcal_push(connection)
+			for event in removed:
+				event.gcal_remove(connection)
+		return result
+
+def epoch(dt):
+	"""Return the Unix time of a timezone-aware datetime."""
+	
+	return timegm(dt.utctimetuple())
+
+class EventIndex(object):
+	
+	"""In-memory index of Event sign in windows for fast "which Event is on now" lookups.
+	
+	Each Event is kept as its (opens, closes) Unix times, i.e. start +
+	Event.ATTENDANCE_OPENS and start + Event.ATTENDANCE_CLOSES.
+	"""
+	
+	__slots__ = ["opens", "windows", "longest", "closes_by_id"]
+	
+	def __init__(self, rows):
+		"""@param rows: (event ID, group ID, start Unix time) tuples."""
+		
+		opens_offset = Event.ATTENDANCE_OPENS.days * 86400 + Event.ATTENDANCE_OPENS.seconds
+		closes_offset = Event.ATTENDANCE_CLOSES.days * 86400 + Event.ATTENDANCE_CLOSES.seconds
+		self.windows = sorted((start + opens_offset, start + closes_offset, event_id, group_id) for (event_id, group_id, start) in rows)
+		self.opens = [w[0] for w in self.windows]
+		self.closes_by_id = dict((w[2], w[1]) for w in self.windows)
+		self.longest = closes_offset - opens_offset
+	
+	@classmethod
+	def select_by_datetime_range(cls, start_dt, end_dt, connection):
+		"""Build an EventIndex over the Events starting in a datetime range."""
+		
+		rows = []
+		try:
+			cur = AttendanceDB.cursor(connection)
+			
+			for table in SemesterPartitions.tables('events', connection, start=start_dt, end=end_dt):
+				sql = '''SELECT id, group_id, CAST(strftime('%%s', start) AS INTEGER) FROM %s 
+				WHERE CAST(strftime('%%s', start) AS INTEGER) BETWEEN ? AND ?''' % table
+				rows.extend(cur.execute(sql, (epoch(start_dt), epoch(end_dt),)))
+		
+		finally:
+			AttendanceDB.release(cur)
+		return cls(rows)
+	
+	@classmethod
+	def select_all(cls, connection):
+		"""Build an EventIndex over every Event, in every Semester's partition."""
+		
+		rows = []
+		try:
+			cur = AttendanceDB.cursor(connection)
+			
+			for table in SemesterPartitions.each('events', connection):
+				rows.extend(cur.execute("SELECT id, group_id, CAST(strftime('%%s', start) AS INTEGER) FROM %s" % table))
+		
+		finally:
+			AttendanceDB.release(cur)
+		return cls(rows)
+	
+	def event_ids(self):
+		"""Return the IDs of every indexed Event."""
+		
+		return [w[2] for w in self.windows]
+	
+	def closes(self, event_id):
+		"""Return the Unix time an Event's sign in window closes."""
+		
+		return self.closes_by_id[event_id]
+	
+	def lookup(self, when, groups=()):
+		"""Return the ID of the Event whose sign in window contains a Unix time, or None.
+		
+		If several windows overlap, an Event held by one of the given group IDs wins.
+		"""
+		
+		found = None
+		i = bisect.bisect_right(self.opens, when) - 1
+		while i >= 0 and self.opens[i] >= when - self.longest:
+			(opens, closes, event_id, group_id) = self.windows[i]
+			if when <= closes:
+				if group_id in groups:
+					return event_id
+				if found is None:
+					found = event_id
+			i -= 1
+		return found
+
+class ColumnExport(object):
+	
+	"""Reads a few typed columns of a table into arrays, without building model objects.
+	
+	For analytics that only need IDs, times and types. Times are Unix epochs,
+	text types are indexes into CATEGORIES (-1 if unknown) and NULL IDs are
+	-1. Rows are copied out of the cursor a chunk at a time, so only one
+	chunk of row tuples is alive at once.
+	"""
+	
+	# Rows copied from the cursor per chunk
+	CHUNK = 10000
+	
+	# Typecode for IDs and times: partition IDs need 64 bits, but 'l' is 32 bits on
+	# Windows and Python 2's array has no 'q', so fall back to exact-to-2**53 doubles
+	try:
+		INT64 = array.array('q').typecode
+	except ValueError:
+		INT64 = 'l' if array.array('l').itemsize == 8 else 'd'
+	
+	# table -> ((column, SQL expression, array typecode), ...); CATEGORIES columns are coded by a CASE
+	COLUMNS = {
+		'signins' : (('student', 'student', INT64), ('event', 'COALESCE(event, -1)', INT64), ('time', "CAST(strftime('%s', dt) AS INTEGER)", INT64)), 
+		'events' : (('event', 'id', INT64), ('group', 'COALESCE(group_id, -1)', INT64), ('start', "CAST(strftime('%s', start) AS INTEGER)", INT64), 
+			('end', "CAST(strftime('%s', end) AS INTEGER)", INT64), ('type', 'eventtype', 'b')), 
+		'absences' : (('student', 'student', INT64), ('event', 'event', INT64), ('excuse', 'CAST(COALESCE(excuseid, -1) AS INTEGER)', INT64), ('type', 'type', 'b')), 
+		'excuses' : (('excuse', 'id', INT64), ('student', 'student', INT64), ('event', 'COALESCE(event, -1)', INT64), 
+			('time', "CAST(strftime('%s', dt) AS INTEGER)", INT64)), 
+		'group_memberships' : (('student', 'student', INT64), ('group', 'group_id', INT64), ('credit', 'COALESCE(credit, 0)', 'b'))}
+	
+	CATEGORIES = {('events', 'type') : (Event.TYPE_REHEARSAL, Event.TYPE_MAKEUP, Event.TYPE_DRESS, Event.TYPE_CONCERT), 
+		('absences', 'type') : (Absence.TYPE_PENDING, Absence.TYPE_EXCUSED, Absence.TYPE_UNEXCUSED)}
+	
+	# table -> column a date range applies to; the others go by their Event's (or Group's Events') start
+	TIMES = {'signins' : 'dt', 'excuses' : 'dt', 'events' : 'start'}
+	
+	@staticmethod
+	def where(table, events_tables, semester, start, end):
+		"""Return the WHERE clause and parameters for a Semester name and/or a datetime range."""
+		
+		clauses = []
+		params = []
+		if semester is not None:
+			if table == 'events':
+				clauses.append('semester = ?')
+			elif table == 'group_memberships':
+				clauses.append('group_id IN (SELECT id FROM groups WHERE semester = ?)')
+			else:
+				clauses.append('event IN (SELECT id FROM %s WHERE semester = ?)' % events_tables[0])
+			params.append(semester)
+		if start is not None:
+			bounds = [epoch(start), epoch(end)]
+			if table in ColumnExport.TIMES:
+				clauses.append("CAST(strftime('%%s', %s) AS INTEGER) BETWEEN ? AND ?" % ColumnExport.TIMES[table])
+				params.extend(bounds)
+			else:
+				(key, column) = ('group_id', 'group_id') if table == 'group_memberships' else ('event', 'id')
+				clauses.append('%s IN (%s)' % (key, ' UNION '.join("SELECT %s FROM %s WHERE CAST(strftime('%%s', start) AS INTEGER) BETWEEN ? AND ?" % (column, events) 
+					for events in events_tables)))
+				params.extend(bounds * len(events_tables))
+		if len(clauses) == 0:
+			return ('', params)
+		return (' WHERE ' + ' AND '.join(clauses), params)
+	
+	@staticmethod
+	def select(table, connection, semester=None, start=None, end=None, as_numpy=False):
+		"""Return an OrderedDict of column name -> array.array for a table's COLUMNS.
+		
+		@param semester: Only rows of this Semester (object or name).
+		@param start: With end, only rows in this timezone-aware datetime range.
+		@param as_numpy: Return NumPy arrays (sharing the arrays' memory) instead.
+		"""
+		
+		if table not in ColumnExport.COLUMNS:
+			raise DatabaseException(ColumnExport.select.__name__, "No columnar export of table %s." % table)
+		if hasattr(semester, 'term_one'):	# Probably a Semester object
+			semester = semester.name
+		if start is not None and end is None:
+			raise DatabaseException(ColumnExport.select.__name__, "A date range needs both start and end.")
+		
+		expressions = []
+		select_params = []
+		for (name, expression, typecode) in ColumnExport.COLUMNS[table]:
+			if (table, name) in ColumnExport.CATEGORIES:
+				categories = ColumnExport.CATEGORIES[(table, name)]
+				expression = 'CASE %s %s ELSE -1 END' % (expression, ' '.join('WHEN ? THEN %d' % i for i in range(len(categories))))
+				select_params.extend(categories)
+			expressions.append(expression)
+		if table == 'group_memberships':
+			sources = [('group_memberships', SemesterPartitions.tables('events', connection, semester=semester, start=start, end=end))]
+		else:
+			sources = [(name, [name[:-len(table)] + 'events']) for name in SemesterPartitions.tables(table, connection, semester=semester, start=start, end=end)]
+		
+		columns = [array.array(typecode) for (name, expression, typecode) in ColumnExport.COLUMNS[table]]
+		for (source, events_tables) in sources:
+			(where, where_params) = ColumnExport.where(table, events_tables, semester, start, end)
+			try:
+				cur = AttendanceDB.cursor(connection)
+				
+				rows = cur.execute('SELECT %s FROM %s%s' % (', '.join(expressions), source, where), select_params + where_params)
+				while True:
+					chunk = list(itertools.islice(rows, ColumnExport.CHUNK))
+					if len(chunk) == 0:
+						break
+					for (column, values) in zip(columns, zip(*chunk)):
+						column.extend(values)
+			
+			finally:
+				AttendanceDB.release(cur)
+		
+		if as_numpy:
+			import numpy
+			columns = [numpy.frombuffer(column, dtype=column.typecode) if len(column) > 0 else numpy.zeros(0, dtype=column.typecode) for column in columns]
+		return OrderedDict(zip([name for (name, expression, typecode) in ColumnExport.COLUMNS[table]], columns))
+
+# What the kiosk tells the person who just tapped their card
+KioskTap = namedtuple('KioskTap', ['student', 'event', 'status'])
+
+class SigninWriter(threading.Thread):
+	
+	"""Background thread that writes queued signins rows in small group commits.
+	
+	The thread writes through its own connection to db.disk_db, opened in
+	run(). A batch that fails to commit (e.g. BusyError while another copy
+	or thread holds the shared DB) is kept and retried with backoff, with
+	the failure in error meanwhile. stop() raises it if the batch still
+	can't be written.
+	"""
+	
+	RETRY_DELAY = 0.05			# First wait after a failed batch, doubling up to RETRY_DELAY_MAX, in seconds
+	RETRY_DELAY_MAX = 5.0
+	STOP_RETRIES = 5			# Retries a failing batch gets once stop() is called
+	
+	def __init__(self, db, batch_size=20, flush_interval=0.25, semester=None):
+		"""@param db: The AttendanceDB to write to, on its disk file.
+		@param semester: The current Semester, if the DB is partitioned.
+		"""
+		
+		threading.Thread.__init__(self, name='signin-writer')
+		self.daemon = True
+		self.db = db
+		self.semester = semester
+		self.connection = None		# The thread's own, opened by the first write
+		self.batch_size = batch_size
+		self.flush_interval = flush_interval	# Longest a tap waits in memory, in seconds
+		self.queue = Queue.Queue()
+		self.stopping = False
+		self.error = None			# Exception of the last failed batch, until one succeeds
+		self.unwritten = []			# Queued items given up on by stop()
+	
+	def put(self, signin, new_student=None):
+		"""Queue a signins row (dt, event, student), with a students row if the card is new."""
+		
+		self.queue.put((signin, new_student))
+	
+	def stop(self):
+		"""Write everything still queued and stop.
+		
+		@raise DatabaseException: If a batch still failed after STOP_RETRIES; the
+		items not written are left in unwritten.
+		"""
+		
+		self.stopping = True
+		self.join()
+		if len(self.unwritten) > 0:
+			raise DatabaseException(self.stop.__name__, "%d signins could not be written: %s" % (len(self.unwritten), self.error))
+	
+	def run(self):
+		try:
+			self.write_queued()
+		finally:
+			if self.connection is not None:
+				AttendanceDB.close_thread(self.connection)
+				self.connection = None
+	
+	def write_queued(self):
+		"""Write batches from the queue until stop() and the queue is empty."""
+		
+		batch = []
+		failures = 0
+		stop_retries = 0
+		while not (self.stopping and self.queue.empty() and len(batch) == 0):
+			if len(batch) == 0:
+				try:
+					batch.append(self.queue.get(True, self.flush_interval))
+					while len(batch) < self.batch_size:
+						batch.append(self.queue.get_nowait())
+				except Queue.Empty:
+					pass
+				if len(batch) == 0:
+					continue
+			try:
+				self.write(batch)
+			except Exception as e:
+				self.error = e
+				failures += 1
+				if self.stopping:
+					stop_retries += 1
+					if stop_retries > SigninWriter.STOP_RETRIES:
+						self.unwritten.extend(batch)
+						while not self.queue.empty():
+							self.unwritten.append(self.queue.get_nowait())
+						return
+				_time.sleep(min(SigninWriter.RETRY_DELAY * 2 ** min(failures - 1, 16), SigninWriter.RETRY_DELAY_MAX))
+				continue
+			batch = []
+			failures = 0
+			self.error = None
+	
+	def write(self, batch):
+		"""Commit one batch of signins."""
+		
+		if self.connection is None:
+			self.connection = self.db.connect_thread(self.semester)
+		students = [s for (signin, s) in batch if s is not None]
+		signins = [signin for (signin, s) in batch]
+		with AttendanceDB.transaction(self.connection):
+			try:
+				cur = AttendanceDB.cursor(self.connection)
+				
+				cur.executemany('INSERT OR IGNORE INTO students VALUES (?,NULL,NULL,NULL,1,1)', students)
+				cur.executemany('INSERT OR IGNORE INTO signins VALUES (?,?,?)', signins)
+			
+			finally:
+				AttendanceDB.release(cur)
+
+class Kiosk(object):
+	
+	"""Live sign in from an RFID reader.
+	
+	Students, group memberships and today's Events are loaded into memory up
+	front, so a tap is confirmed with a few dict and bisect lookups. The
+	signins rows are handed to a SigninWriter and committed in the background,
+	on its own connection to the same DB file.
+	"""
+	
+	def __init__(self, db, connection, clock=None, batch_size=20, flush_interval=0.25, journal=None, reader_id=0):
+		"""@param db: The AttendanceDB connection was opened from; its disk_db is written to.
+		@param connection: This thread's connection, for loading the roster and Events.
+		"""
+		
+		self.connection = connection
+		self.clock = clock				# Callable returning the current datetime; defaults to now
+		self.journal = journal			# Optional SigninJournal, written before anything else
+		self.reader_id = reader_id
+		self.students = {}				# RFID -> Student
+		self.groups = {}				# RFID -> set of group IDs
+		self.index = None
+		self.signed_in = set()			# (event ID, RFID) pairs already recorded
+		partitions = SemesterPartitions.for_connection(connection)
+		self.writer = SigninWriter(db, batch_size, flush_interval, getattr(partitions, 'current', None))
+	
+	def now(self):
+		if self.clock is None:
+			return datetime.now(TZ_EST).replace(microsecond=0)
+		return self.clock()
+	
+	def load(self):
+		"""Load the roster and the Events from yesterday through tomorrow."""
+		
+		now = self.now()
+		self.index = EventIndex.select_by_datetime_range(now - timedelta(1), now + timedelta(1), self.connection)
+		self.groups = Group.select_membership_map(self.connection)
+		try:
+			cur = AttendanceDB.cursor(self.connection)
+			
+			for row in cur.execute('SELECT * FROM students'):
+				self.students[row[0]] = Student.new_from_row(row)
+			for event_id in self.index.event_ids():
+				for (student,) in cur.execute('SELECT student FROM signins WHERE event=?', (event_id,)):
+					self.signed_in.add((event_id, student))
+		
+		finally:
+			AttendanceDB.release(cur)
+	
+	def start(self):
+		"""Load the in-memory state and start the background writer."""
+		
+		if self.journal is not None:
+			self.journal.open()
+		self.load()
+		self.writer.start()
+	
+	def close(self):
+		"""Wait for every queued signin to be committed.
+		
+		@raise DatabaseException: If the writer gave up on some; with a journal,
+		replay() can still load them.
+		"""
+		
+		try:
+			self.writer.stop()
+		finally:
+			if self.journal is not None:
+				self.journal.close()
+	
+	def tap(self, rfid, when=None):
+		"""Record a card tap and return a KioskTap describing it.
+		
+		The status is 'ok', 'duplicate' (already signed in to this Event),
+		or 'unknown' (a card not in the database, added as a blank Student).
+		"""
+		
+		if when is None:
+			when = self.now()
+		if self.journal is not None:
+			self.journal.append(rfid, when, self.reader_id)
+		event_id = self.index.lookup(epoch(when), self.groups.get(rfid, ()))
+		student = self.students.get(rfid)
+		new_student = None
+		status = 'ok'
+		if student is None:
+			student = Student(rfid, None, None, None)
+			self.students[rfid] = student
+			new_student = (rfid,)
+			status = 'unknown'
+		elif event_id is not None and (event_id, rfid) in self.signed_in:
+			return KioskTap(student, event_id, 'duplicate')
+		if event_id is not None:
+			self.signed_in.add((event_id, rfid))
+		# The record variable formatting matches the signins columns
+		self.writer.put((when.isoformat(), event_id, rfid), new_student)
+		return KioskTap(student, event_id, status)
+	
+	def run(self, stream, out):
+		"""Read one RFID number per line from stream until EOF, confirming each tap on out."""
+		
+		self.start()
+		try:
+			for line in iter(stream.readline, ''):
+				line = line.strip()
+				if not line.isdigit():
+					continue
+				result = self.tap(int(line))
+				if result.student.fname is None:
+					name = 'Card ' + line
+				else:
+					name = result.student.fname + ' ' + result.student.lname
+				if result.status == 'unknown':
+					out.write('%s: unknown card, added to the database\n' % name)
+				elif result.event is None:
+					out.write('%s: no event right now\n' % name)
+				elif result.status == 'duplicate':
+					out.write('%s: already signed in\n' % name)
+				else:
+					out.write('%s: signed in\n' % name)
+				if self.writer.error is not None:
+					out.write('Signins are not being saved yet (%s); retrying.\n' % self.writer.error)
+				out.flush()
+		finally:
+			self.close()
+
+class SigninJournal(object):
+	
+	"""Append-only binary file of card taps, written before the database.
+	
+	Each tap is one fixed-width RECORD written with a single os.write on an
+	O_APPEND descriptor, so taps are kept even while the DB is locked or
+	Dropbox is syncing. replay() loads the file into signins later.
+	"""
+	
+	RECORD = struct.Struct('<QqH')	# RFID, Unix time, reader ID
+	
+	def __init__(self, path):
+		self.path = path
+		self.source_id = 'journal:' + os.path.abspath(path)
+		self.fd = None
+	
+	def open(self):
+		"""Open the journal for appending, creating it if needed."""
+		
+		self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+	
+	def close(self):
+		if self.fd is not None:
+			os.close(self.fd)
+			self.fd = None
+	
+	def append(self, rfid, when, reader_id=0):
+		"""Write one tap. when is a timezone-aware datetime."""
+		
+		os.write(self.fd, SigninJournal.RECORD.pack(rfid, epoch(when), reader_id))
+	
+	def replay(self, connection, batch_size=5000):
+		"""Load taps written since the last replay into the signins table.
+		
+		Taps are assigned to Events with an EventIndex. Rows already in the
+		table are ignored (by the (dt, student) primary key, and the
+		(event, student) constraint keeps the earliest tap), so replaying twice
+		is harmless. A partly written record at the end of the file is left for
+		the next replay.
+		@return: The number of taps read.
+		"""
+		
+		size = SigninJournal.RECORD.size
+		offset = int(ImportCheckpoint.get(self.source_id, connection) or 0)
+		end = offset + (os.path.getsize(self.path) - offset) // size * size
+		if end <= offset:
+			return 0
+		
+		with open(self.path, 'rb') as f:
+			journal = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		try:
+			first = SigninJournal.RECORD.unpack_from(journal, offset)[1]
+			last = SigninJournal.RECORD.unpack_from(journal, end - size)[1]
+			index = EventIndex.select_by_datetime_range(datetime.fromtimestamp(first, TZ_EST) - timedelta(1), datetime.fromtimestamp(last, TZ_EST) + timedelta(1), connection)
+			groups = Group.select_membership_map(connection)
+			for batch_start in xrange(offset, end, batch_size * size):
+				batch_end = min(end, batch_start + batch_size * size)
+				students = []
+				signins = []
+				for position in xrange(batch_start, batch_end, size):
+					(rfid, when, reader_id) = SigninJournal.RECORD.unpack_from(journal, position)
+					students.append((rfid,))
+					signins.append((datetime.fromtimestamp(when, TZ_EST).isoformat(), index.lookup(when, groups.get(rfid, ())), rfid,))
+				with AttendanceDB.transaction(connection):
+					try:
+						cur = AttendanceDB.cursor(connection)
+						
+						cur.executemany('INSERT OR IGNORE INTO students VALUES (?,NULL,NULL,NULL,1,1)', students)
+						for (table, rows) in SemesterPartitions.by_table('signins', signins, connection):
+							cur.executemany('INSERT OR IGNORE INTO %s VALUES (?,?,?)' % table, rows)
+					
+					finally:
+						AttendanceDB.release(cur)
+					ImportCheckpoint.set(self.source_id, str(batch_end), connection)
+		finally:
+			journal.close()
+		return (end - offset) // size
+
+class SigninMerge(object):
+	
+	"""Merges the exports of several RFID readers into the signins table.
+	
+	The time-sorted reader streams are k-way merged, so only one pending row
+	per reader is held in memory. Repeat reads of a card within `window` are
+	collapsed into the first, and only the earliest tap per student per Event
+	is kept, both in memory and against rows already in the table. Ties are
+	broken by RFID and then reader number, so the result doesn't depend on
+	the order the files are given in.
+	"""
+	
+	def __init__(self, connection, window=timedelta(0, 60), batch_size=5000, index=None):
+		self.connection = connection
+		self.window = window.days * 86400 + window.seconds
+		self.batch_size = batch_size
+		self.index = index			# EventIndex; defaults to every Event in the DB
+		self.counts = {'taps' : 0, 'collapsed' : 0, 'duplicates' : 0}
+	
+	@staticmethod
+	def reader_stream(infile, reader_id):
+		"""Yield (Unix time, RFID, reader ID, ISO datetime) for each row of an export file."""
+		
+		for (when, dt, rfid) in read_rfid_timestamps(infile):
+			yield (when, rfid, reader_id, dt)
+	
+	def merge(self, streams):
+		"""Yield (datetime or ISO string, event ID, RFID) for each tap that survives de-duplication.
+		
+		@param streams: Iterables of (Unix time, RFID, reader ID, datetime or ISO string), each in time order.
+		"""
+		
+		groups = Group.select_membership_map(self.connection)
+		last_read = {}		# RFID -> Unix time of its most recent read
+		kept = {}			# Event ID -> set of RFIDs already kept for it
+		closing = []		# Heap of (closes, event ID) for forgetting finished Events
+		reads = deque()		# (Unix time, RFID) in time order, for forgetting reads older than the window
+		for (when, rfid, reader_id, dt) in heapq.merge(*streams):
+			while len(closing) > 0 and closing[0][0] < when:
+				del kept[heapq.heappop(closing)[1]]
+			while len(reads) > 0 and reads[0][0] <= when - self.window:
+				(read, old) = reads.popleft()
+				if last_read.get(old) == read:
+					del last_read[old]
+			previous = last_read.get(rfid)
+			last_read[rfid] = when
+			reads.append((when, rfid))
+			if previous is not None and when - previous < self.window:
+				self.counts['collapsed'] += 1
+				continue
+			event_id = self.index.lookup(when, groups.get(rfid, ()))
+			if event_id is not None:
+				if event_id not in kept:
+					kept[event_id] = set()
+					heapq.heappush(closing, (self.index.closes(event_id), event_id))
+				elif rfid in kept[event_id]:
+					self.counts['duplicates'] += 1
+					continue
+				kept[event_id].add(rfid)
+			yield (dt, event_id, rfid)
+	
+	def run(self, infiles):
+		"""Merge one export file per reader into the DB, in one transaction.
+		
+		@return: A dict of counts: 'taps' written, 'collapsed' repeat reads and
+		'duplicates' (later taps for an Event the student already signed in to).
+		"""
+		
+		streams = [SigninMerge.reader_stream(infile, reader_id) for (reader_id, infile) in enumerate(infiles)]
+		with AttendanceDB.transaction(self.connection):
+			self.load(streams)
+		return self.counts
+	
+	def load(self, streams):
+		"""Merge reader streams into the DB, in the caller's transaction.
+		
+		@param streams: As for merge().
+		@return: The counts, as for run().
+		"""
+		
+		if self.index is None:
+			self.index = EventIndex.select_all(self.connection)
+		self.counts = {'taps' : 0, 'collapsed' : 0, 'duplicates' : 0}
+		batch = []
+		for (dt, event_id, rfid) in self.merge(streams):
+			if not isinstance(dt, basestring):
+				dt = dt.isoformat()
+			batch.append((dt, event_id, rfid))
+			if len(batch) >= self.batch_size:
+				self.write(batch)
+				batch = []
+		self.write(batch)
+		return self.counts
+	
+	def write(self, batch):
+		"""Bulk write signins rows, keeping the earliest per (event, student).
+		
+		Each row goes to its Event's (or else its date's) Semester partition.
+		Taps are compared as instants, not as ISO strings, which sort wrongly
+		across a UTC offset change such as the fall-back hour.
+		"""
+		
+		with AttendanceDB.transaction(self.connection):
+			try:
+				cur = AttendanceDB.cursor(self.connection)
+				
+				# Check that student ID is in DB, if not, create a blank entry
+				cur.executemany('INSERT OR IGNORE INTO students VALUES (?,NULL,NULL,NULL,1,1)', [(rfid,) for (dt, event_id, rfid) in batch])
+				for (table, rows) in SemesterPartitions.by_table('signins', batch, self.connection):
+					# Moving the kept tap to excluded.dt must not collide with another row on the (dt, student) key
+					cur.executemany('''INSERT INTO %(table)s AS signins VALUES (?,?,?) 
+					ON CONFLICT(dt, student) DO NOTHING 
+					ON CONFLICT(event, student) DO UPDATE SET dt=excluded.dt 
+					WHERE julianday(excluded.dt) < julianday(signins.dt) 
+					AND NOT EXISTS (SELECT 1 FROM %(table)s WHERE dt=excluded.dt AND student=excluded.student)''' % {'table' : table}, rows)
+			
+			finally:
+				AttendanceDB.release(cur)
+		self.counts['taps'] += len(batch)
+
+def parse_backfill_file(path):
+	"""Backfill's Pool worker: parse one RFID export or roster file.
+	
+	@return: (path, kind, rows, error). Export rows are (Unix time, RFID, ISO
+	datetime) in time order; roster rows are as from Group.parse_gc_roster().
+	Errors come back as text, as RosterException doesn't survive pickling.
+	"""
+	
+	kind = Backfill.KIND_ROSTER if path.lower().endswith('.xlsx') else Backfill.KIND_RFID
+	try:
+		if kind == Backfill.KIND_ROSTER:
+			rows = list(Group.parse_gc_roster(read_xlsx_rows(path)))
+		else:
+			rows = sorted((when, rfid, dt) for (when, dt, rfid) in read_rfid_timestamps(path))
+	except Exception as e:
+		return (path, kind, None, '%s: %s' % (type(e).__name__, e))
+	return (path, kind, rows, None)
+
+class Backfill(object):
+	
+	"""Loads the archived RFID exports and rosters under a folder, parsing them in parallel.
+	
+	Files are parsed by parse_backfill_file() on a multiprocessing Pool and
+	this process is the only writer. Rosters go first, each to the Group
+	whose name (and, if the name is shared, Semester) is in its file name,
+	as datagen names them, so signins can be matched by membership. Exports
+	are parsed in order of their first tap; those whose time spans overlap
+	(one per reader over the same weeks) are k-way merged by SigninMerge and
+	loaded together as soon as the next export starts after them, so only
+	one such cluster is held in memory. A file's checkpoint (its size and
+	mtime) is saved in the transaction that loads it, so an interrupted
+	backfill picks up the files it hadn't finished, and a changed file is
+	loaded again.
+	"""
+	
+	KIND_RFID = 'rfid'
+	KIND_ROSTER = 'roster'
+	
+	# Parsed files waiting for the writer, per Pool process
+	LOOKAHEAD = 2
+	
+	# ImportCheckpoint sources are this plus the file's absolute path
+	PREFIX = 'backfill:'
+	
+	def __init__(self, connection, processes=None):
+		self.connection = connection
+		self.processes = processes		# Pool size; None for one per CPU
+	
+	@staticmethod
+	def discover(folder):
+		"""Return the .csv and .xlsx files under a folder, skipping Dropbox conflicted copies."""
+		
+		paths = []
+		for (root, dirs, files) in os.walk(folder):
+			for name in files:
+				if os.path.splitext(name)[1].lower() in ('.csv', '.xlsx') and 'conflicted copy' not in name:
+					paths.append(os.path.join(root, name))
+		return sorted(paths)
+	
+	@staticmethod
+	def position(path):
+		"""Return a file's checkpoint position, from its size and modification time."""
+		
+		stat = os.stat(path)
+		return '%d:%d' % (stat.st_size, int(stat.st_mtime))
+	
+	@staticmethod
+	def first_tap(path):
+		"""Return the Unix time of an export's first row, or None if it has none (or it can't be read).
+		
+		Readers write their exports in time order, so this orders them without parsing them.
+		"""
+		
+		try:
+			for (when, dt, rfid) in read_rfid_timestamps(path):
+				return when
+		except Exception:
+			pass	# parse_backfill_file() reports it
+		return None
+	
+	@staticmethod
+	def stream(rows, reader_id):
+		"""Yield parsed export rows as a SigninMerge reader stream."""
+		
+		for (when, rfid, dt) in rows:
+			yield (when, rfid, reader_id, dt)
+	
+	def checkpoint(self, path):
+		ImportCheckpoint.set(Backfill.PREFIX + os.path.abspath(path), Backfill.position(path), self.connection)
+	
+	def pending(self, paths):
+		"""Return the paths not loaded since they last changed."""
+		
+		return [path for path in paths if ImportCheckpoint.get(Backfill.PREFIX + os.path.abspath(path), self.connection) != Backfill.position(path)]
+	
+	def group_ids(self):
+		"""Return a dict of (Group name, Semester name) as they appear in file names -> group ID."""
+		
+		def file_name(name):
+			return re.sub(r'\W', '_', name.lower())
+		
+		try:
+			cur = AttendanceDB.cursor(self.connection)
+			
+			groups = dict(((file_name(name), file_name(semester)), group_id) for (group_id, name, semester) in cur.execute('SELECT id, name, semester FROM groups'))
+		
+		finally:
+			AttendanceDB.release(cur)
+		return groups
+	
+	@staticmethod
+	def roster_group(path, groups):
+		"""Return the ID of the Group a roster file is for, and None or why there isn't one.
+		
+		The longest Group name in the file name wins; Groups whose names look
+		the same there are told apart by their Semester's name.
+		@param groups: As from group_ids().
+		"""
+		
+		stem = re.sub(r'\W', '_', os.path.splitext(os.path.basename(path))[0].lower())
+		matches = [(name, semester, group_id) for ((name, semester), group_id) in groups.items() if name in stem]
+		if len(matches) == 0:
+			return (None, 'No Group name in the file name')
+		longest = max(len(name) for (name, semester, group_id) in matches)
+		matches = [match for match in matches if len(match[0]) == longest]
+		if len(matches) > 1:
+			matches = [match for match in matches if match[1] in stem]
+		if len(matches) != 1:
+			return (None, 'Ambiguous Group name in the file name')
+		return (matches[0][2], None)
+	
+	def parse(self, paths):
+		"""Parse files on a Pool, yielding parse_backfill_file() results in the order of paths.
+		
+		At most LOOKAHEAD parsed files per process wait for the caller, so a
+		slow writer doesn't leave the whole archive parsed in memory.
+		"""
+		
+		import multiprocessing
+		
+		processes = self.processes or multiprocessing.cpu_count()
+		pool = multiprocessing.Pool(processes)
+		try:
+			queued = deque()
+			for path in paths:
+				queued.append(pool.apply_async(parse_backfill_file, (path,)))
+				if len(queued) >= Backfill.LOOKAHEAD * processes:
+					yield queued.popleft().get()
+			while len(queued) > 0:
+				yield queued.popleft().get()
+		finally:
+			pool.close()
+			pool.join()
+	
+	def load(self, cluster):
+		"""Merge and load a cluster of overlapping (path, rows) exports in one transaction.
+		
+		@return: The number of taps written.
+		"""
+		
+		streams = [Backfill.stream(rows, reader_id) for (reader_id, (path, rows)) in enumerate(cluster)]
+		with AttendanceDB.transaction(self.connection):
+			taps = SigninMerge(self.connection).load(streams)['taps']
+			for (path, rows) in cluster:
+				self.checkpoint(path)
+		return taps
+	
+	def run(self, folder):
+		"""Backfill every new or changed file under a folder.
+		
+		@return: A dict of counts: 'files' found, 'skipped' as already loaded,
+		'rosters' and 'exports' loaded and 'taps' written, and a list of
+		(path, message) 'errors' for the files that couldn't be loaded.
+		"""
+		
+		paths = Backfill.discover(folder)
+		todo = self.pending(paths)
+		result = {'files' : len(paths), 'skipped' : len(paths) - len(todo), 'rosters' : 0, 'exports' : 0, 'taps' : 0, 'errors' : []}
+		rosters = [path for path in todo if path.lower().endswith('.xlsx')]
+		exports = [(Backfill.first_tap(path), path) for path in todo if not path.lower().endswith('.xlsx')]
+		# Unreadable exports go first, to be reported
+		exports.sort(key=lambda export: (export[0] is not None,) + export)
+		
+		groups = self.group_ids()
+		cluster = []		# Parsed exports whose time spans overlap, oldest first
+		end = None			# Unix time of the cluster's last tap
+		for (path, kind, rows, error) in self.parse(rosters + [path for (first, path) in exports]):
+			if error is not None:
+				result['errors'].append((path, error))
+			elif kind == Backfill.KIND_ROSTER:
+				(group_id, message) = Backfill.roster_group(path, groups)
+				if group_id is None:
+					result['errors'].append((path, message))
+					continue
+				with AttendanceDB.transaction(self.connection):
+					Group(group_id, None, None, None).apply_roster(rows, self.connection, archive=True)
+					self.checkpoint(path)
+				result['rosters'] += 1
+			elif len(rows) == 0:
+				self.checkpoint(path)
+			else:
+				# The cluster is closed once an export starts after it
+				if len(cluster) > 0 and rows[0][0] > end:
+					result['taps'] += self.load(cluster)
+					result['exports'] += len(cluster)
+					cluster = []
+				if len(cluster) == 0:
+					end = rows[-1][0]
+				cluster.append((path, rows))
+				end = max(end, rows[-1][0])
+		if len(cluster) > 0:
+			result['taps'] += self.load(cluster)
+			result['exports'] += len(cluster)
+		return result
+
+class GCalOutbox(object):
+	
+	"""Persistent queue of Google Calendar mutations waiting to be sent.
+	
+	Rows live in the gcal_outbox table. Queueing an insert or update for an
+	Event that already has one pending replaces the pending resource, so
+	repeated local edits turn into a single API call; deleting an Event drops
+	whatever was pending for it and, if Google has it, queues a delete.
+	"""
+	
+	OP_INSERT = 'insert'
+	OP_UPDATE = 'update'
+	OP_DELETE = 'delete'
+	
+	# Rows Google has rejected this many times are left for a human to look at
+	MAX_ATTEMPTS = 5
+	
+	@staticmethod
+	def network_errors():
+		"""Return the errors that mean "the network is down", as opposed to Google rejecting a request."""
+		
+		import httplib2
+		return (socket.error, httplib2.HttpLib2Error)
+	
+	@staticmethod
+	def enqueue(event_id, operation, calendar_id, resource, connection):
+		"""Queue a mutation, collapsing it into any insert or update already pending for the Event.
+		
+		A delete's resource is {'id' : the Event's gcal_id}; with no ID, the
+		Event never reached Google and only its pending mutations are dropped.
+		"""
+		
+		try:
+			cur = AttendanceDB.cursor(connection)
+			
+			sql = 'SELECT operation FROM gcal_outbox WHERE event=? AND operation!=?'
+			rows = list(cur.execute(sql, (event_id, GCalOutbox.OP_DELETE,)))
+			cur.execute('DELETE FROM gcal_outbox WHERE event=? AND operation!=?', (event_id, GCalOutbox.OP_DELETE,))
+			# An update to an Event that was never inserted is still an insert
+			if operation == GCalOutbox.OP_UPDATE and len(rows) == 1 and rows[0][0] == GCalOutbox.OP_INSERT:
+				operation = GCalOutbox.OP_INSERT
+			if operation != GCalOutbox.OP_DELETE or resource.get('id') is not None:
+				params = (event_id, operation, calendar_id, json.dumps(resource), datetime.now(TZ_EST).isoformat(),)
+				cur.execute('INSERT INTO gcal_outbox (event, operation, calendar, resource, queued) VALUES (?,?,?,?,?)', params)
+		
+		finally:
+			AttendanceDB.release(cur)
+	
+	@staticmethod
+	def pending(connection):
+		"""Return the number of mutations waiting to be sent."""
+		
+		try:
+			cur = AttendanceDB.cursor(connection)
+			count = list(cur.execute('SELECT COUNT(*) FROM gcal_outbox'))[0][0]
+		
+		finally:
+			AttendanceDB.release(cur)
+			return count
+	
+	@staticmethod
+	def request(gcal, operation, calendar_id, resource, gcal_id):
+		"""Build the API request for one outbox row."""
+		
+		body = json.loads(resource)
+		if operation == GCalOutbox.OP_DELETE:
+			return gcal.service.events().delete(calendarId=calendar_id, eventId=body['id'])
+		# An insert that was sent before (e.g. pushed from a stale Event) is an update by now
+		if operation == GCalOutbox.OP_UPDATE or gcal_id is not None:
+			if 'id' not in body:
+				body['id'] = gcal_id
+			return gcal.service.events().update(calendarId=calendar_id, eventId=body['id'], body=body)
+		return gcal.service.events().insert(calendarId=calendar_id, body=body)
+	
+	@staticmethod
+	def drain(gcal, connection, batch_size=50):
+		"""Send pending mutations to Google Calendar in batched HTTP requests.
+		
+		Stops at the first network failure, leaving the remaining rows queued.
+		A row that can't be sent (a malformed resource, or Google rejecting it)
+		has the attempt counted against it; any other failure of the whole
+		batch is counted against every row in it and raised.
+		@param gcal: A GCal instance.
+		@return: The number of mutations Google accepted.
+		"""
+		
+		sent = 0
+		while True:
+			try:
+				cur = AttendanceDB.cursor(connection)
+				sql = 'SELECT id, event, operation, calendar, resource FROM gcal_outbox WHERE attempts < ? ORDER BY id LIMIT ?'
+				rows = list(cur.execute(sql, (GCalOutbox.MAX_ATTEMPTS, batch_size,)))
+			finally:
+				AttendanceDB.release(cur)
+			if len(rows) == 0:
+				return sent
+			rows = [row + (GCalOutbox.gcal_id(row[1], connection),) for row in rows]
+			
+			results = {}
+			def callback(request_id, response, exception):
+				results[request_id] = (response, exception)
+			
+			batch = gcal.new_batch()
+			for (row_id, event_id, operation, calendar_id, resource, gcal_id) in rows:
+				try:
+					batch.add(GCalOutbox.request(gcal, operation, calendar_id, resource, gcal_id), callback=callback, request_id=str(row_id))
+				except Exception as e:
+					results[str(row_id)] = (None, e)
+			
+			if len(results) < len(rows):
+				try:
+					batch.execute(http=gcal.http)
+				except GCalOutbox.network_errors():
+					GCalOutbox.record_results([row for row in rows if str(row[0]) in results], results, connection)
+					return sent
+				except Exception as e:
+					for row in rows:
+						results.setdefault(str(row[0]), (None, e))
+					GCalOutbox.record_results(rows, results, connection)
+					raise
+			
+			sent += GCalOutbox.record_results(rows, results, connection)
+	
+	@staticmethod
+	def gcal_id(event_id, connection):
+		"""Return the Google Calendar ID stored for an Event, or None if it has none (or is gone)."""
+		
+		try:
+			cur = AttendanceDB.cursor(connection)
+			
+			table = SemesterPartitions.table_for('events', connection, row_id=event_id)
+			rows = list(cur.execute('SELECT gcal_id FROM %s WHERE id=?' % table, (event_id,)))
+		
+		finally:
+			AttendanceDB.release(cur)
+		if len(rows) == 0:
+			return None
+		return rows[0][0]
+	
+	@staticmethod
+	def accepted(operation, response, exception):
+		"""Return whether Google accepted a mutation, given its batch callback arguments."""
+		
+		if operation == GCalOutbox.OP_DELETE:
+			# Deletes answer with an empty body; an Event already gone needs no delete
+			return exception is None or getattr(getattr(exception, 'resp', None), 'status', None) in (404, 410)
+		return exception is None and response is not None
+	
+	@staticmethod
+	def record_results(rows, results, connection):
+		"""Delete the rows Google accepted and count failures against the rest.
+		
+		@param rows: The gcal_outbox rows sent in one batch.
+		@param results: Dict of row ID string -> (response, exception).
+		@return: The number of rows Google accepted.
+		"""
+		
+		accepted = 0
+		try:
+			cur = AttendanceDB.cursor(connection)
+			
+			for (row_id, event_id, operation, calendar_id, resource, gcal_id) in rows:
+				response, exception = results.get(str(row_id), (None, None))
+				if not GCalOutbox.accepted(operation, response, exception):
+					cur.execute('UPDATE gcal_outbox SET attempts=attempts+1, last_error=? WHERE id=?', (str(exception), row_id,))
+					continue
+				accepted += 1
+				# Deleting by row ID leaves alone anything queued while the batch was in flight
+				cur.execute('DELETE FROM gcal_outbox WHERE id=?', (row_id,))
+				if operation == GCalOutbox.OP_INSERT:
+					table = SemesterPartitions.table_for('events', connection, row_id=event_id)
+					cur.execute('UPDATE %s SET gcal_id=? WHERE id=?' % table, (response['id'], event_id,))
+					cur.execute('UPDATE gcal_outbox SET operation=? WHERE event=? AND operation=?', (GCalOutbox.OP_UPDATE, event_id, GCalOutbox.OP_INSERT,))
+		
+		finally:
+			AttendanceDB.release(cur)
+			return accepted
+
+class OutboxDrainer(threading.Thread):
+	
+	"""Background thread that drains the GCalOutbox whenever the network allows.
+	
+	The thread uses its own connection to db.disk_db, opened in run(), so
+	its writes never land in a transaction of the thread that queues
+	mutations. A network failure waits for the next interval; any other
+	failure is printed and waits too, doubling the wait each time up to
+	MAX_INTERVAL, so one bad row or API outage never stops the thread.
+	"""
+	
+	MAX_INTERVAL = 3600		# Longest wait after repeated failures, in seconds
+	
+	def __init__(self, gcal_factory, db, interval=60, batch_size=50, semester=None):
+		"""@param gcal_factory: A callable returning a GCal instance (e.g. GCal itself).
+		It is called again after a failure, since building the service
+		needs the network too.
+		@param db: The AttendanceDB whose disk file holds the outbox.
+		@param semester: The current Semester, if the DB is partitioned.
+		"""
+		
+		threading.Thread.__init__(self, name='gcal-outbox')
+		self.daemon = True
+		self.gcal_factory = gcal_factory
+		self.db = db
+		self.semester = semester
+		self.connection = None		# The thread's own, opened in run()
+		self.interval = interval
+		self.batch_size = batch_size
+		self.gcal = None
+		self.wakeup = threading.Event()
+		self.stopping = False
+		self.failures = 0		# Failures since the last clean drain
+	
+	def wake(self):
+		"""Ask the drainer to try again now instead of waiting out the interval."""
+		
+		self.wakeup.set()
+	
+	def stop(self):
+		"""Stop the drainer after its current batch."""
+		
+		self.stopping = True
+		self.wakeup.set()
+	
+	def run(self):
+		try:
+			self.drain_until_stopped()
+		finally:
+			if self.connection is not None:
+				AttendanceDB.close_thread(self.connection)
+				self.connection = None
+	
+	def drain_until_stopped(self):
+		while not self.stopping:
+			try:
+				if self.connection is None:
+					self.connection = self.db.connect_thread(self.semester)
+				if GCalOutbox.pending(self.connection) > 0:
+					if self.gcal is None:
+						self.gcal = self.gcal_factory()
+					GCalOutbox.drain(self.gcal, self.connection, self.batch_size)
+				self.failures = 0
+			except GCalOutbox.network_errors():
+				self.gcal = None
+			except Exception:
+				traceback.print_exc()
+				self.gcal = None
+				self.failures += 1
+			self.wakeup.wait(min(self.interval * 2 ** min(self.failures, 16), max(self.interval, OutboxDrainer.MAX_INTERVAL)))
+			self.wakeup.clear()
+
+# One Student's attendance over a Semester, from SemesterRollup.standing
+AttendanceRecord = namedtuple('AttendanceRecord', ['present', 'late', 'minutes_late', 'excused', 'unexcused', 'pending'])
+
+class SemesterRollup(object):
+	
+	"""Rolls a closed Semester's signins up into one event_outcomes row per (event, student).
+	
+	An outcome is OUTCOME_PRESENT or OUTCOME_LATE (with the minutes late) for a
+	Student who signed in, or the Absence type for one who didn't. Once rolled
+	up, the raw signins can be moved to a gzipped CSV archive and the file
+	VACUUMed. standing() reads event_outcomes for rolled-up Semesters and
+	computes the same rows from signins and absences for the others.
+	"""
+	
+	OUTCOME_PRESENT = 'Present'
+	OUTCOME_LATE = 'Late'
+	
+	# Outcome rows of Semester ?1: signins first, then absences without a signin
+	OUTCOMES_SQL = '''SELECT event, student, CASE WHEN minutes_late > 0 THEN ?3 ELSE ?2 END AS outcome, minutes_late 
+	FROM (SELECT signins.event AS event, signins.student AS student, 
+		MAX(0, CAST((julianday(signins.dt) - julianday(events.start)) * 1440 AS INTEGER)) AS minutes_late 
+		FROM %(signins)s AS signins JOIN %(events)s AS events ON events.id = signins.event 
+		WHERE events.semester = ?1) 
+	UNION ALL 
+	SELECT absences.event, absences.student, absences.type, NULL 
+	FROM %(absences)s AS absences JOIN %(events)s AS events ON events.id = absences.event 
+	WHERE events.semester = ?1 AND NOT EXISTS (SELECT 1 FROM %(signins)s AS signins 
+		WHERE signins.event = absences.event AND signins.student = absences.student)'''
+	
+	ROLLED_UP_SQL = '''SELECT event_outcomes.* FROM %(event_outcomes)s AS event_outcomes 
+	JOIN %(events)s AS events ON events.id = event_outcomes.event WHERE events.semester = ?1'''
+	
+	STANDING_SQL = '''SELECT student, SUM(outcome IN (?2, ?3)), SUM(outcome = ?3), CAST(TOTAL(minutes_late) AS INTEGER), 
+	SUM(outcome = ?4), SUM(outcome = ?5), SUM(outcome = ?6) 
+	FROM (%s) WHERE student IS NOT NULL%s GROUP BY student'''
+	
+	@staticmethod
+	def is_rolled_up(semester_name, connection):
+		"""Return True if a Semester's signins have been rolled up."""
+		
+		try:
+			cur = AttendanceDB.cursor(connection)
+			
+			rows = list(cur.execute('SELECT semester FROM rollups WHERE semester=?', (semester_name,)))
+		
+		finally:
+			AttendanceDB.release(cur)
+		return len(rows) == 1
+	
+	@staticmethod
+	def archive_of(semester_name, connection):
+		"""Return the archive file a rolled-up Semester's signins were moved to, or None."""
+		
+		try:
+			cur = AttendanceDB.cursor(connection)
+			
+			rows = list(cur.execute('SELECT archive FROM rollups WHERE semester=?', (semester_name,)))
+		
+		finally:
+			AttendanceDB.release(cur)
+		if len(rows) == 1:
+			return rows[0][0]
+		return None
+	
+	@staticmethod
+	def semester_tables(semester_name, connection):
+		"""Return the %-format dict of the (possibly schema-qualified) tables of a Semester."""
+		
+		names = {}
+		for table in ('events', 'signins', 'absences', 'event_outcomes'):
+			names[table] = SemesterPartitions.tables(table, connection, semester=semester_name)[0]
+		return names
+	
+	@staticmethod
+	def standing(semester_name, connection, student=None):
+		"""Return a dict of Student ID -> AttendanceRecord for a Semester.
+		
+		@param student: Only count this Student (object or ID).
+		"""
+		
+		tables = SemesterRollup.semester_tables(semester_name, connection)
+		if SemesterRollup.is_rolled_up(semester_name, connection):
+			outcomes = SemesterRollup.ROLLED_UP_SQL % tables
+		else:
+			outcomes = SemesterRollup.OUTCOMES_SQL % tables
+		params = (semester_name, SemesterRollup.OUTCOME_PRESENT, SemesterRollup.OUTCOME_LATE, 
+			Absence.TYPE_EXCUSED, Absence.TYPE_UNEXCUSED, Absence.TYPE_PENDING,)
+		if student is None:
+			sql = SemesterRollup.STANDING_SQL % (outcomes, '')
+		else:
+			sql = SemesterRollup.STANDING_SQL % (outcomes, ' AND student = ?7')
+			params = params + (getattr(student, 'rfid', student),)
+		
+		records = {}
+		try:
+			cur = AttendanceDB.cursor(connection)
+			
+			for row in cur.execute(sql, params):
+				records[row[0]] = AttendanceRecord(*row[1:])
+		
+		finally:
+			AttendanceDB.release(cur)
+		return records
+	
+	@staticmethod
+	def read_archive(path):
+		"""Yield the (dt, event, student) signins rows saved in an archive file."""
+		
+		with gzip.open(path, 'rb') as archive:
+			for row in csv.reader(archive):
+				yield (row[0], int(row[1]), int(row[2]))
+	
+	def __init__(self, semester_name, connection):
+		self.semester_name = semester_name
+		self.connection = connection
+		self.tables = SemesterRollup.semester_tables(semester_name, connection)
+	
+	def archive_path(self):
+		"""Return the archive file for this Semester's signins, next to the DB file."""
+		
+		base, extension = os.path.splitext(self.connection.filename)
+		return '%s-%s-signins.csv.gz' % (base, re.sub(r'\W', '_', self.semester_name.lower()))
+	
+	def write_archive(self, cur):
+		"""Write this Semester's signins to archive_path() + '.part' and return how many there were.
+		
+		run() renames it once the signins' deletion has committed. An existing
+		archive is never overwritten, as it may be the only copy of its signins.
+		"""
+		
+		path = self.archive_path()
+		if os.path.exists(path):
+			raise DatabaseException(self.write_archive.__name__, "Archive %s already exists." % path)
+		sql = 'SELECT signins.* FROM %(signins)s AS signins JOIN %(events)s AS events ON events.id = signins.event WHERE events.semester = ? ORDER BY signins.dt' % self.tables
+		count = 0
+		with gzip.open(path + '.part', 'wb') as archive:
+			writer = csv.writer(archive)
+			for row in cur.execute(sql, (self.semester_name,)):
+				writer.writerow(row)
+				count += 1
+		return count
+	
+	def run(self, archive=False, vacuum=True):
+		"""Roll up the Semester, optionally archiving and deleting its signins.
+		
+		@param archive: Move the raw signins to archive_path() afterwards.
+		@param vacuum: VACUUM the file holding the Semester once done.
+		@return: Tuple of (outcome rows written, signins archived).
+		"""
+		
+		semester = AcademicCalendar.for_connection(self.connection).semester_by_name(self.semester_name)
+		if semester is None:
+			raise DatabaseException(self.run.__name__, "No such semester: %s" % self.semester_name)
+		if semester.term_two.end_date >= date.today():
+			raise DatabaseException(self.run.__name__, "Semester %s has not ended yet." % self.semester_name)
+		# Its signins are gone, so rolling up again would overwrite the outcomes and the archive record
+		if SemesterRollup.archive_of(self.semester_name, self.connection) is not None:
+			raise DatabaseException(self.run.__name__, "Semester %s is already rolled up and archived." % self.semester_name)
+		
+		archived = 0
+		params = (self.semester_name, SemesterRollup.OUTCOME_PRESENT, SemesterRollup.OUTCOME_LATE,)
+		part = self.archive_path() + '.part'
+		try:
+			cur = AttendanceDB.cursor(self.connection)
+			
+			try:
+				with AttendanceDB.transaction(self.connection):
+					cur.execute('INSERT OR REPLACE INTO %s ' % self.tables['event_outcomes'] + SemesterRollup.OUTCOMES_SQL % self.tables, params)
+					outcomes = self.connection.changes()
+					AttendanceDB.bus(self.connection).touch(self.tables['event_outcomes'])
+					if archive:
+						archived = self.write_archive(cur)
+						cur.execute('DELETE FROM %(signins)s WHERE event IN (SELECT id FROM %(events)s WHERE semester=?)' % self.tables, (self.semester_name,))
+					params = (self.semester_name, datetime.now(TZ_EST).isoformat(), archived, self.archive_path() if archive else None,)
+					cur.execute('INSERT OR REPLACE INTO rollups VALUES (?,?,?,?)', params)
+			except:
+				# Rolled back, so the signins are still in the DB and a rerun writes the archive again
+				if archive and os.path.exists(part):
+					os.remove(part)
+				raise
+			if archive:
+				os.rename(part, self.archive_path())
+			if vacuum:
+				schema = 'main'
+				if '.' in self.tables['signins']:
+					schema = self.tables['signins'].split('.')[0]
+				cur.execute('VACUUM %s' % schema)
+		
+		finally:
+			AttendanceDB.release(cur)
+		return (outcomes, archived)
+
+def main(argv=None):
+	"""Command line entry point."""
+	
+	parser = argparse.ArgumentParser(description='Attendance system for the WPI Glee Club, Alden Voices and Festival Choir.')
+	parser.add_argument('--db', default=AttendanceDB.db0, help='SQLite database file')
+	parser.add_argument('--semester', help='use one database file per semester, with this one current')
+	parser.add_argument('--profile', metavar='FILE', help='print a SQL profile of the command and write its flame graph stacks to FILE')
+	commands = parser.add_subparsers(dest='command')
+	kiosk = commands.add_parser('kiosk', help='sign students in from an RFID reader, one number per line on stdin')
+	kiosk.add_argument('--journal', help='signin journal file to append every tap to first')
+	kiosk.add_argument('--reader', type=int, default=0, help='reader ID recorded in the journal')
+	replay = commands.add_parser('replay', help='load a signin journal into the database')
+	replay.add_argument('journal')
+	compact = commands.add_parser('compact', help='roll a finished semester up into per-event outcomes')
+	compact.add_argument('name', help='semester name, e.g. fall_2011')
+	compact.add_argument('--archive', action='store_true', help='move its signins to a compressed archive file')
+	backfill = commands.add_parser('backfill', help='load the archived RFID exports and rosters under a folder')
+	backfill.add_argument('folder')
+	backfill.add_argument('--processes', type=int, help='parser processes (default: one per CPU)')
+	args = parser.parse_args(argv)
+	
+	db = AttendanceDB(args.db)
+	connection = db.open_shared()
+	if db.lock is None:
+		# Every command writes, so a second instance can't run any of them
+		holder = DatabaseLock(db.disk_db + '.lock').holder() or {}
+		print 'The database is in use by %s on %s; not running %s.' % (holder.get('user'), holder.get('host'), args.command)
+		db.close_shared(connection)
+		return 1
+	try:
+		if args.semester is not None:
+			db.open_partitioned(args.semester, connection)
+		else:
+			db.create_tables(connection)
+		for path in db.find_conflicted_copies():
+			print 'Merging', path
+			for (table, (added, conflicts)) in sorted(db.merge_conflicted_copy(path, connection).items()):
+				if added > 0 or len(conflicts) > 0:
+					print '  %s: %d rows added, %d conflicting rows kept as they were' % (table, added, len(conflicts))
+		
+		if args.profile is not None:
+			profiler = QueryProfiler(connection)
+			profiler.install()
+		if args.command == 'kiosk':
+			journal = None
+			if args.journal is not None:
+				journal = SigninJournal(args.journal)
+			Kiosk(db, connection, journal=journal, reader_id=args.reader).run(sys.stdin, sys.stdout)
+		elif args.command == 'replay':
+			print 'Replayed %d taps' % SigninJournal(args.journal).replay(connection)
+		elif args.command == 'compact':
+			(outcomes, archived) = SemesterRollup(args.name, connection).run(archive=args.archive)
+			print 'Rolled up %d outcomes, archived %d signins' % (outcomes, archived)
+		elif args.command == 'backfill':
+			result = Backfill(connection, args.processes).run(args.folder)
+			print 'Loaded %d rosters and %d RFID exports (%d signins); %d of %d files were already loaded' % (
+				result['rosters'], result['exports'], result['taps'], result['skipped'], result['files'])
+			for (path, error) in result['errors']:
+				print '  %s: %s' % (path, error)
+		if args.profile is not None:
+			profiler.uninstall()
+			print >> sys.stderr, profiler.report()
+			with open(args.profile, 'w') as f:
+				f.write(profiler.folded() + '\n')
+	finally:
+		db.close_shared(connection)
+
+if __name__ == '__main__':
+	main()
@@ -1,8 +1,20 @@
 import os
+import sys
+import subprocess
 import unittest
+import socket
+import time as _time
+import tempfile
+import random
+import shutil
+import json
+import zipfile
 from datetime import *
+import base64
 import apsw
 from gc_attendance import *
+import datagen
+import benchmarks
 
 class AttendanceTestCase(unittest.TestCase):
 	def setUp(self):
@@ -100,5 +112,1572 @@ class AttendanceTestCase(unittest.TestCase):
 		del self.db
 		#os.remove(os.path.join(os.getcwd(), 'dbtests.sqlite'))
 
+class FakeCalendar(object):
+	
+	"""Stands in for GCal: answers each batched request through respond(operation, kwargs)."""
+	
+	def __init__(self, respond):
+		self.respond = respond		# Returns (response, exception), or raises to fail the whole batch
+		self.http = None
+		self.service = self
+		self.sent = []				# (operation, kwargs) of every request answered
+	
+	def events(self):
+		return self
+	
+	def insert(self, **kwargs):
+		return ('insert', kwargs)
+	
+	def update(self, **kwargs):
+		return ('update', kwargs)
+	
+	def delete(self, **kwargs):
+		return ('delete', kwargs)
+	
+	def new_batch(self):
+		return FakeBatch(self)
+
+class FakeBatch(object):
+	def __init__(self, calendar):
+		self.calendar = calendar
+		self.requests = []
+	
+	def add(self, request, callback, request_id):
+		self.requests.append((request, callback, request_id))
+	
+	def execute(self, http=None):
+		answers = [self.calendar.respond(*request) for (request, callback, request_id) in self.requests]
+		for ((request, callback, request_id), (response, exception)) in zip(self.requests, answers):
+			self.calendar.sent.append(request)
+			callback(request_id, response, exception)
+
+class OutboxTestCase(unittest.TestCase):
+	def setUp(self):
+		unittest.TestCase.setUp(self)
+		self.folder = tempfile.mkdtemp()
+		self.db = AttendanceDB(os.path.join(self.folder, 'gc-attendance.sqlite'))
+		self.connection = self.db.connect(self.db.disk_db)
+		self.db.create_tables(self.connection)
+		cur = self.connection.cursor()
+		cur.execute("INSERT INTO events (id, eventname, start, end) VALUES (1, 'Rehearsal', '2011-09-06T18:30:00-04:00', '2011-09-06T20:30:00-04:00')")
+		cur.close()
+	
+	def test_coalesce(self):
+		''' Repeated pushes for one Event collapse into one pending insert. '''
+		GCalOutbox.enqueue(1, GCalOutbox.OP_INSERT, 'wpigleeclub@gmail.com', {'summary' : 'Rehearsal'}, self.connection)
+		GCalOutbox.enqueue(1, GCalOutbox.OP_UPDATE, 'wpigleeclub@gmail.com', {'summary' : 'Sectionals'}, self.connection)
+		assert GCalOutbox.pending(self.connection) == 1
+		cur = self.connection.cursor()
+		rows = list(cur.execute('SELECT id, event, operation, calendar, resource, NULL FROM gcal_outbox'))
+		cur.close()
+		assert rows[0][2] == GCalOutbox.OP_INSERT
+		assert json.loads(rows[0][4])['summary'] == 'Sectionals'
+		
+		accepted = GCalOutbox.record_results(rows, {str(rows[0][0]) : ({'id' : 'abc123'}, None)}, self.connection)
+		assert accepted == 1
+		assert GCalOutbox.pending(self.connection) == 0
+		cur = self.connection.cursor()
+		assert list(cur.execute('SELECT gcal_id FROM events WHERE id=1'))[0][0] == 'abc123'
+		cur.close()
+	
+	def row(self, event_id):
+		cur = self.connection.cursor()
+		rows = list(cur.execute('SELECT operation, calendar, resource, attempts, last_error FROM gcal_outbox WHERE event=?', (event_id,)))
+		cur.close()
+		return rows
+	
+	def test_drain(self):
+		''' Sent rows go once the network is back; a poison row uses up its attempts; deletes are sent. '''
+		cur = self.connection.cursor()
+		cur.execute("INSERT INTO events (id, eventname, start, end) VALUES (2, 'Sectionals', '2011-09-07T18:30:00-04:00', '2011-09-07T20:30:00-04:00')")
+		cur.close()
+		GCalOutbox.enqueue(1, GCalOutbox.OP_INSERT, 'wpigleeclub@gmail.com', {'summary' : 'Rehearsal'}, self.connection)
+		GCalOutbox.enqueue(2, GCalOutbox.OP_INSERT, 'wpigleeclub@gmail.com', {'summary' : 'Sectionals'}, self.connection)
+		cur = self.connection.cursor()
+		cur.execute("UPDATE gcal_outbox SET resource='{' WHERE event=2")
+		cur.close()
+		
+		def offline(operation, kwargs):
+			raise socket.error('Network is unreachable')
+		assert GCalOutbox.drain(FakeCalendar(offline), self.connection) == 0
+		assert self.row(1)[0][3] == 0
+		
+		def online(operation, kwargs):
+			if operation == 'insert':
+				return ({'id' : kwargs['body']['summary'].lower()}, None)
+			return ('', None)
+		calendar = FakeCalendar(online)
+		assert GCalOutbox.drain(calendar, self.connection) == 1
+		assert calendar.sent == [('insert', {'calendarId' : 'wpigleeclub@gmail.com', 'body' : {'summary' : 'Rehearsal'}})]
+		assert self.row(1) == []
+		(operation, calendar_id, resource, attempts, last_error) = self.row(2)[0]
+		assert attempts == GCalOutbox.MAX_ATTEMPTS and last_error is not None
+		cur = self.connection.cursor()
+		assert list(cur.execute('SELECT gcal_id FROM events WHERE id=1'))[0][0] == 'rehearsal'
+		cur.close()
+		
+		GCalOutbox.enqueue(1, GCalOutbox.OP_DELETE, 'wpigleeclub@gmail.com', {'id' : 'rehearsal'}, self.connection)
+		calendar = FakeCalendar(online)
+		assert GCalOutbox.drain(calendar, self.connection) == 1
+		assert calendar.sent == [('delete', {'calendarId' : 'wpigleeclub@gmail.com', 'eventId' : 'rehearsal'})]
+		assert GCalOutbox.pending(self.connection) == 1
+	
+	def test_drainer(self):
+		''' Errors other than the network's are counted against the rows and don't stop the thread. '''
+		GCalOutbox.enqueue(1, GCalOutbox.OP_INSERT, 'wpigleeclub@gmail.com', {'summary' : 'Rehearsal'}, self.connection)
+		def broken(operation, kwargs):
+			raise RuntimeError('500 Backend Error')
+		drainer = OutboxDrainer(lambda: FakeCalendar(broken), self.db, interval=0.01)
+		drainer.start()
+		deadline = _time.time() + 5
+		while self.row(1)[0][3] < 2 and _time.time() < deadline:
+			_time.sleep(0.01)
+		assert drainer.is_alive()
+		drainer.stop()
+		drainer.join()
+		assert self.row(1)[0][3] >= 2 and 'Backend Error' in self.row(1)[0][4]
+	
+	def test_event_writes(self):
+		''' Inserting, updating and deleting an Event queue the matching mutations. '''
+		cur = self.connection.cursor()
+		cur.execute("INSERT INTO organizations VALUES ('Glee Club', 'wpigleeclub@gmail.com')")
+		cur.execute("INSERT INTO terms VALUES ('A11', '2011-08-25', '2011-10-13')")
+		cur.execute("INSERT INTO terms VALUES ('B11', '2011-10-25', '2011-12-15')")
+		cur.execute("INSERT INTO semesters VALUES ('fall_2011', 'A11', 'B11')")
+		cur.execute("INSERT INTO groups VALUES (1, 'Glee Club', 'fall_2011', 'Glee Club Fall 2011', NULL)")
+		cur.close()
+		semester = Semester('fall_2011', Term('A11', date(2011, 8, 25), date(2011, 10, 13)), Term('B11', date(2011, 10, 25), date(2011, 12, 15)))
+		group = Group(1, Organization('Glee Club', 'wpigleeclub@gmail.com'), semester, 'Glee Club Fall 2011')
+		start = datetime(2011, 9, 13, 18, 30, tzinfo=TZ_EST)
+		
+		event = Event(None, 'Sectionals', None, 'Alden', start, start + timedelta(0, 7200), Event.TYPE_REHEARSAL, group, semester, None)
+		event.insert(self.connection)
+		event.event_name = 'Full rehearsal'
+		event.update(self.connection)
+		rows = self.row(event.id)
+		assert [(operation, calendar_id) for (operation, calendar_id, resource, attempts, last_error) in rows] == [(GCalOutbox.OP_INSERT, 'wpigleeclub@gmail.com')]
+		assert json.loads(rows[0][2])['summary'] == 'Full rehearsal'
+		event.delete(self.connection)
+		assert self.row(event.id) == []
+		
+		event = Event(None, 'Concert', None, 'Alden', start, start + timedelta(0, 7200), Event.TYPE_CONCERT, group, semester, None)
+		event.insert(self.connection)
+		assert GCalOutbox.drain(FakeCalendar(lambda operation, kwargs: ({'id' : 'concert'}, None)), self.connection) == 1
+		event.delete(self.connection)	# event.gcal_id is stale, but delete reads it back
+		assert [(operation, json.loads(resource)) for (operation, calendar_id, resource, attempts, last_error) in self.row(event.id)] == [
+			(GCalOutbox.OP_DELETE, {'id' : 'concert'})]
+	
+	def test_blank_members(self):
+		''' Members made from unknown cards are left off the attendees, and a payload failure doesn't undo the Event write. '''
+		cur = self.connection.cursor()
+		cur.execute("INSERT INTO organizations VALUES ('Glee Club', 'wpigleeclub@gmail.com')")
+		cur.execute("INSERT INTO terms VALUES ('A11', '2011-08-25', '2011-10-13')")
+		cur.execute("INSERT INTO terms VALUES ('B11', '2011-10-25', '2011-12-15')")
+		cur.execute("INSERT INTO semesters VALUES ('fall_2011', 'A11', 'B11')")
+		cur.execute("INSERT INTO groups VALUES (1, 'Glee Club', 'fall_2011', 'Glee Club Fall 2011', NULL)")
+		cur.execute("INSERT INTO students VALUES (10000, 'Joe', 'Baker', 'jbaker@wpi.edu', 1, 1)")
+		cur.execute("INSERT INTO students VALUES (10001, NULL, 'Smith', 'smith@wpi.edu', 1, 1)")
+		cur.execute('INSERT INTO students VALUES (10002, NULL, NULL, NULL, 1, 1)')
+		cur.executemany('INSERT INTO group_memberships (student, group_id, credit) VALUES (?, 1, 1)', [(10000,), (10001,), (10002,)])
+		cur.close()
+		semester = Semester('fall_2011', Term('A11', date(2011, 8, 25), date(2011, 10, 13)), Term('B11', date(2011, 10, 25), date(2011, 12, 15)))
+		group = Group(1, Organization('Glee Club', 'wpigleeclub@gmail.com'), semester, 'Glee Club Fall 2011')
+		start = datetime(2011, 9, 13, 18, 30, tzinfo=TZ_EST)
+		
+		event = Event(None, 'Rehearsal', None, 'Alden', start, start + timedelta(0, 7200), Event.TYPE_REHEARSAL, group, semester, None)
+		event.insert(self.connection)
+		attendees = json.loads(self.row(event.id)[0][2])['attendees']
+		assert sorted((a['email'], a.get('displayName')) for a in attendees) == [('jbaker@wpi.edu', 'Baker, Joe'), ('smith@wpi.edu', 'Smith')]
+		
+		def broken(self, connection):
+			raise TypeError('broken payload')
+		make_json = Event.make_json
+		Event.make_json = broken
+		try:
+			event.event_name = 'Sectionals'
+			event.update(self.connection)
+		finally:
+			Event.make_json = make_json
+		assert Event.select_by_id(event.id, self.connection).event_name == 'Sectionals'
+	
+	def tearDown(self):
+		unittest.TestCase.tearDown(self)
+		self.connection.close()
+		del self.db
+		shutil.rmtree(self.folder)
+
+class FakeGmail(object):
+	''' Just enough of a Gmail service for GmailSource: pages of (history ID, message IDs) records, and a mailbox. '''
+	def __init__(self, pages, mailbox=(), history_id='1000'):
+		self.pages = pages
+		self.mailbox = list(mailbox)	# (message ID, history ID, text), newest first
+		self.history_id = history_id
+		self.response = None
+	
+	def users(self):
+		return self
+	
+	def history(self):
+		return self
+	
+	def messages(self):
+		return self
+	
+	def getProfile(self, userId):
+		self.response = {'historyId' : self.history_id}
+		return self
+	
+	def list(self, userId, startHistoryId=None, q=None, pageToken=None):
+		if startHistoryId is None:
+			self.response = {'messages' : [{'id' : message[0]} for message in self.mailbox]}
+			return self
+		page = int(pageToken or 0)
+		self.response = {'history' : [{'id' : history_id, 'messagesAdded' : [{'message' : {'id' : message_id}} for message_id in ids]} 
+			for (history_id, ids) in self.pages[page]]}
+		if page + 1 < len(self.pages):
+			self.response['nextPageToken'] = str(page + 1)
+		return self
+	
+	def get(self, userId, id, format):
+		message = [message for message in self.mailbox if message[0] == id][0]
+		self.response = {'raw' : base64.urlsafe_b64encode(message[2]), 'historyId' : message[1]}
+		return self
+	
+	def execute(self):
+		return self.response
+
+class ExcuseImportTestCase(unittest.TestCase):
+	def setUp(self):
+		unittest.TestCase.setUp(self)
+		self.db = AttendanceDB(':memory:')
+		self.db.create_tables(self.db.memory)
+		(fd, self.mbox) = tempfile.mkstemp(suffix='.mbox')
+		os.close(fd)
+		cur = self.db.memory.cursor()
+		cur.executemany('INSERT INTO students VALUES (?,?,?,?,1,1)', [(10000 + i, 'First', 'Last', 'student%d@wpi.edu' % i) for i in range(100)])
+		cur.close()
+	
+	def write_messages(self, first, count):
+		with open(self.mbox, 'ab') as f:
+			for i in range(first, first + count):
+				f.write('From student%d@wpi.edu Tue Sep 13 11:37:00 2011\n' % (i % 120))
+				f.write('From: Student <student%d@wpi.edu>\n' % (i % 120))
+				f.write('To: gc-excuse@wpi.edu\n')
+				f.write('Date: Tue, 13 Sep 2011 11:37:%02d -0400\n' % (i % 60))
+				f.write('Subject: Missing rehearsal %d\n\n' % i)
+				f.write('oh god rbe ahhhh\n\n')
+	
+	def test_mbox_import(self):
+		''' Import 10k messages, then only the new ones on the next run. '''
+		self.write_messages(0, 10000)
+		importer = ExcuseImporter(self.db.memory, 'gc-excuse')
+		result = importer.run(MboxSource(self.mbox))
+		assert result['messages'] == 10000
+		# Senders 100-119 are not on the roster
+		assert result['imported'] == len([i for i in range(10000) if i % 120 < 100])
+		assert result['pending'] == 10000 - result['imported']
+		assert len(result['unknown']) == 20
+		
+		self.write_messages(10000, 5)
+		result = importer.run(MboxSource(self.mbox))
+		assert result['messages'] == 5
+		
+		result = importer.run(MboxSource(self.mbox))
+		assert result['messages'] == 0
+	
+	def test_search(self):
+		''' Excuse text is searchable as soon as it is written, and filters apply. '''
+		cur = self.db.memory.cursor()
+		cur.execute("INSERT INTO terms VALUES ('A11', '2011-08-25', '2011-10-13')")
+		cur.execute("INSERT INTO terms VALUES ('B11', '2011-10-25', '2011-12-15')")
+		cur.execute("INSERT INTO semesters VALUES ('fall_2011', 'A11', 'B11')")
+		cur.execute("INSERT INTO excuses VALUES (NULL, '2011-09-13T11:37:00-04:00', NULL, 'oh god rbe ahhhh', 10000)")
+		cur.execute("INSERT INTO excuses VALUES (NULL, '2011-09-20T09:00:00-04:00', NULL, 'sick', 10001)")
+		cur.execute("INSERT INTO excuses VALUES (NULL, '2012-02-07T09:00:00-05:00', NULL, 'another rbe', 10001)")
+		cur.close()
+		assert len(Excuse.search('rbe', self.db.memory)) == 2
+		matches = Excuse.search('rbe', self.db.memory, semester='fall_2011')
+		assert len(matches) == 1
+		assert matches[0].student == 10000
+		assert '[rbe]' in matches[0].snippet
+		assert len(Excuse.search('rbe', self.db.memory, student=10001)) == 1
+		
+		cur = self.db.memory.cursor()
+		cur.execute("UPDATE excuses SET reason='exam' WHERE student=10000")
+		cur.close()
+		assert len(Excuse.search('rbe', self.db.memory, semester='fall_2011')) == 0
+		assert len(Excuse.search('exam', self.db.memory)) == 1
+	
+	def test_unknown_sender(self):
+		''' Mail from an unknown sender waits, and is imported once the sender is a Student. '''
+		self.write_messages(100, 3)
+		importer = ExcuseImporter(self.db.memory, 'gc-excuse')
+		result = importer.run(MboxSource(self.mbox))
+		assert (result['imported'], result['pending'], result['unknown']) == (0, 3, set(['student100@wpi.edu', 'student101@wpi.edu', 'student102@wpi.edu']))
+		
+		cur = self.db.memory.cursor()
+		cur.execute("INSERT INTO students VALUES (10100, 'First', 'Last', 'student100@wpi.edu', 1, 1)")
+		cur.close()
+		result = importer.run(MboxSource(self.mbox))
+		assert (result['messages'], result['imported'], result['pending']) == (0, 1, 2)
+		assert [(match.student, match.dt) for match in Excuse.search('rehearsal', self.db.memory)] == [(10100, '2011-09-13T11:37:40-04:00')]
+		assert importer.run(MboxSource(self.mbox))['imported'] == 0
+	
+	def test_gmail_ids(self):
+		''' A message listed by several history records, across pages, is read once. '''
+		source = GmailSource(FakeGmail([[('1240', ['a', 'b']), ('1241', ['b'])], [('1250', ['c', 'a']), ('1245', ['d'])]]))
+		assert source.message_ids('1234') == (['a', 'b', 'c', 'd'], '1250')
+	
+	def test_gmail_checkpoint(self):
+		''' The checkpoint is the mailbox's history ID from before a full listing, then the largest one seen. '''
+		text = 'From: Student <student%d@wpi.edu>\nTo: gc-excuse@wpi.edu\nDate: Tue, 13 Sep 2011 11:37:00 -0400\nSubject: Missing rehearsal\n\noh god rbe ahhhh\n'
+		mailbox = [('m2', '900', text % 2), ('m1', '300', text % 1)]
+		service = FakeGmail([], mailbox, history_id='500')
+		source = GmailSource(service)
+		importer = ExcuseImporter(self.db.memory, 'gc-excuse', batch_size=1)
+		assert importer.run(source)['imported'] == 2
+		assert ImportCheckpoint.get(source.source_id, self.db.memory) == '500'
+		
+		service.mailbox.insert(0, ('m3', '520', text % 3))
+		service.pages = [[('9999', []), ('510', ['m3'])]]
+		assert importer.run(source)['imported'] == 1
+		assert ImportCheckpoint.get(source.source_id, self.db.memory) == '9999'
+	
+	def tearDown(self):
+		unittest.TestCase.tearDown(self)
+		del self.db
+		os.remove(self.mbox)
+
+class CalendarTestCase(unittest.TestCase):
+	def setUp(self):
+		unittest.TestCase.setUp(self)
+		self.db = AttendanceDB(':memory:')
+		self.db.create_tables(self.db.memory)
+		self.a_term = Term('A11', date(2011, 8, 25), date(2011, 10, 13))
+		self.b_term = Term('B11', date(2011, 10, 25), date(2011, 12, 15))
+		self.fall_semester = Semester('fall_2011', self.a_term, self.b_term)
+		self.a_term.insert(self.db.memory)
+		self.b_term.insert(self.db.memory)
+		self.fall_semester.insert(self.db.memory)
+		AcademicCalendar.insert_day_off(date(2011, 9, 5), self.db.memory)
+	
+	def test_classify(self):
+		''' Dates resolve to their Term and Semester, and writes refresh the calendar. '''
+		calendar = AcademicCalendar.for_connection(self.db.memory)
+		term, semester, day_off = calendar.classify(date(2011, 9, 5))
+		assert term.name == 'A11'
+		assert semester.name == 'fall_2011'
+		assert day_off
+		# Break between terms is still in the semester
+		term, semester, day_off = calendar.classify(datetime(2011, 10, 18, 18, 30, tzinfo=TZ_EST))
+		assert term is None
+		assert semester.name == 'fall_2011'
+		assert not day_off
+		assert calendar.semester_for(date(2012, 1, 10)) is None
+		
+		AcademicCalendar.insert_day_off(date(2011, 11, 24), self.db.memory)
+		calendar = AcademicCalendar.for_connection(self.db.memory)
+		assert calendar.is_day_off(date(2011, 11, 24))
+		assert self.b_term.fetch_days_off(self.db.memory) == [date(2011, 11, 24)]
+		assert self.fall_semester.fetch_days_off(self.db.memory) == [date(2011, 9, 5), date(2011, 11, 24)]
+		
+		Term('C12', date(2012, 1, 12), date(2012, 3, 2)).insert(self.db.memory)
+		assert AcademicCalendar.for_connection(self.db.memory).term_for(date(2012, 2, 1)).name == 'C12'
+	
+	def test_recurrence(self):
+		''' A weekly rule fills the semester once and only touches moved dates afterwards. '''
+		cur = self.db.memory.cursor()
+		cur.execute("INSERT INTO organizations VALUES ('Glee Club', 'wpigleeclub@gmail.com')")
+		cur.execute("INSERT INTO groups VALUES (1, 'Glee Club', 'fall_2011', 'Glee Club Fall 2011', NULL)")
+		cur.close()
+		tuesdays = WeeklyRule(1, time(18, 30), time(20, 30), 1, location='Alden Hall')
+		result = tuesdays.generate(self.fall_semester, self.db.memory)
+		# 7 Tuesdays in A11, 8 in B11, none in the break
+		assert result['inserted'] == 15
+		assert tuesdays.generate(self.fall_semester, self.db.memory)['unchanged'] == 15
+		
+		AcademicCalendar.insert_day_off(date(2011, 11, 22), self.db.memory)
+		result = tuesdays.generate(self.fall_semester, self.db.memory)
+		assert result['deleted'] == 1
+		assert result['unchanged'] == 14
+		
+		self.b_term.end_date = date(2011, 12, 22)
+		self.b_term.update(self.db.memory)
+		result = tuesdays.generate(self.fall_semester, self.db.memory)
+		assert result['inserted'] == 1
+		assert result['unchanged'] == 14
+		cur = self.db.memory.cursor()
+		assert list(cur.execute("SELECT COUNT(*) FROM events WHERE start LIKE '2011-11-22%'"))[0][0] == 0
+		cur.close()
+	
+	def test_recurrence_outbox(self):
+		''' A weekly rule queues its inserts, moves and deletes for the Google calendar. '''
+		cur = self.db.memory.cursor()
+		cur.execute("INSERT INTO organizations VALUES ('Glee Club', 'wpigleeclub@gmail.com')")
+		cur.execute("INSERT INTO groups VALUES (1, 'Glee Club', 'fall_2011', 'Glee Club Fall 2011', NULL)")
+		tuesdays = WeeklyRule(1, time(18, 30), time(20, 30), 1)
+		tuesdays.generate(self.fall_semester, self.db.memory)
+		assert list(cur.execute('SELECT DISTINCT operation, calendar FROM gcal_outbox')) == [(GCalOutbox.OP_INSERT, 'wpigleeclub@gmail.com')]
+		assert GCalOutbox.pending(self.db.memory) == 15
+		# As if the outbox had been drained
+		cur.execute("UPDATE events SET gcal_id='g' || id")
+		cur.execute('DELETE FROM gcal_outbox')
+		
+		# The semester object is stale after this; generate() reads the new end date
+		Term('B11', self.b_term.start_date, date(2011, 12, 22)).update(self.db.memory)
+		AcademicCalendar.insert_day_off(date(2011, 11, 22), self.db.memory)
+		assert tuesdays.generate(self.fall_semester, self.db.memory)['moved'] == 1
+		moved = list(cur.execute("SELECT id, gcal_id FROM events WHERE start LIKE '2011-12-20%'"))[0]
+		rows = list(cur.execute('SELECT event, operation, resource FROM gcal_outbox'))
+		assert [(event_id, operation) for (event_id, operation, resource) in rows] == [(moved[0], GCalOutbox.OP_UPDATE)]
+		assert json.loads(rows[0][2])['id'] == moved[1]
+		cur.execute('DELETE FROM gcal_outbox')
+		
+		AcademicCalendar.insert_day_off(date(2011, 12, 20), self.db.memory)
+		assert tuesdays.generate(self.fall_semester, self.db.memory)['deleted'] == 1
+		assert list(cur.execute('SELECT event, operation, resource FROM gcal_outbox')) == [(moved[0], GCalOutbox.OP_DELETE, json.dumps({'id' : moved[1]}))]
+		cur.close()
+	
+	def test_recurrence_records(self):
+		''' Surplus Events with excuses or absences are kept, and an unknown Semester is an error. '''
+		cur = self.db.memory.cursor()
+		cur.execute("INSERT INTO organizations VALUES ('Glee Club', 'wpigleeclub@gmail.com')")
+		cur.execute("INSERT INTO groups VALUES (1, 'Glee Club', 'fall_2011', 'Glee Club Fall 2011', NULL)")
+		cur.executemany('INSERT INTO students VALUES (?,?,?,?,1,1)', [(10000 + i, 'First', 'Last', 'student%d@wpi.edu' % i) for i in range(2)])
+		tuesdays = WeeklyRule(1, time(18, 30), time(20, 30), 1)
+		tuesdays.generate(self.fall_semester, self.db.memory)
+		excused = list(cur.execute("SELECT id FROM events WHERE start LIKE '2011-11-22%'"))[0][0]
+		absent = list(cur.execute("SELECT id FROM events WHERE start LIKE '2011-11-29%'"))[0][0]
+		cur.execute("INSERT INTO excuses (dt, event, reason, student) VALUES ('2011-11-22T12:00:00-05:00', ?, 'RBE exam', 10000)", (excused,))
+		cur.execute('INSERT INTO absences VALUES (10001, ?, ?, NULL)', (Absence.TYPE_UNEXCUSED, absent,))
+		cur.close()
+		AcademicCalendar.insert_day_off(date(2011, 11, 22), self.db.memory)
+		AcademicCalendar.insert_day_off(date(2011, 11, 29), self.db.memory)
+		result = tuesdays.generate(self.fall_semester, self.db.memory)
+		assert (result['kept'], result['deleted']) == (2, 0)
+		
+		self.assertRaises(DatabaseException, tuesdays.generate, Semester('spring_2099', self.a_term, self.b_term), self.db.memory)
+	
+	def tearDown(self):
+		unittest.TestCase.tearDown(self)
+		del self.db
+
+class KioskTestCase(unittest.TestCase):
+	def setUp(self):
+		unittest.TestCase.setUp(self)
+		self.folder = tempfile.mkdtemp()
+		self.db = AttendanceDB(os.path.join(self.folder, 'gc-attendance.sqlite'))
+		self.connection = self.db.connect(self.db.disk_db)
+		self.db.create_tables(self.connection)
+		self.start = datetime(2011, 9, 6, 18, 30, tzinfo=TZ_EST)
+		cur = self.connection.cursor()
+		cur.executemany('INSERT INTO students VALUES (?,?,?,?,1,1)', [(10000 + i, 'First', 'Last', 'student%d@wpi.edu' % i) for i in range(150)])
+		cur.execute('INSERT INTO events (id, eventname, start, end) VALUES (1, ?, ?, ?)', ('Rehearsal', self.start.isoformat(), (self.start + timedelta(0, 7200)).isoformat()))
+		cur.close()
+	
+	def test_journal_replay(self):
+		''' Journaled taps load once, and a torn record at the end waits for the next replay. '''
+		(fd, path) = tempfile.mkstemp(suffix='.journal')
+		os.close(fd)
+		journal = SigninJournal(path)
+		journal.open()
+		for i in range(150):
+			journal.append(10000 + i, self.start + timedelta(0, -300 + i * 4), 1)
+		journal.append(10000, self.start + timedelta(0, 600), 2)	# Second tap, same Event
+		journal.close()
+		try:
+			assert journal.replay(self.connection) == 151
+			assert journal.replay(self.connection) == 0
+			with open(path, 'ab') as f:
+				f.write(SigninJournal.RECORD.pack(10001, epoch(self.start), 1)[:7])
+			assert journal.replay(self.connection) == 0
+			cur = self.connection.cursor()
+			assert list(cur.execute('SELECT COUNT(*) FROM signins WHERE event=1'))[0][0] == 150
+			assert list(cur.execute('SELECT dt FROM signins WHERE event=1 AND student=10000'))[0][0] == (self.start - timedelta(0, 300)).isoformat()
+			cur.close()
+		finally:
+			os.remove(path)
+	
+	def test_reader_merge(self):
+		''' Two readers' exports merge into one earliest signin per student. '''
+		folder = tempfile.mkdtemp()
+		paths = [os.path.join(folder, 'reader0.csv'), os.path.join(folder, 'reader1.csv')]
+		with open(paths[0], 'wb') as f:
+			f.write(',9/6/2011,18:27,10000\n,9/6/2011,18:27,10000\n,9/6/2011,18:29,10001\n,9/6/2011,18:40,10002\n')
+		with open(paths[1], 'wb') as f:
+			f.write(',9/6/2011,18:26,10001\n,9/6/2011,18:31,10000\n,9/6/2011,18:33,99999\n')
+		try:
+			counts = SigninMerge(self.connection).run(paths)
+			assert counts == {'taps' : 4, 'collapsed' : 1, 'duplicates' : 2}
+			# Running the same files again changes nothing
+			SigninMerge(self.connection).run(list(reversed(paths)))
+			cur = self.connection.cursor()
+			rows = list(cur.execute('SELECT student, dt FROM signins WHERE event=1 ORDER BY student'))
+			cur.close()
+			assert [r[0] for r in rows] == [10000, 10001, 10002, 99999]
+			assert rows[0][1] == datetime(2011, 9, 6, 18, 27, tzinfo=TZ_EST).isoformat()
+			assert rows[1][1] == datetime(2011, 9, 6, 18, 26, tzinfo=TZ_EST).isoformat()
+		finally:
+			shutil.rmtree(folder)
+	
+	def test_merge_fall_back(self):
+		''' In the repeated hour of a DST change the earlier instant is kept, not the smaller string. '''
+		merge = SigninMerge(self.connection)
+		merge.write([('2011-11-06T01:45:00-04:00', 1, 10000), ('2011-11-06T01:50:00-05:00', 1, 10001)])
+		merge.write([('2011-11-06T01:15:00-05:00', 1, 10000), ('2011-11-06T01:10:00-05:00', 1, 10001)])
+		cur = self.connection.cursor()
+		rows = list(cur.execute('SELECT student, dt FROM signins WHERE event=1 ORDER BY student'))
+		cur.close()
+		assert rows == [(10000, '2011-11-06T01:45:00-04:00'), (10001, '2011-11-06T01:10:00-05:00')]
+	
+	def test_rehearsal_burst(self):
+		''' 150 taps between 18:25 and 18:35. '''
+		kiosk = Kiosk(self.db, self.connection, clock=lambda: self.start)
+		kiosk.start()
+		for i in range(150):
+			result = kiosk.tap(10000 + i, self.start + timedelta(0, -300 + i * 4))
+			assert result.status == 'ok'
+			assert result.event == 1
+		assert kiosk.tap(10000, self.start).status == 'duplicate'
+		assert kiosk.tap(99999, self.start).status == 'unknown'
+		kiosk.close()
+		
+		cur = self.connection.cursor()
+		assert list(cur.execute('SELECT COUNT(*) FROM signins WHERE event=1'))[0][0] == 151
+		assert list(cur.execute('SELECT COUNT(*) FROM students WHERE id=99999'))[0][0] == 1
+		cur.close()
+	
+	def test_writer_retry(self):
+		''' A batch that fails to commit is retried; one that keeps failing is reported by stop(). '''
+		writer = SigninWriter(self.db, flush_interval=0.01)
+		write = writer.write
+		failures = [2]
+		def flaky(batch):
+			if failures[0] > 0:
+				failures[0] -= 1
+				raise apsw.BusyError('database is locked')
+			write(batch)
+		writer.write = flaky
+		writer.start()
+		writer.put((self.start.isoformat(), 1, 10000))
+		writer.stop()
+		assert failures == [0] and writer.error is None and writer.unwritten == []
+		cur = self.connection.cursor()
+		assert list(cur.execute('SELECT COUNT(*) FROM signins WHERE event=1'))[0][0] == 1
+		cur.close()
+		
+		writer = SigninWriter(self.db, flush_interval=0.01)
+		def locked(batch):
+			raise apsw.BusyError('database is locked')
+		writer.write = locked
+		writer.start()
+		writer.put(((self.start + timedelta(0, 60)).isoformat(), 1, 10001))
+		self.assertRaises(DatabaseException, writer.stop)
+		assert isinstance(writer.error, apsw.BusyError)
+		assert [signin for (signin, new_student) in writer.unwritten] == [((self.start + timedelta(0, 60)).isoformat(), 1, 10001)]
+	
+	def test_writer_connection(self):
+		''' The writer commits on its own connection, so rolling back the caller's transaction keeps its rows. '''
+		cur = self.connection.cursor()
+		cur.execute('BEGIN IMMEDIATE')
+		cur.execute("INSERT INTO students VALUES (20000, 'Joe', 'Baker', 'jbaker@wpi.edu', 1, 1)")
+		writer = SigninWriter(self.db, flush_interval=0.01)
+		writer.start()
+		writer.put((self.start.isoformat(), 1, 10000))
+		_time.sleep(0.1)
+		cur.execute('ROLLBACK')
+		writer.stop()
+		assert list(cur.execute('SELECT COUNT(*) FROM signins WHERE event=1'))[0][0] == 1
+		assert list(cur.execute('SELECT COUNT(*) FROM students WHERE id=20000'))[0][0] == 0
+		cur.close()
+	
+	def tearDown(self):
+		unittest.TestCase.tearDown(self)
+		self.connection.close()
+		del self.db
+		shutil.rmtree(self.folder)
+
+class SharedDatabaseTestCase(unittest.TestCase):
+	def setUp(self):
+		unittest.TestCase.setUp(self)
+		self.folder = tempfile.mkdtemp()
+		self.db = AttendanceDB(os.path.join(self.folder, 'gc-attendance.sqlite'))
+	
+	def test_lock(self):
+		''' The second instance gets a read-only connection; a dead holder's lock is broken. '''
+		first = self.db.open_shared()
+		self.db.create_tables(first)
+		second_db = AttendanceDB(self.db.disk_db)
+		second = second_db.open_shared()
+		assert self.db.lock is not None
+		assert second_db.lock is None
+		self.assertRaises(apsw.ReadOnlyError, second.cursor().execute, "INSERT INTO daysoff VALUES ('2011-09-05')")
+		assert DatabaseLock(self.db.disk_db + '.lock').holder()['pid'] == os.getpid()
+		second.close()
+		self.db.close_shared(first)
+		
+		with open(self.db.disk_db + '.lock', 'wb') as f:
+			holder = DatabaseLock.describe_self()
+			holder['pid'] = 2 ** 22 + 1	# Above the Linux PID limit, so never running
+			f.write(json.dumps(holder))
+		connection = self.db.open_shared()
+		assert self.db.lock is not None
+		self.db.close_shared(connection)
+	
+	def test_main_lock(self):
+		''' A second instance is refused; the lock is released when a command fails. '''
+		lock = self.db.disk_db + '.lock'
+		(fd, journal) = tempfile.mkstemp(suffix='.journal', dir=self.folder)
+		os.close(fd)
+		first = self.db.open_shared()
+		assert main(['--db', self.db.disk_db, 'replay', journal]) == 1
+		assert DatabaseLock(lock).holder()['pid'] == os.getpid() and self.db.lock is not None
+		self.db.close_shared(first)
+		
+		self.assertRaises(DatabaseException, main, ['--db', self.db.disk_db, 'compact', 'fall_2099'])
+		assert not os.path.exists(lock)
+		assert main(['--db', self.db.disk_db, 'replay', journal]) is None
+	
+	def test_conflicted_copy(self):
+		''' Rows added in a conflicted copy are merged in; rows changed in both are reported. '''
+		connection = self.db.connect(self.db.disk_db)
+		self.db.create_tables(connection)
+		cur = connection.cursor()
+		cur.executemany('INSERT INTO students VALUES (?,?,?,?,1,1)', [(10000 + i, 'First', 'Last', 'student%d@wpi.edu' % i) for i in range(100)])
+		cur.close()
+		connection.close()
+		copy = os.path.join(self.folder, "gc-attendance (Joe's conflicted copy 2012-01-05).sqlite")
+		shutil.copy(self.db.disk_db, copy)
+		
+		theirs = self.db.connect(copy)
+		cur = theirs.cursor()
+		cur.execute("INSERT INTO students VALUES (42737, 'Joe', 'Baker', 'jbaker@alum.wpi.edu', 1, 1)")
+		cur.execute("UPDATE students SET fname='Changed' WHERE id=10005")
+		cur.close()
+		theirs.close()
+		
+		assert self.db.find_conflicted_copies() == [copy]
+		connection = self.db.connect(self.db.disk_db)
+		summary = self.db.merge_conflicted_copy(copy, connection)
+		assert summary['students'] == (1, [(10005,)])
+		cur = connection.cursor()
+		assert list(cur.execute('SELECT COUNT(*) FROM students'))[0][0] == 101
+		assert list(cur.execute('SELECT fname FROM students WHERE id=10005'))[0][0] == 'First'
+		cur.close()
+		connection.close()
+		assert self.db.find_conflicted_copies() == []
+	
+	def test_conflicted_ids(self):
+		''' Rows both sides inserted under the same ID are renumbered, and their children follow them. '''
+		connection = self.db.connect(self.db.disk_db)
+		self.db.create_tables(connection)
+		cur = connection.cursor()
+		cur.executemany('INSERT INTO students VALUES (?,?,?,?,1,1)', [(10000 + i, 'First', 'Last', 'student%d@wpi.edu' % i) for i in range(2)])
+		cur.execute("INSERT INTO organizations (name) VALUES ('Glee Club')")
+		cur.execute("INSERT INTO terms VALUES ('A11', '2011-08-25', '2011-10-13')")
+		cur.execute("INSERT INTO terms VALUES ('B11', '2011-10-25', '2011-12-15')")
+		cur.execute("INSERT INTO semesters VALUES ('fall_2011', 'A11', 'B11')")
+		cur.execute("INSERT INTO groups VALUES (1, 'Glee Club', 'fall_2011', 'Glee Club Fall 2011', NULL)")
+		cur.close()
+		connection.close()
+		copy = os.path.join(self.folder, "gc-attendance (Joe's conflicted copy 2012-01-05).sqlite")
+		shutil.copy(self.db.disk_db, copy)
+		
+		for (path, group, event, start) in [(self.db.disk_db, 'Tenors', 'Rehearsal', '2011-09-01T18:30:00-04:00'), 
+				(copy, 'Basses', 'Concert', '2011-09-02T19:30:00-04:00')]:
+			other = self.db.connect(path)
+			cur = other.cursor()
+			cur.execute("INSERT INTO groups VALUES (2, 'Glee Club', 'fall_2011', ?, 1)", (group,))
+			cur.execute("INSERT INTO events VALUES (1, ?, NULL, 'Alden', ?, ?, 'rehearsal', 2, 'fall_2011', NULL)", (event, start, start))
+			cur.execute('INSERT INTO group_memberships (student, group_id, credit) VALUES (10000, 2, 1)')
+			cur.execute('INSERT INTO signins VALUES (?, 1, 10001)', (start,))
+			cur.close()
+			other.close()
+		
+		connection = self.db.connect(self.db.disk_db)
+		summary = self.db.merge_conflicted_copy(copy, connection)
+		for table in ('groups', 'group_memberships', 'events', 'signins'):
+			assert summary[table] == (1, []), (table, summary[table])
+		cur = connection.cursor()
+		assert list(cur.execute('SELECT id, eventname FROM events ORDER BY id')) == [(1, 'Rehearsal'), (2, 'Concert')]
+		sql = 'SELECT groups.name, events.eventname FROM events JOIN groups ON events.group_id=groups.id ORDER BY events.id'
+		assert list(cur.execute(sql)) == [('Tenors', 'Rehearsal'), ('Basses', 'Concert')]
+		sql = 'SELECT signins.dt, events.eventname FROM signins JOIN events ON signins.event=events.id ORDER BY signins.dt'
+		assert [row[1] for row in cur.execute(sql)] == ['Rehearsal', 'Concert']
+		sql = 'SELECT groups.name FROM group_memberships JOIN groups ON group_memberships.group_id=groups.id ORDER BY groups.name'
+		assert [row[0] for row in cur.execute(sql)] == ['Basses', 'Tenors']
+		cur.close()
+		connection.close()
+	
+	def tearDown(self):
+		unittest.TestCase.tearDown(self)
+		del self.db
+		shutil.rmtree(self.folder)
+
+class PartitionTestCase(unittest.TestCase):
+	def setUp(self):
+		unittest.TestCase.setUp(self)
+		self.folder = tempfile.mkdtemp()
+		self.db = AttendanceDB(os.path.join(self.folder, 'gc-attendance.sqlite'))
+		self.connection = self.db.open_partitioned('spring_2012')
+		for term in (Term('A11', date(2011, 8, 25), date(2011, 10, 13)), Term('B11', date(2011, 10, 25), date(2011, 12, 15)), 
+				Term('C12', date(2012, 1, 12), date(2012, 3, 2)), Term('D12', date(2012, 3, 12), date(2012, 5, 3))):
+			term.insert(self.connection)
+		cur = self.connection.cursor()
+		cur.execute("INSERT INTO semesters VALUES ('fall_2011', 'A11', 'B11')")
+		cur.execute("INSERT INTO semesters VALUES ('spring_2012', 'C12', 'D12')")
+		cur.close()
+		AcademicCalendar.invalidate(self.connection)
+	
+	def test_routing(self):
+		''' Unqualified writes land in the current semester; reads route by semester, date and ID. '''
+		cur = self.connection.cursor()
+		cur.execute("INSERT INTO events (eventname, start, end, semester) VALUES ('Rehearsal', '2012-01-17T18:30:00-05:00', '2012-01-17T20:30:00-05:00', 'spring_2012')")
+		spring_id = self.connection.last_insert_rowid()
+		fall = SemesterPartitions.tables('events', self.connection, semester='fall_2011')[0]
+		assert fall == 'sem_fall_2011.events'
+		cur.execute("INSERT INTO %s (eventname, start, end, semester) VALUES ('Rehearsal', '2011-09-06T18:30:00-04:00', '2011-09-06T20:30:00-04:00', 'fall_2011')" % fall)
+		fall_id = self.connection.last_insert_rowid()
+		cur.close()
+		assert os.path.exists(os.path.join(self.folder, 'gc-attendance-spring_2012.sqlite'))
+		assert os.path.exists(os.path.join(self.folder, 'gc-attendance-fall_2011.sqlite'))
+		assert spring_id >> SemesterPartitions.ID_BITS == 1
+		assert fall_id >> SemesterPartitions.ID_BITS == 2
+		
+		assert [e.id for e in Event.select_by_semester('fall_2011', self.connection)] == [fall_id]
+		assert [e.id for e in Event.select_by_semester('spring_2012', self.connection)] == [spring_id]
+		assert Event.select_by_id(fall_id, self.connection).id == fall_id
+		events = Event.select_by_datetime_range(datetime(2011, 9, 1, tzinfo=TZ_EST), datetime(2012, 2, 1, tzinfo=TZ_EST), self.connection)
+		assert sorted(e.id for e in events) == [spring_id, fall_id]
+		# Partition IDs are past 32 bits, and survive the columnar export
+		assert list(AttendanceDB.columns('events', self.connection, 'fall_2011')['event']) == [fall_id]
+		
+		# The calendar outbox is a core table, shared by every partition
+		GCalOutbox.enqueue(fall_id, GCalOutbox.OP_INSERT, 'wpigleeclub@gmail.com', {'summary' : 'Rehearsal'}, self.connection)
+		GCalOutbox.enqueue(spring_id, GCalOutbox.OP_INSERT, 'wpigleeclub@gmail.com', {'summary' : 'Rehearsal'}, self.connection)
+		assert GCalOutbox.pending(self.connection) == 2
+		cur = self.connection.cursor()
+		assert list(cur.execute('SELECT COUNT(*) FROM main.gcal_outbox'))[0][0] == 2
+		assert list(cur.execute("SELECT COUNT(*) FROM sem_fall_2011.sqlite_master WHERE name='gcal_outbox'"))[0][0] == 0
+		cur.close()
+	
+	def test_older_semester(self):
+		''' Loading a past semester's export writes to its partition, and unfiltered reads see every partition. '''
+		cur = self.connection.cursor()
+		cur.execute("INSERT INTO organizations VALUES ('Glee Club', 'wpigleeclub@gmail.com')")
+		cur.execute("INSERT INTO groups VALUES (1, 'Glee Club', 'fall_2011', 'Glee Club Fall 2011', NULL)")
+		cur.close()
+		fall = AcademicCalendar.for_connection(self.connection).semester_by_name('fall_2011')
+		assert WeeklyRule(1, time(18, 30), time(20, 30), 1).generate(fall, self.connection)['inserted'] == 15
+		spring = Event(None, 'Rehearsal', None, None, datetime(2012, 1, 17, 18, 30, tzinfo=TZ_EST), datetime(2012, 1, 17, 20, 30, tzinfo=TZ_EST), 
+			Event.TYPE_REHEARSAL, None, None, None)
+		spring.insert(self.connection)
+		assert spring.id >> SemesterPartitions.ID_BITS == 1
+		
+		path = os.path.join(self.folder, 'fall_2011-reader1.csv')
+		with open(path, 'wb') as f:
+			f.write(',9/6/2011,18:27,10000\n,9/6/2011,18:29,10001\n,9/13/2011,18:31,10000\n')
+		assert SigninMerge(self.connection).run([path])['taps'] == 3
+		cur = self.connection.cursor()
+		assert list(cur.execute('SELECT COUNT(*) FROM sem_fall_2011.signins WHERE event IS NOT NULL'))[0][0] == 3
+		assert list(cur.execute('SELECT COUNT(*) FROM sem_spring_2012.signins'))[0][0] == 0
+		
+		fall_event = list(cur.execute('SELECT MIN(id) FROM sem_fall_2011.events'))[0][0]
+		cur.execute("INSERT INTO sem_fall_2011.excuses (dt, event, reason, student) VALUES ('2011-09-06T12:00:00-04:00', ?, 'RBE exam', 10000)", (fall_event,))
+		cur.execute("INSERT INTO sem_spring_2012.excuses (dt, event, reason, student) VALUES ('2012-01-17T12:00:00-05:00', ?, 'RBE lab', 10001)", (spring.id,))
+		cur.close()
+		assert len(EventIndex.select_all(self.connection).event_ids()) == 16
+		assert sorted(match.student for match in Excuse.search('rbe', self.connection)) == [10000, 10001]
+		assert len(Excuse.search('rbe', self.connection, limit=1)) == 1
+	
+	def test_selects(self):
+		''' Lookups by student, name, type, group and calendar ID read every partition; by event, only its own. '''
+		cur = self.connection.cursor()
+		cur.execute("INSERT INTO students VALUES (10000, 'Joe', 'Baker', 'jbaker@wpi.edu', 1, 1)")
+		cur.execute("INSERT INTO organizations VALUES ('Glee Club', 'wpigleeclub@gmail.com')")
+		cur.execute("INSERT INTO groups VALUES (1, 'Glee Club', 'fall_2011', 'Glee Club Fall 2011', NULL)")
+		ids = []
+		for (semester, start) in (('fall_2011', datetime(2011, 9, 6, 18, 30, tzinfo=TZ_EST)), ('spring_2012', datetime(2012, 1, 17, 18, 30, tzinfo=TZ_EST))):
+			names = dict((table, SemesterPartitions.tables(table, self.connection, semester=semester)[0]) for table in ('events', 'signins', 'excuses', 'absences'))
+			cur.execute("INSERT INTO %s (eventname, start, end, eventtype, group_id, semester, gcal_id) VALUES ('Rehearsal', ?, ?, ?, 1, ?, ?)" % names['events'], 
+				(start.isoformat(), (start + timedelta(hours=2)).isoformat(), Event.TYPE_REHEARSAL, semester, 'gcal_' + semester,))
+			event_id = self.connection.last_insert_rowid()
+			ids.append(event_id)
+			cur.execute('INSERT INTO %s VALUES (?,?,10000)' % names['signins'], (start.isoformat(), event_id,))
+			cur.execute("INSERT INTO %s (dt, event, reason, student) VALUES (?, ?, 'RBE exam', 10000)" % names['excuses'], ((start - timedelta(hours=6)).isoformat(), event_id,))
+			excuse_id = self.connection.last_insert_rowid()
+			cur.execute('INSERT INTO %s VALUES (10000, ?, ?, ?)' % names['absences'], (Absence.TYPE_PENDING, event_id, excuse_id,))
+		cur.close()
+		(fall_id, spring_id) = ids
+		
+		assert sorted(e.id for e in Event.select_by_name('Rehearsal', self.connection)) == ids
+		assert sorted(e.id for e in Event.select_by_type(Event.TYPE_REHEARSAL, self.connection)) == ids
+		assert sorted(e.id for e in Event.select_by_group(1, self.connection)) == ids
+		assert [e.id for e in Event.select_by_start(datetime(2011, 9, 6, 18, 30, tzinfo=TZ_EST), self.connection)] == [fall_id]
+		assert Event.select_by_gcal_id('gcal_fall_2011', self.connection).id == fall_id
+		fall = Event.select_by_id(fall_id, self.connection)
+		
+		student = Student.select_by_id(10000, self.connection)
+		assert sorted(s.event.id for s in Signin.select_by_student(student, self.connection)) == ids
+		assert [s.event.id for s in Signin.select_by_event(fall, self.connection)] == [fall_id]
+		assert sorted(x.event.id for x in Excuse.select_by_student(student, self.connection)) == ids
+		excuses = Excuse.select_by_event(fall, self.connection)
+		assert [x.event.id for x in excuses] == [fall_id]
+		assert sorted(a.event.id for a in Absence.select_by_student(student, self.connection)) == ids
+		assert sorted(a.event.id for a in Absence.select_by_type(Absence.TYPE_PENDING, self.connection)) == ids
+		assert [a.event.id for a in Absence.select_by_event(fall, self.connection)] == [fall_id]
+		assert [a.event.id for a in Absence.select_by_excuse(excuses[0].id, self.connection)] == [fall_id]
+	
+	def test_merge(self):
+		''' Merging a replaced ID card re-points its records in every partition. '''
+		cur = self.connection.cursor()
+		cur.execute("INSERT INTO students VALUES (10000, 'Joe', 'Baker', 'jbaker@wpi.edu', 1, 1)")
+		cur.execute("INSERT INTO students VALUES (20000, 'Joe', 'Baker', 'jbaker@wpi.edu', 1, 1)")
+		for (semester, start) in (('fall_2011', '2011-09-06T18:30:00-04:00'), ('spring_2012', '2012-01-17T18:30:00-05:00')):
+			signins = SemesterPartitions.tables('signins', self.connection, semester=semester)[0]
+			absences = SemesterPartitions.tables('absences', self.connection, semester=semester)[0]
+			cur.execute('INSERT INTO %s VALUES (?, NULL, 10000)' % signins, (start,))
+			cur.execute('INSERT INTO %s VALUES (10000, ?, NULL, NULL)' % absences, (Absence.TYPE_UNEXCUSED,))
+		cur.close()
+		Student.merge(Student.select_by_id(10000, self.connection), Student.select_by_id(20000, self.connection), self.connection)
+		cur = self.connection.cursor()
+		for schema in ('sem_fall_2011', 'sem_spring_2012'):
+			for table in ('signins', 'absences'):
+				assert list(cur.execute('SELECT student FROM %s.%s' % (schema, table))) == [(20000,)]
+		assert list(cur.execute('SELECT COUNT(*) FROM students WHERE id=10000'))[0][0] == 0
+		cur.close()
+	
+	def tearDown(self):
+		unittest.TestCase.tearDown(self)
+		self.connection.close()
+		del self.db
+		shutil.rmtree(self.folder)
+
+class RollupTestCase(unittest.TestCase):
+	def setUp(self):
+		unittest.TestCase.setUp(self)
+		self.folder = tempfile.mkdtemp()
+		self.db = AttendanceDB(os.path.join(self.folder, 'gc-attendance.sqlite'))
+		self.connection = self.db.connect(self.db.disk_db)
+		self.db.create_tables(self.connection)
+		Term('A11', date(2011, 8, 25), date(2011, 10, 13)).insert(self.connection)
+		Term('B11', date(2011, 10, 25), date(2011, 12, 15)).insert(self.connection)
+		cur = self.connection.cursor()
+		cur.execute("INSERT INTO semesters VALUES ('fall_2011', 'A11', 'B11')")
+		cur.executemany('INSERT INTO students VALUES (?,?,?,?,1,1)', [(10000 + i, 'First', 'Last', 'student%d@wpi.edu' % i) for i in range(80)])
+		random.seed(36)
+		with self.connection:
+			for week in range(14):
+				start = datetime(2011, 9, 6, 18, 30, tzinfo=TZ_EST) + timedelta(weeks=week)
+				cur.execute("INSERT INTO events (eventname, start, end, semester) VALUES ('Rehearsal', ?, ?, 'fall_2011')", (start.isoformat(), (start + timedelta(hours=2)).isoformat(),))
+				event_id = self.connection.last_insert_rowid()
+				for student in range(10000, 10080):
+					if random.random() < 0.85:
+						dt = start + timedelta(seconds=random.randint(-900, 1800))
+						cur.execute('INSERT INTO signins VALUES (?,?,?)', (dt.isoformat(), event_id, student,))
+					else:
+						absence_type = random.choice([Absence.TYPE_EXCUSED, Absence.TYPE_UNEXCUSED, Absence.TYPE_PENDING])
+						cur.execute('INSERT INTO absences VALUES (?,?,?,NULL)', (student, absence_type, event_id,))
+		cur.close()
+		AcademicCalendar.invalidate(self.connection)
+	
+	def test_rollup(self):
+		''' Standing is unchanged by rolling up and archiving; the archive keeps every signin. '''
+		cur = self.connection.cursor()
+		signins = list(cur.execute('SELECT * FROM signins ORDER BY dt'))
+		pages = list(cur.execute('PRAGMA page_count'))[0][0]
+		before = SemesterRollup.standing('fall_2011', self.connection)
+		assert len(before) == 80
+		assert sum(record.late for record in before.values()) > 0
+		
+		rollup = SemesterRollup('fall_2011', self.connection)
+		assert rollup.run(archive=True) == (14 * 80, len(signins))
+		assert SemesterRollup.is_rolled_up('fall_2011', self.connection)
+		assert list(cur.execute('SELECT COUNT(*) FROM signins'))[0][0] == 0
+		assert list(SemesterRollup.read_archive(rollup.archive_path())) == signins
+		assert list(cur.execute('PRAGMA page_count'))[0][0] < pages
+		cur.close()
+		
+		assert SemesterRollup.standing('fall_2011', self.connection) == before
+		assert SemesterRollup.standing('fall_2011', self.connection, student=10007) == {10007 : before[10007]}
+		student = Student(10007, 'First', 'Last', 'student7@wpi.edu')
+		assert SemesterRollup.standing('fall_2011', self.connection, student=student) == {10007 : before[10007]}
+	
+	def test_rerun(self):
+		''' An archived Semester can't be rolled up again, which would empty its archive. '''
+		rollup = SemesterRollup('fall_2011', self.connection)
+		(outcomes, archived) = rollup.run(archive=True, vacuum=False)
+		assert SemesterRollup.archive_of('fall_2011', self.connection) == rollup.archive_path()
+		self.assertRaises(DatabaseException, rollup.run, archive=True)
+		self.assertRaises(DatabaseException, rollup.run)
+		assert len(list(SemesterRollup.read_archive(rollup.archive_path()))) == archived > 0
+		cur = self.connection.cursor()
+		assert list(cur.execute('SELECT archived FROM rollups'))[0][0] == archived
+		assert list(cur.execute('SELECT COUNT(*) FROM event_outcomes'))[0][0] == outcomes
+		cur.close()
+	
+	def test_failed_archive(self):
+		''' A rollup that fails after writing its archive leaves no archive behind, and a rerun completes. '''
+		rollup = SemesterRollup('fall_2011', self.connection)
+		cur = self.connection.cursor()
+		signins = list(cur.execute('SELECT COUNT(*) FROM signins'))[0][0]
+		write_archive = SemesterRollup.write_archive
+		def broken(self, cur):
+			write_archive(self, cur)
+			raise apsw.IOError('disk I/O error')
+		SemesterRollup.write_archive = broken
+		try:
+			self.assertRaises(apsw.IOError, rollup.run, archive=True, vacuum=False)
+		finally:
+			SemesterRollup.write_archive = write_archive
+		assert not os.path.exists(rollup.archive_path()) and not os.path.exists(rollup.archive_path() + '.part')
+		assert not SemesterRollup.is_rolled_up('fall_2011', self.connection)
+		assert list(cur.execute('SELECT COUNT(*) FROM signins'))[0][0] == signins
+		
+		assert rollup.run(archive=True, vacuum=False)[1] == signins
+		assert len(list(SemesterRollup.read_archive(rollup.archive_path()))) == signins
+		assert list(cur.execute('SELECT COUNT(*) FROM signins'))[0][0] == 0
+		cur.close()
+	
+	def tearDown(self):
+		unittest.TestCase.tearDown(self)
+		self.connection.close()
+		del self.db
+		shutil.rmtree(self.folder)
+
+class ChangeLogTestCase(unittest.TestCase):
+	def setUp(self):
+		unittest.TestCase.setUp(self)
+		self.connection = gcdb.connect(':memory:')
+		gcdb.create_tables(self.connection)
+	
+	def test_cursor(self):
+		''' A cursor returns each change once, survives reopening, and pruning keeps unread changes. '''
+		cur = self.connection.cursor()
+		cur.executemany('INSERT INTO students VALUES (?,?,?,?,1,1)', [(10000 + i, 'First', 'Last', 'student%d@wpi.edu' % i) for i in range(5)])
+		cur.execute("UPDATE students SET id=20000 WHERE id=10004")
+		cur.execute("INSERT INTO signins VALUES ('2011-09-06T18:31:00-04:00', NULL, 10000)")
+		
+		reader = ChangeCursor('test', self.connection)
+		changes = reader.read()
+		assert [(change.table, change.key, change.operation) for change in changes[-3:]] == [
+			('students', [10004], ChangeLog.OP_DELETE), ('students', [20000], ChangeLog.OP_UPDATE), 
+			('signins', ['2011-09-06T18:31:00-04:00', 10000], ChangeLog.OP_INSERT)]
+		assert reader.read() == []
+		reader.commit()
+		
+		cur.execute('DELETE FROM students WHERE id=10001')
+		reader = ChangeCursor('test', self.connection)
+		assert [(change.table, change.key, change.operation) for change in reader.read()] == [('students', [10001], ChangeLog.OP_DELETE)]
+		assert ChangeLog.prune(self.connection) == len(changes)
+		assert len(ChangeLog.changes('changelog', 0, self.connection)) == 1
+		cur.close()
+	
+	def tearDown(self):
+		unittest.TestCase.tearDown(self)
+		self.connection.close()
+
+class ChangeBusTestCase(unittest.TestCase):
+	def setUp(self):
+		unittest.TestCase.setUp(self)
+		self.connection = gcdb.connect(':memory:')
+		gcdb.create_tables(self.connection)
+		self.notifications = []
+	
+	def test_coalesce(self):
+		''' Subscribers get one coalesced notification per committed transaction and none for rollbacks. '''
+		bus = AttendanceDB.bus(self.connection)
+		bus.subscribe(self.notifications.append, tables=['students'])
+		cur = self.connection.cursor()
+		with self.connection:
+			cur.executemany('INSERT INTO students VALUES (?,?,?,?,1,1)', [(10000 + i, 'First', 'Last', 'student%d@wpi.edu' % i) for i in range(3)])
+			cur.execute("UPDATE students SET fname='Joe' WHERE id=10000")
+			cur.execute('DELETE FROM students WHERE id=10001')
+			cur.execute("INSERT INTO daysoff VALUES ('2011-09-05')")
+		assert self.notifications == [{'students' : {10000 : ChangeLog.OP_INSERT, 10002 : ChangeLog.OP_INSERT}}]
+		
+		try:
+			with self.connection:
+				cur.execute('DELETE FROM students')
+				raise ValueError
+		except ValueError:
+			pass
+		cur.execute("UPDATE students SET lname='Baker' WHERE id=10002")
+		assert self.notifications[1:] == [{'students' : {10002 : ChangeLog.OP_UPDATE}}]
+		assert bus.generations['students'] == 2
+		
+		bus.unsubscribe(self.notifications.append)
+		assert not bus.installed
+		cur.execute('DELETE FROM students')
+		assert len(self.notifications) == 2
+		cur.close()
+	
+	def test_savepoints(self):
+		''' Changes rolled back to a savepoint aren't delivered; released savepoints are. '''
+		AttendanceDB.bus(self.connection).subscribe(self.notifications.append, tables=['students'])
+		cur = self.connection.cursor()
+		with AttendanceDB.transaction(self.connection):
+			cur.execute("INSERT INTO students VALUES (10000, 'First', 'Last', 'student0@wpi.edu', 1, 1)")
+			with AttendanceDB.transaction(self.connection):
+				cur.execute("INSERT INTO students VALUES (10001, 'First', 'Last', 'student1@wpi.edu', 1, 1)")
+				try:
+					with AttendanceDB.transaction(self.connection):
+						cur.execute('DELETE FROM students')
+						cur.execute("INSERT INTO students VALUES (10002, 'First', 'Last', 'student2@wpi.edu', 1, 1)")
+						raise ValueError
+				except ValueError:
+					pass
+			try:
+				with AttendanceDB.transaction(self.connection):
+					cur.execute("UPDATE students SET fname='Joe' WHERE id=10001")
+					raise ValueError
+			except ValueError:
+				pass
+		cur.close()
+		assert self.notifications == [{'students' : {10000 : ChangeLog.OP_INSERT, 10001 : ChangeLog.OP_INSERT}}]
+	
+	def tearDown(self):
+		unittest.TestCase.tearDown(self)
+		self.connection.close()
+
+class QueryCacheTestCase(unittest.TestCase):
+	def setUp(self):
+		unittest.TestCase.setUp(self)
+		self.folder = tempfile.mkdtemp()
+		self.db = AttendanceDB(os.path.join(self.folder, 'gc-attendance.sqlite'))
+		self.connection = self.db.connect(self.db.disk_db)
+		self.db.create_tables(self.connection)
+		cur = self.connection.cursor()
+		cur.executemany('INSERT INTO students VALUES (?,?,?,?,1,1)', [(10000 + i, 'First', 'Last', 'student%d@wpi.edu' % i) for i in range(50)])
+		cur.close()
+	
+	def test_invalidation(self):
+		''' Repeated lookups hit; commits on this or another connection invalidate. '''
+		cache = QueryCache.for_connection(self.connection)
+		assert len(Student.select_by_current(True, self.connection)) == 50
+		assert len(Student.select_by_current(True, self.connection)) == 50
+		assert (cache.stats()['hits'], cache.stats()['misses']) == (1, 1)
+		
+		cur = self.connection.cursor()
+		cur.execute("INSERT INTO students VALUES (42737, 'Joe', 'Baker', 'jbaker@alum.wpi.edu', 1, 1)")
+		assert cache.stats()['entries'] == 0
+		assert len(Student.select_by_current(True, self.connection)) == 51
+		with self.connection:
+			cur.execute('DELETE FROM students WHERE id=42737')
+			assert len(Student.select_by_current(True, self.connection)) == 50
+		cur.close()
+		assert len(Student.select_by_current(True, self.connection)) == 50
+		
+		other = self.db.connect(self.db.disk_db)
+		other.cursor().execute("UPDATE students SET current=0 WHERE id=10000")
+		other.close()
+		assert len(Student.select_by_current(True, self.connection)) == 49
+		assert cache.stats()['hits'] == 1
+	
+	def test_eviction(self):
+		''' The least recently used entries go first when over the entry or byte limit. '''
+		cache = QueryCache(self.connection, max_entries=2)
+		build = lambda rows: rows
+		for student in (10000, 10001, 10000, 10002):
+			cache.select('SELECT * FROM students WHERE id=?', (student,), ('students',), build)
+		assert [key[1] for key in cache.entries] == [(10000,), (10002,)]
+		assert cache.stats()['evictions'] == 1
+		cache.max_bytes = cache.bytes - 1
+		cache.select('SELECT * FROM students WHERE id=?', (10003,), ('students',), build)
+		assert cache.bytes <= cache.max_bytes
+	
+	def tearDown(self):
+		unittest.TestCase.tearDown(self)
+		self.connection.close()
+		del self.db
+		shutil.rmtree(self.folder)
+
+class CursorPoolTestCase(unittest.TestCase):
+	def setUp(self):
+		unittest.TestCase.setUp(self)
+		self.connection = gcdb.connect(':memory:')
+		gcdb.create_tables(self.connection)
+	
+	def test_reuse(self):
+		''' Released cursors are reused; one with unread rows is closed instead. '''
+		cur = AttendanceDB.cursor(self.connection)
+		cur.executemany('INSERT INTO students VALUES (?,?,?,?,1,1)', [(10000 + i, 'First', 'Last', 'student%d@wpi.edu' % i) for i in range(3)])
+		AttendanceDB.release(cur)
+		assert AttendanceDB.cursor(self.connection) is cur
+		
+		rows = cur.execute('SELECT * FROM students')
+		next(rows)
+		AttendanceDB.release(cur)
+		assert AttendanceDB.cursor(self.connection) is not cur
+		assert Student.select_by_id(10001, self.connection).fname == 'First'
+	
+	def tearDown(self):
+		unittest.TestCase.tearDown(self)
+		self.connection.close()
+
+class TransactionTestCase(unittest.TestCase):
+	def setUp(self):
+		unittest.TestCase.setUp(self)
+		self.connection = gcdb.connect(':memory:')
+		gcdb.create_tables(self.connection)
+	
+	def count(self, table):
+		return list(self.connection.cursor().execute('SELECT COUNT(*) FROM %s' % table))[0][0]
+	
+	def test_nesting(self):
+		''' A failed inner block rolls back alone; a failed outer block rolls back everything. '''
+		cur = self.connection.cursor()
+		with AttendanceDB.transaction(self.connection):
+			cur.execute("INSERT INTO daysoff VALUES ('2011-09-05')")
+			try:
+				with AttendanceDB.transaction(self.connection):
+					cur.execute("INSERT INTO daysoff VALUES ('2011-10-10')")
+					raise ValueError
+			except ValueError:
+				pass
+			assert not self.connection.getautocommit()
+		assert self.connection.getautocommit()
+		assert self.count('daysoff') == 1
+		
+		try:
+			with AttendanceDB.transaction(self.connection):
+				cur.execute("INSERT INTO daysoff VALUES ('2011-11-24')")
+				with self.connection:
+					cur.execute("INSERT INTO daysoff VALUES ('2011-11-25')")
+				raise ValueError
+		except ValueError:
+			pass
+		assert self.count('daysoff') == 1
+		
+		with AttendanceDB.batch(self.connection, size=10) as batch:
+			for i in range(25):
+				cur.execute('INSERT INTO students VALUES (?,NULL,NULL,NULL,1,1)', (10000 + i,))
+				batch.tick()
+			assert self.count('changelog') > 0
+		assert self.count('students') == 25
+		cur.close()
+	
+	def test_absences(self):
+		''' Members without a signin get an Absence, Pending if they sent an Excuse. '''
+		cur = self.connection.cursor()
+		cur.executemany('INSERT INTO students VALUES (?,?,?,?,1,1)', [(10000 + i, 'First', 'Last', 'student%d@wpi.edu' % i) for i in range(3)])
+		cur.execute("INSERT INTO terms VALUES ('A11', '2011-08-25', '2011-10-13')")
+		cur.execute("INSERT INTO terms VALUES ('B11', '2011-10-25', '2011-12-15')")
+		cur.execute("INSERT INTO semesters VALUES ('fall_2011', 'A11', 'B11')")
+		cur.execute("INSERT INTO groups VALUES (1, NULL, 'fall_2011', 'Glee Club Fall 2011', NULL)")
+		group = Group(1, None, None, 'Glee Club Fall 2011')
+		group.apply_roster([(10000 + i, 'First', 'Last', 'student%d@wpi.edu' % i, True) for i in range(3)], self.connection)
+		cur.execute("INSERT INTO events (id, eventname, start, end, group_id, semester) VALUES (7, 'Rehearsal', '2011-09-06T18:30:00-04:00', '2011-09-06T20:30:00-04:00', 1, 'fall_2011')")
+		cur.execute("INSERT INTO signins VALUES ('2011-09-06T18:29:00-04:00', 7, 10000)")
+		cur.execute("INSERT INTO excuses (dt, event, reason, student) VALUES ('2011-09-06T12:00:00-04:00', 7, 'Sick', 10001)")
+		event = Event(7, 'Rehearsal', None, None, None, None, Event.TYPE_REHEARSAL, group, None, None)
+		assert Absence.generate([event], self.connection) == 2
+		assert Absence.generate([event], self.connection) == 0
+		assert sorted(cur.execute('SELECT student, type FROM absences')) == [(10001, Absence.TYPE_PENDING), (10002, Absence.TYPE_UNEXCUSED)]
+		cur.close()
+	
+	def tearDown(self):
+		unittest.TestCase.tearDown(self)
+		self.connection.close()
+
+class StartupTestCase(unittest.TestCase):
+	def test_lazy_imports(self):
+		''' Importing the module loads neither the Google client nor dateutil.parser, nor opens a DB. '''
+		code = 'import sys, gc_attendance; print " ".join(sorted(sys.modules)); print gc_attendance.gcdb._memory'
+		output = subprocess.check_output([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__))).split('\n')
+		loaded = output[0].split()
+		for module in ['httplib2', 'apiclient', 'oauth2client', 'dateutil.parser']:
+			assert module not in loaded, module
+		assert output[1] == 'None'
+	
+	def test_sqlite_version(self):
+		''' Connecting refuses an SQLite too old for the upserts. '''
+		gcdb.connect(':memory:').close()
+		minimum = AttendanceDB.MIN_SQLITE_VERSION
+		AttendanceDB.MIN_SQLITE_VERSION = (99, 0, 0)
+		try:
+			self.assertRaises(DatabaseException, gcdb.connect, ':memory:')
+		finally:
+			AttendanceDB.MIN_SQLITE_VERSION = minimum
+	
+	def test_parse(self):
+		''' The lazy parse() replaces itself with dateutil's. '''
+		import gc_attendance
+		assert parse('2011-09-06T18:30:00-04:00').utcoffset() == timedelta(hours=-4)
+		from dateutil.parser import parse as dateutil_parse
+		assert gc_attendance.parse is dateutil_parse
+	
+	def test_timezone(self):
+		''' TZ_EST keeps the offsets of the POSIX string it replaced, hour by hour through 2011. '''
+		from dateutil.tz import tzstr
+		posix = tzstr('EST+05EDT,M4.1.0,M10.5.0')
+		for hour in range(365 * 24):
+			dt = datetime(2011, 1, 1) + timedelta(hours=hour)
+			assert dt.replace(tzinfo=TZ_EST).utcoffset() == dt.replace(tzinfo=posix).utcoffset(), dt
+
+class DatasetTestCase(unittest.TestCase):
+	def setUp(self):
+		unittest.TestCase.setUp(self)
+		self.folder = tempfile.mkdtemp()
+		self.dataset = datagen.Dataset(seed=7, years=2, organizations=3, students_per_year=30, group_size=20)
+	
+	def test_deterministic(self):
+		''' The same seed gives the same data; a different one doesn't. '''
+		again = datagen.Dataset(seed=7, years=2, organizations=3, students_per_year=30, group_size=20)
+		assert again.taps == self.dataset.taps
+		assert again.excuses == self.dataset.excuses
+		assert datagen.Dataset(seed=8, years=2, organizations=3, students_per_year=30, group_size=20).taps != self.dataset.taps
+	
+	def test_outputs(self):
+		''' The DB, RFID exports and rosters all carry the generated rows. '''
+		connection = gcdb.connect(':memory:')
+		gcdb.create_tables(connection)
+		counts = self.dataset.write_db(connection)
+		cur = connection.cursor()
+		assert list(cur.execute('SELECT COUNT(*) FROM events'))[0][0] == len(self.dataset.events) == counts['events']
+		signins = list(cur.execute('SELECT COUNT(*) FROM signins'))[0][0]
+		assert 0 < signins < len(self.dataset.taps)
+		assert list(cur.execute('SELECT COUNT(*) FROM students WHERE fname IS NULL'))[0][0] > 0	# Unknown cards
+		cur.close()
+		connection.close()
+		
+		exports = self.dataset.write_rfid_exports(self.folder)
+		assert sorted(exports) == ['fall_2011', 'fall_2012', 'spring_2012', 'spring_2013']
+		taps = sum(len(list(read_rfid_export(path))) for paths in exports.values() for path in paths)
+		assert taps == len(self.dataset.taps)
+		rosters = self.dataset.write_rosters(self.folder)
+		assert len(rosters) == len(self.dataset.groups)
+		assert 'xl/sharedStrings.xml' in zipfile.ZipFile(rosters[1]).namelist()
+	
+	def tearDown(self):
+		unittest.TestCase.tearDown(self)
+		shutil.rmtree(self.folder)
+
+class ProfilerTestCase(unittest.TestCase):
+	def setUp(self):
+		unittest.TestCase.setUp(self)
+		self.connection = gcdb.connect(':memory:')
+		gcdb.create_tables(self.connection)
+		self.dataset = datagen.Dataset(seed=7, years=1, organizations=2, students_per_year=30, group_size=20)
+		self.dataset.write_db(self.connection, signins=False)	# Everyone is absent
+		semester = self.dataset.semesters[0][0]
+		Absence.generate(Event.select_by_semester(semester, self.connection), self.connection)
+		cur = self.connection.cursor()
+		rfid = list(cur.execute('SELECT student FROM absences GROUP BY student ORDER BY COUNT(*) DESC LIMIT 1'))[0][0]
+		cur.close()
+		self.student = Student.select_by_id(rfid, self.connection)
+	
+	def test_attribution(self):
+		''' Statements are attributed to the model method that ran them, under their callers. '''
+		with AttendanceDB.profile(self.connection) as profiler:
+			absences = Absence.select_by_student(self.student, self.connection)
+		stats = dict((s.caller, s) for s in profiler.statements())
+		assert stats['Absence.select_by_student'].calls == 1
+		assert stats['Absence.select_by_student'].rows == len(absences) >= QueryProfiler.N_PLUS_ONE
+		assert stats['Student.select_by_id'].calls == len(absences)
+		assert 'Top statements by count' in profiler.report()
+		folded = profiler.folded().split('\n')
+		assert any(line.startswith('<test_attribution>;Absence.select_by_student;Absence.new_from_row;Student.select_by_id;') for line in folded)
+		
+		# The tracers are gone once the block ends
+		before = profiler.statements('count')
+		Student.select_by_id(self.student.rfid, self.connection)
+		assert profiler.statements('count') == before
+	
+	def test_n_plus_one(self):
+		''' Per-row lookups inside one call are flagged; the same lookups from separate calls aren't. '''
+		with AttendanceDB.profile(self.connection) as profiler:
+			Absence.select_by_student(self.student, self.connection)
+		flagged = [(n.outer, n.caller) for n in profiler.n_plus_ones()]
+		assert ('Absence.select_by_student', 'Student.select_by_id') in flagged
+		assert ('Absence.select_by_student', 'Absence.select_by_student') not in flagged
+		
+		with AttendanceDB.profile(self.connection) as profiler:
+			for i in range(QueryProfiler.N_PLUS_ONE):
+				self.lookup()
+		assert profiler.n_plus_ones() == []
+	
+	def lookup(self):
+		Student.select_by_id(self.student.rfid, self.connection)
+	
+	def tearDown(self):
+		unittest.TestCase.tearDown(self)
+		self.connection.close()
+
+class ModelMemoryTestCase(unittest.TestCase):
+	def test_slots(self):
+		''' Model objects have no __dict__ and create their relation lists on first use. '''
+		student = Student(12345, 'First', 'Last', 'flast@wpi.edu')
+		assert not hasattr(student, '__dict__')
+		assert student._signins is None
+		student.signins.append('signin')
+		assert student.signins == ['signin']
+		self.assertRaises(AttributeError, setattr, student, 'nickname', 'Flast')
+		group = Group(1, None, None, 'Glee Club Fall 2011', students=[student])
+		assert group.members == [student]
+		assert Organization('Glee Club', 'wpigleeclub@gmail.com').calendar == {'id' : 'wpigleeclub@gmail.com'}
+	
+	def test_report(self):
+		''' The memory report counts every object a semester load hydrates. '''
+		connection = gcdb.connect(':memory:')
+		gcdb.create_tables(connection)
+		dataset = datagen.Dataset(seed=7, years=1, organizations=2, students_per_year=30, group_size=20)
+		dataset.write_db(connection)
+		semester = dataset.semesters[0][0]
+		report = benchmarks.memory_report(semester, connection)
+		events = len([row for row in dataset.events if row[8] == semester])
+		assert report['classes']['Event']['objects'] >= events
+		assert report['classes']['Signin']['objects'] > 0
+		assert report['classes']['Student']['bytes_per_object'] < sys.getsizeof({})
+		assert report['total_bytes'] > 0
+		connection.close()
+
+class ColumnExportTestCase(unittest.TestCase):
+	def setUp(self):
+		unittest.TestCase.setUp(self)
+		self.connection = gcdb.connect(':memory:')
+		gcdb.create_tables(self.connection)
+		self.dataset = datagen.Dataset(seed=7, years=1, organizations=2, students_per_year=30, group_size=20)
+		self.dataset.write_db(self.connection)
+		self.semester = self.dataset.semesters[1][0]
+	
+	def test_semester(self):
+		''' A Semester's columns match its model objects. '''
+		events = Event.select_by_semester(self.semester, self.connection)
+		columns = AttendanceDB.columns('events', self.connection, self.semester)
+		assert list(columns['event']) == sorted(event.id for event in events)
+		assert columns['type'].typecode == 'b'
+		assert [ColumnExport.CATEGORIES[('events', 'type')][code] for code in columns['type']] == [event.event_type for event in sorted(events, key=lambda e: e.id)]
+		
+		signins = AttendanceDB.columns('signins', self.connection, self.semester)
+		expected = sorted((s.student.rfid, s.event.id) for event in events for s in Signin.select_by_event(event, self.connection))
+		assert sorted(zip(signins['student'], signins['event'])) == expected
+		memberships = AttendanceDB.columns('group_memberships', self.connection, self.semester)
+		assert set(memberships['group']) == set(event.group.id for event in events)
+	
+	def test_range(self):
+		''' A datetime range picks the rows by their own time or their Event's start. '''
+		start = datetime(self.dataset.first_year + 1, 1, 1, tzinfo=TZ_EST)
+		end = datetime(self.dataset.first_year + 1, 12, 31, tzinfo=TZ_EST)
+		events = AttendanceDB.columns('events', self.connection, start=start, end=end)
+		assert len(events['event']) == len([row for row in self.dataset.events if row[8] == self.semester])
+		assert min(events['start']) >= epoch(start)
+		Absence.generate(Event.select_by_semester(self.dataset.semesters[0][0], self.connection), self.connection)
+		Absence.generate(Event.select_by_semester(self.semester, self.connection), self.connection)
+		absences = AttendanceDB.columns('absences', self.connection, start=start, end=end)
+		assert len(absences['event']) > 0
+		assert set(absences['event']) <= set(events['event'])
+		self.assertRaises(DatabaseException, AttendanceDB.columns, 'students', self.connection)
+	
+	def tearDown(self):
+		unittest.TestCase.tearDown(self)
+		self.connection.close()
+
+class RosterImportTestCase(unittest.TestCase):
+	def setUp(self):
+		unittest.TestCase.setUp(self)
+		self.folder = tempfile.mkdtemp()
+		self.connection = gcdb.connect(':memory:')
+		gcdb.create_tables(self.connection)
+		cur = self.connection.cursor()
+		cur.execute("INSERT INTO terms VALUES ('A11', '2011-08-25', '2011-10-13')")
+		cur.execute("INSERT INTO terms VALUES ('B11', '2011-10-25', '2011-12-15')")
+		cur.execute("INSERT INTO semesters VALUES ('fall_2011', 'A11', 'B11')")
+		cur.execute("INSERT INTO groups VALUES (1, NULL, 'fall_2011', 'Glee Club Fall 2011', NULL)")
+		cur.execute("INSERT INTO groups VALUES (2, NULL, 'fall_2011', 'Alden Voices Fall 2011', NULL)")
+		cur.execute('INSERT INTO students VALUES (10009, NULL, NULL, NULL, 1, 1)')	# An unknown card from a signin
+		cur.close()
+		self.groups = {'Glee Club' : Group(1, None, None, 'Glee Club Fall 2011'), 'Alden Voices' : Group(2, None, None, 'Alden Voices Fall 2011')}
+	
+	def workbook(self, glee_club, alden_voices):
+		path = os.path.join(self.folder, 'roster.xlsx')
+		datagen.write_workbook(path, [('Glee Club', [datagen.ROSTER_HEADER] + glee_club), ('Alden Voices', [datagen.ROSTER_HEADER] + alden_voices)])
+		return path
+	
+	def members(self, group_id):
+		cur = self.connection.cursor()
+		rows = sorted(cur.execute('SELECT student, credit FROM group_memberships WHERE group_id=?', (group_id,)))
+		cur.close()
+		return rows
+	
+	def test_diff(self):
+		''' A multi-sheet roster is diffed against the DB and only the changes are applied. '''
+		glee_club = [[str(10000 + i), 'First', 'Last', 'student%d@wpi.edu' % i, 'N', 'Y', 'N'] for i in range(10)]
+		alden_voices = [['10020', 'Alto', 'One', 'alto@wpi.edu', 'N', 'N', 'N']]
+		diffs = Group.read_gc_rosters(self.workbook(glee_club, alden_voices), self.groups, self.connection)
+		assert len(diffs['Glee Club'].added) == 10 and diffs['Glee Club'].removed == []
+		assert diffs['Glee Club'].created == [10000 + i for i in range(9)]	# 10009 was already a Student
+		assert diffs['Glee Club'].changed == [10009]
+		assert self.members(2) == [(10020, 0)]
+		
+		glee_club[3][3] = 'new@wpi.edu'
+		glee_club[4][5] = 'N'
+		del glee_club[5]
+		diff = self.groups['Glee Club'].read_gc_roster(self.workbook(glee_club, alden_voices), self.connection, 'Glee Club')
+		assert diff == RosterDiff(added=[], removed=[10005], changed=[10003], credit_changed=[10004], created=[])
+		assert Student.select_by_id(10003, self.connection).email == 'new@wpi.edu'
+		assert (10004, 0) in self.members(1) and 10005 not in [rfid for (rfid, credit) in self.members(1)]
+		assert self.groups['Alden Voices'].apply_roster(Group.parse_gc_roster(read_xlsx_rows(self.workbook(glee_club, alden_voices), 'Alden Voices')), 
+			self.connection) == RosterDiff([], [], [], [], [])
+	
+	def test_bad_credit(self):
+		''' An unreadable credit column rolls the whole import back. '''
+		path = self.workbook([['10000', 'First', 'Last', 'a@wpi.edu', 'N', 'Y', 'N']], [['10001', 'First', 'Last', 'b@wpi.edu', 'N', '?', 'N']])
+		self.assertRaises(RosterException, Group.read_gc_rosters, path, self.groups, self.connection)
+		assert self.members(1) == [] and self.members(2) == []
+	
+	def tearDown(self):
+		unittest.TestCase.tearDown(self)
+		self.connection.close()
+		shutil.rmtree(self.folder)
+
+class BackfillTestCase(unittest.TestCase):
+	def setUp(self):
+		unittest.TestCase.setUp(self)
+		self.folder = tempfile.mkdtemp()
+		self.connection = gcdb.connect(os.path.join(self.folder, 'backfill.sqlite'))
+		gcdb.create_tables(self.connection)
+		self.dataset = datagen.Dataset(seed=7, years=1, organizations=2, students_per_year=30, group_size=20)
+		self.dataset.write_db(self.connection, signins=False)
+		archive = os.path.join(self.folder, 'archive')
+		os.mkdir(archive)
+		self.exports = self.dataset.write_rfid_exports(archive)
+		self.rosters = self.dataset.write_rosters(archive)
+		self.archive = archive
+	
+	def count(self):
+		cur = self.connection.cursor()
+		count = list(cur.execute('SELECT COUNT(*) FROM signins'))[0][0]
+		cur.close()
+		return count
+	
+	def test_backfill(self):
+		''' Every file is loaded once; a rerun only loads files changed since. '''
+		result = Backfill(self.connection, processes=2).run(self.archive)
+		assert result['errors'] == []
+		assert result['rosters'] == len(self.rosters)
+		assert result['exports'] == sum(len(paths) for paths in self.exports.values())
+		assert result['taps'] == self.count() > 0
+		
+		# The same rows as merging each semester's exports directly
+		other = gcdb.connect(':memory:')
+		gcdb.create_tables(other)
+		self.dataset.write_db(other, signins=False)
+		for paths in self.exports.values():
+			SigninMerge(other).run(paths)
+		sql = 'SELECT * FROM signins ORDER BY dt, student'
+		assert list(self.connection.cursor().execute(sql)) == list(other.cursor().execute(sql))
+		other.close()
+		signins = self.count()
+		
+		result = Backfill(self.connection, processes=2).run(self.archive)
+		assert result['skipped'] == result['files'] and result['taps'] == 0
+		path = self.exports.values()[0][0]
+		os.utime(path, (0, 0))
+		result = Backfill(self.connection, processes=2).run(self.archive)
+		assert result['skipped'] == result['files'] - 1 and result['exports'] == 1
+		assert self.count() == signins
+	
+	def test_archive_rosters(self):
+		''' Old rosters add memberships without touching existing Students or their memberships. '''
+		cur = self.connection.cursor()
+		cur.execute("UPDATE students SET current=0, fname='Renamed'")
+		cur.execute('DELETE FROM group_memberships WHERE id IN (SELECT MIN(id) FROM group_memberships GROUP BY group_id)')
+		memberships = list(cur.execute('SELECT COUNT(*) FROM group_memberships'))[0][0]
+		cur.execute('DELETE FROM students WHERE id = (SELECT MAX(student) FROM group_memberships)')
+		cur.close()
+		result = Backfill(self.connection, processes=1).run(self.archive)
+		assert result['errors'] == [] and result['rosters'] == len(self.rosters)
+		cur = self.connection.cursor()
+		assert list(cur.execute('SELECT COUNT(*) FROM students WHERE current=1'))[0][0] == 0
+		assert list(cur.execute("SELECT COUNT(*) FROM students WHERE fname IS NOT 'Renamed'"))[0][0] == 1
+		assert list(cur.execute('SELECT COUNT(*) FROM group_memberships'))[0][0] > memberships
+		cur.close()
+	
+	def test_roster_group(self):
+		''' Rosters go to the Group named in the file name, told apart by semester when names collide. '''
+		groups = {('alden_voices', 'fall_2011') : 1, ('alden_voices', 'spring_2012') : 2, ('glee_club', 'fall_2011') : 3}
+		assert Backfill.roster_group('roster-Alden Voices-spring_2012.xlsx', groups) == (2, None)
+		assert Backfill.roster_group('roster-glee_club.xlsx', groups) == (3, None)
+		assert Backfill.roster_group('roster-alden_voices.xlsx', groups)[0] is None
+		assert Backfill.roster_group('roster-shm.xlsx', groups)[0] is None
+	
+	def test_errors(self):
+		''' Unreadable files are reported and not checkpointed. '''
+		with open(os.path.join(self.archive, 'broken.csv'), 'wb') as f:
+			f.write(',not a date,,\n')
+		result = Backfill(self.connection, processes=1).run(self.archive)
+		assert [os.path.basename(path) for (path, error) in result['errors']] == ['broken.csv']
+		assert Backfill(self.connection, processes=1).pending(Backfill.discover(self.archive)) == [os.path.join(self.archive, 'broken.csv')]
+	
+	def tearDown(self):
+		unittest.TestCase.tearDown(self)
+		self.connection.close()
+		shutil.rmtree(self.folder)
+
+class RfidTimestampsTestCase(unittest.TestCase):
+	def setUp(self):
+		unittest.TestCase.setUp(self)
+		self.folder = tempfile.mkdtemp()
+	
+	def reference(self, day, minute):
+		dt = datetime(day.year, day.month, day.day, minute // 60, minute % 60, tzinfo=TIMEZONES['EST'])
+		return (epoch(dt), dt.isoformat())
+	
+	def test_every_minute(self):
+		''' Every minute of the DST changeover days, and an ordinary day, decodes as the datetime path does. '''
+		timestamps = RfidTimestamps()
+		days = [date(2011, 1, 1) + timedelta(days=i) for i in range(365)]
+		changes = [day for day in days if self.reference(day, 0)[1][-6:] != self.reference(day, 1439)[1][-6:]]
+		assert len(changes) == 2
+		for day in changes + [date(2011, 9, 1)]:
+			for minute in range(1440):
+				decoded = timestamps.decode('%d/%d/%d' % (day.month, day.day, day.year), '%d:%02d' % (minute // 60, minute % 60))
+				assert decoded == self.reference(day, minute), (day, minute, decoded)
+		assert len(timestamps.days) == 3 and len(timestamps.times) == 1440
+	
+	def test_read_export(self):
+		''' read_rfid_timestamps() agrees with read_rfid_export() row for row. '''
+		path = os.path.join(self.folder, 'export.csv')
+		with open(path, 'wb') as f:
+			for (day, time, rfid) in [('4/3/2011', '1:59', 10000), ('4/3/2011', '3:00', 10001), ('10/30/2011', '1:30', 10002), 
+					('09/01/2011', '18:30', 10003), ('12/31/2011', '23:59', 10004)]:
+				f.write(',%s,%s,%d\n' % (day, time, rfid))
+		expected = [(epoch(dt), dt.isoformat(), rfid) for (dt, rfid) in read_rfid_export(path)]
+		assert list(read_rfid_timestamps(path)) == expected
+	
+	def tearDown(self):
+		unittest.TestCase.tearDown(self)
+		shutil.rmtree(self.folder)
+
+class BenchmarkSuiteTestCase(unittest.TestCase):
+	def setUp(self):
+		unittest.TestCase.setUp(self)
+		self.folder = tempfile.mkdtemp()
+	
+	def test_suite_size(self):
+		''' Every workflow reports its items, latencies and queries. '''
+		dataset = datagen.Dataset(seed=7, years=1, organizations=3, students_per_year=30, group_size=20)
+		results = benchmarks.suite_size(dataset, self.folder)
+		assert [r['workflow'] for r in results] == ['read_gc_roster', 'read_attendance', 'assign_signins', 
+			'generate_absences', 'standing', 'make_json']
+		for result in results:
+			assert result['items'] > 0 and result['queries'] > 0, result
+			assert result['latency_ms']['p50'] <= result['latency_ms']['p99'] <= result['latency_ms']['max']
+		assert results[1]['items'] == len(dataset.taps)
+		json.dumps(results)
+	
+	def test_compare(self):
+		''' Slower or chattier workflows are flagged against the baseline. '''
+		def run(throughput, queries):
+			return {'results' : [{'workflow' : 'standing', 'dataset' : {'years' : 1}, 'throughput' : throughput, 'queries' : queries}]}
+		assert benchmarks.compare(run(95, 10), run(100, 10)) == []
+		assert len(benchmarks.compare(run(50, 10), run(100, 10))) == 1
+		assert len(benchmarks.compare(run(100, 11), run(100, 10))) == 1
+	
+	def tearDown(self):
+		unittest.TestCase.tearDown(self)
+		shutil.rmtree(self.folder)
+
 if __name__ == '__main__':
 	unittest.main()	